@@ -0,0 +1,137 @@
+# Benchmark of SWAT_LC on synthetic projects
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import numpy as np
+import pandas as pd
+import synthetic
+import kernel
+from main import Simulation
+from resultreader import LCreader
+
+
+# model sizes of the benchmark: number of sub-basins, HRUs per sub-basin, PACs (DOC not included), years
+SCALES = {"small": {"nsub": 5, "nhru": 4, "npoll": 2, "nyears": 2},
+          "medium": {"nsub": 20, "nhru": 10, "npoll": 3, "nyears": 5},
+          "large": {"nsub": 100, "nhru": 20, "npoll": 4, "nyears": 10}}
+POLLUTANTS = ["Chrysene", "Napthalene", "Phenanthrene", "Pyrene", "Fluorene", "Anthracene", "Benzo(a)pyrene"]
+
+
+def project(workdir, scale, seed=0):
+    """
+    Generate the synthetic project of a scale (once, reused by the following benchmarks).
+    :param workdir: folder of the benchmark projects
+    :param scale: name of the scale in SCALES
+    :return: (SWAT folder, SWAT_LC folder)
+    """
+    size = SCALES[scale]
+    rootdir = os.path.join(workdir, "{}_{}".format(scale, seed))
+    if os.path.exists(os.path.join(rootdir, "LC", "lcproj.sim")):
+        return os.path.join(rootdir, "TxtInOut"), os.path.join(rootdir, "LC")
+    print("Generating the {} synthetic project...".format(scale))
+    return synthetic.generate_project(rootdir, nsub=size["nsub"], nhru=size["nhru"],
+                                      pollutants=POLLUTANTS[:size["npoll"]], nyears=size["nyears"], seed=seed)
+
+
+def _timed(records, scale, phase, fn, units=None):
+    t = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - t
+    records.append({"scale": scale, "phase": phase, "seconds": seconds, "units": units,
+                    "rate": units / seconds if units and seconds > 0 else None})
+    return value
+
+
+def run_benchmark(workdir, scales=("small", "medium"), engines=("python", "jit"), repeat=1):
+    """
+    Time the project loading (PROJmanager), the simulation (Simulation.run, text outputs) and the result reading
+    and post-processing (LCreader, postprocessing.subout_summary) of synthetic projects.
+    :param workdir: folder of the benchmark projects
+    :param scales: names of the scales in SCALES
+    :param engines: simulation engines (ENGINE), jit is skipped if Numba is not installed
+    :param repeat: number of repetitions of each benchmark, the fastest one is kept
+    :return: {"info": environment of the benchmark, "results": list of {"scale", "phase", "seconds", "units", "rate"}}
+             the units are HRU-days for the simulation and rows for the reading
+    """
+    import postprocessing
+    records = []
+    for scale in scales:
+        swatdir, lcdir = project(workdir, scale)
+        for r in range(repeat):
+            sim = _timed(records, scale, "load", lambda: Simulation(swatdir, lcdir))
+            sim.mdl_struct.screenshow = 0
+            hrudays = len(sim.dateseries) * sum(len(s.hrulist) for s in sim.mdl_struct.sublist)
+            for engine in engines:
+                if engine == "jit" and not kernel.available():
+                    continue
+                sim.mdl_struct.engine = engine
+                if engine == "jit":
+                    sim.run(output="numpy")  # compile the kernel before timing
+                _timed(records, scale, "run_" + engine, sim.run, hrudays)
+            layout = sim.output_layout()
+            nrows = len(layout.dates) * len(layout.hrus) * len(layout.pollutants)   # rows of lcproj.hruout
+            _timed(records, scale, "read_hruout", lambda: LCreader(sim.outhrupath, typed=True, useindex=False),
+                   nrows)
+            _timed(records, scale, "subout_summary", lambda: postprocessing.subout_summary(sim.outsubpath))
+    df = pd.DataFrame(records)
+    df = df.loc[df.groupby(["scale", "phase"], sort=False)["seconds"].idxmin()]
+    info = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "numba": kernel.available(), "repeat": repeat}
+    return {"info": info, "results": df.replace({np.nan: None}).to_dict("records")}
+
+
+def save(bench, path):
+    with open(path, "w") as f:
+        json.dump(bench, f, indent=1)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(bench, baseline, tolerance=0.2):
+    """
+    Compare the benchmark with a baseline (e.g. the results of the previous version).
+    :param bench: results of run_benchmark (or the path of the saved results)
+    :param baseline: baseline results (or the path of the saved results)
+    :param tolerance: relative slowdown flagged as a regression
+    :return: DataFrame of the phases in both results: seconds, baseline seconds, ratio and regression flag
+    """
+    bench = load(bench) if isinstance(bench, str) else bench
+    baseline = load(baseline) if isinstance(baseline, str) else baseline
+    cur = pd.DataFrame(bench["results"]).set_index(["scale", "phase"])["seconds"]
+    base = pd.DataFrame(baseline["results"]).set_index(["scale", "phase"])["seconds"]
+    df = pd.DataFrame({"seconds": cur, "baseline": base}).dropna()
+    df["ratio"] = df["seconds"] / df["baseline"]
+    df["regression"] = df["ratio"] > 1 + tolerance
+    return df
+
+
+def report(bench):
+    """
+    :return: text table of the benchmark results
+    """
+    df = pd.DataFrame(bench["results"])
+    lines = ["SWAT_LC benchmark {} (Python {}, NumPy {}, Numba: {})".format(
+        bench["info"]["date"], bench["info"]["python"], bench["info"]["numpy"], bench["info"]["numba"])]
+    for r in df.itertuples():
+        rate = "" if r.rate is None or pd.isna(r.rate) else "{:>14,.0f} /s".format(r.rate)
+        lines.append("{:<8} {:<16} {:>10.3f} s {}".format(r.scale, r.phase, r.seconds, rate))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python benchmark.py WORKDIR [SCALES (comma separated)] [BASELINE.json]
+    # the results are saved to WORKDIR/benchmark.json and compared with the baseline if given
+    workdir = sys.argv[1]
+    scales = sys.argv[2].split(",") if len(sys.argv) > 2 else ["small", "medium"]
+    bench = run_benchmark(workdir, scales)
+    print(report(bench))
+    save(bench, os.path.join(workdir, "benchmark.json"))
+    if len(sys.argv) > 3:
+        print(compare(bench, sys.argv[3]).to_string())
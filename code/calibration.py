@@ -0,0 +1,228 @@
+# Calibration of the SWAT_LC parameters against observed sub-basin loads
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from main import Simulation
+from objective import ObjectiveSink
+from runcache import RunCache
+
+
+# calibrated parameters: .lu build-up/wash-off, .plt half-lives/partitioning, .ocp outcrop erosion
+LUPARAMS = ["bmax", "kbu", "nbu", "kwov", "nwov", "kwoh", "nwoh"]
+PLTPARAMS = ["hlw", "hls", "logkoc", "logkdoc"]
+OCPPARAMS = ["COCP", "KOCP", "NOCP", "QWCR", "EA", "T0"]
+OCPATTRS = {"COCP": "cocp", "KOCP": "kocp", "NOCP": "nocp", "QWCR": "qwcr", "EA": "ea", "T0": "t0"}
+
+
+class Parameter:
+
+    def __init__(self, kind, name, pollutant, low, high, target=None, method="v"):
+        """
+        A calibrated parameter.
+        :param kind: "lu" (land use, .lu), "plt" (pollutant, .plt) or "ocp" (outcrop erosion, .ocp)
+        :param name: parameter name (column of the parameter file), see LUPARAMS, PLTPARAMS, OCPPARAMS
+        :param pollutant: pollutant name
+        :param low: lower bound of the sampled value
+        :param high: upper bound of the sampled value
+        :param target: land use name (lu) or reach id (ocp), None -> all land uses/reaches
+        :param method: "v": the value replaces the parameter, "r": relative change, parameter * (1 + value)
+        """
+        valid = {"lu": LUPARAMS, "plt": PLTPARAMS, "ocp": OCPPARAMS}
+        if kind not in valid or name not in valid[kind]:
+            raise ValueError("Unknown parameter: {} {}.".format(kind, name))
+        if method not in ("v", "r"):
+            raise ValueError("The method of a parameter should be v (replace) or r (relative change).")
+        self.kind = kind
+        self.name = name
+        self.pollutant = pollutant
+        self.low = low
+        self.high = high
+        self.target = target
+        self.method = method
+        self.base = None    # [(object, original value)] of the bound project
+
+    def __repr__(self):
+        target = "" if self.target is None else "@{}".format(self.target)
+        return f"{self.method}__{self.kind}.{self.name}.{self.pollutant}{target}"
+
+    def bind(self, mdl):
+        """
+        Find the parameter in a loaded project (PROJmanager) and keep the original values.
+        """
+        self.base = []
+        if self.kind == "lu":
+            for luname, lu in mdl.lu.items():
+                if (self.target is None or luname == self.target) and self.pollutant in lu.bmax:
+                    self.base.append((lu, getattr(lu, self.name)[self.pollutant]))
+        elif self.kind == "plt":
+            for p in mdl.pollutants:
+                if p.name == self.pollutant:
+                    self.base.append((p, self.plt_value(p)))
+        else:
+            attr = OCPATTRS[self.name]
+            for s in mdl.sublist:
+                if (self.target is None or s.name == self.target) and self.pollutant in s.cocp:
+                    self.base.append((s, getattr(s, attr)[self.pollutant]))
+        if not self.base:
+            raise ValueError("The parameter {} is not found in the project.".format(self))
+
+    def plt_value(self, p):
+        if self.name in ("hlw", "hls"):
+            return getattr(p, self.name)
+        return np.log10(p.koc if self.name == "logkoc" else p.kdoc)
+
+    def set(self, value):
+        """
+        Set the parameter of the bound project, relative changes are applied to the original values.
+        """
+        for obj, base in self.base:
+            v = value if self.method == "v" else base * (1 + value)
+            if self.kind == "lu":
+                getattr(obj, self.name)[self.pollutant] = v
+            elif self.kind == "ocp":
+                getattr(obj, OCPATTRS[self.name])[self.pollutant] = v
+            elif self.name == "hlw":
+                obj.hlw = v
+                obj.dwat = 0.693 / v
+            elif self.name == "hls":
+                obj.hls = v
+                obj.dsoil = 0.693 / v
+            elif self.name == "logkoc":
+                obj.koc = 10 ** v
+            else:
+                obj.kdoc = 10 ** v
+
+
+class RandomSearch:
+
+    def __init__(self, params, seed=None):
+        """
+        Uniform random sampling within the parameter bounds.
+        Optimizers provide ask(n) -> (n, parameters) array and tell(x, losses).
+        """
+        self.low = np.array([p.low for p in params], dtype=float)
+        self.high = np.array([p.high for p in params], dtype=float)
+        self.rng = np.random.default_rng(seed)
+
+    def ask(self, n):
+        return self.low + (self.high - self.low) * self.rng.random((n, len(self.low)))
+
+    def tell(self, x, losses):
+        pass
+
+
+class LatinHypercube(RandomSearch):
+
+    def __init__(self, params, nsamples, seed=None):
+        """
+        Latin hypercube design of nsamples parameter sets, asked in batches.
+        """
+        super().__init__(params, seed)
+        npar = len(self.low)
+        strata = np.array([self.rng.permutation(nsamples) for i in range(npar)]).T
+        u = (strata + self.rng.random((nsamples, npar))) / nsamples
+        self.design = self.low + (self.high - self.low) * u
+        self.next = 0
+
+    def ask(self, n):
+        x = self.design[self.next:self.next + n]
+        self.next += len(x)
+        return x
+
+
+# state of the worker processes: the project is loaded once per worker
+_worker = {}
+
+
+def _init_worker(swatdir, lcdir, params, obs, metric, bound, cache):
+    # own memory-mapped input file in the out-of-core mode, the other workers keep theirs mapped
+    sim = Simulation(swatdir, lcdir, cubepath=os.path.join(lcdir, "lcproj.cube.{}.npy".format(os.getpid())))
+    sim.mdl_struct.screenshow = 0
+    for p in params:
+        p.bind(sim.mdl_struct)
+    _worker["sim"] = sim
+    _worker["params"] = params
+    _worker["sink"] = ObjectiveSink(obs, metric=metric, bound=bound)
+    _worker["cache"] = RunCache(cache) if cache else None
+
+
+def _evaluate(x):
+    for p, v in zip(_worker["params"], x):
+        p.set(v)
+    r = _worker["sim"].run(sink=_worker["sink"], cache=_worker["cache"])
+    return r["objective"], r["aborted"] is not None
+
+
+class Calibrator:
+
+    def __init__(self, swatdir, lcdir, params, obs, metric="NSE", bound=None, workers=None, cache=None):
+        """
+        Calibrate the SWAT_LC parameters with a pool of worker processes. Each worker loads the project once and
+        reuses it (the state variables are reset before every run), the parameter sets are evaluated with
+        objective.ObjectiveSink, so no output file is written.
+        In the out-of-core mode (OUTOFCORE), each worker writes its own memory-mapped input file
+        (lcproj.cube.<process id>.npy), the files are removed at the end of the run.
+        :param swatdir: SWAT project folder
+        :param lcdir: SWAT_LC project folder
+        :param params: list of Parameter
+        :param obs: observations, DataFrame or path of the observation file (see objective.read_obs)
+        :param metric: objective metric (NSE, KGE, PBIAS, LOGRMSE)
+        :param bound: early abort bound of the objective (NSE/LOGRMSE), aborted runs are never the best
+        :param workers: number of worker processes, default: the number of CPUs
+        :param cache: folder of the run cache (see runcache.RunCache), the objectives of parameter sets evaluated
+                      before are not simulated again
+        """
+        self.swatdir = swatdir
+        self.lcdir = lcdir
+        self.params = params
+        self.obs = obs
+        self.metric = metric
+        self.bound = bound
+        self.workers = workers or os.cpu_count()
+        self.cache = cache
+        self.history = None
+
+    def loss(self, value):
+        """
+        :return: the objective converted to a loss (lower is better)
+        """
+        if self.metric in ("NSE", "KGE"):
+            return -value
+        if self.metric == "PBIAS":
+            return abs(value)
+        return value
+
+    def run(self, optimizer, nevals, batch=None):
+        """
+        :param optimizer: object with ask(n) and tell(x, losses), e.g. RandomSearch, LatinHypercube
+        :param nevals: number of evaluations
+        :param batch: number of parameter sets asked at a time, default: the number of workers
+        :return: history of the evaluations (DataFrame: parameters, objective, aborted, loss)
+        """
+        batch = batch or self.workers
+        rows = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.swatdir, self.lcdir, self.params, self.obs, self.metric,
+                                           self.bound, self.cache)) as executor:
+            while len(rows) < nevals:
+                x = optimizer.ask(min(batch, nevals - len(rows)))
+                if len(x) == 0:
+                    break
+                results = list(executor.map(_evaluate, [list(v) for v in x]))
+                losses = [np.inf if aborted else self.loss(obj) for obj, aborted in results]
+                optimizer.tell(x, np.array(losses))
+                for v, (obj, aborted), l in zip(x, results, losses):
+                    rows.append(list(v) + [obj, aborted, l])
+        # input files of the workers (out-of-core mode), the worker processes have exited
+        for f in glob.glob(os.path.join(self.lcdir, "lcproj.cube.*.npy")):
+            os.remove(f)
+        self.history = pd.DataFrame(rows, columns=[str(p) for p in self.params] + [self.metric, "aborted", "loss"])
+        return self.history
+
+    def best(self):
+        """
+        :return: the best parameter set (Series) of the history
+        """
+        return self.history.loc[self.history["loss"].idxmin()]
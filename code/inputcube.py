@@ -0,0 +1,98 @@
+import datetime
+import numpy as np
+
+
+# SWAT_LC HRU input series and the corresponding columns in the SWAT output.hru
+HRUVARS = [("PRECIP", "PRECIPmm"),
+           ("PERC", "PERCmm"),
+           ("SURQ", "SURQ_GENmm"),
+           ("SWINI", "SW_INITmm"),
+           ("SWEND", "SW_ENDmm"),
+           ("GWRCHG", "GW_RCHGmm"),
+           ("LATQ", "LATQGENmm"),
+           ("LATQRCH", "LATQCNTmm"),
+           ("WYLD", "WYLDmm"),
+           ("REVAP", "REVAPmm"),
+           ("SAST", "SA_STmm"),
+           ("DAST", "DA_STmm"),
+           ("TLOSS", "TLOSSmm"),
+           ("SNOMELT", "SNOMELTmm"),
+           ("SURQRCH", "SURQ_CNTmm"),
+           ("GWQ", "GW_Qmm"),
+           ("DGWQ", "GW_Q_Dmm")]
+
+
+class InputCube:
+
+    def __init__(self, hruids, ndays, path=None, blockdays=None):
+        """
+        The HRU input series (SWAT results) of the whole project stored as one (day, variable, HRU) array.
+        If a path is given, the cube is a memory-mapped .npy file (out-of-core mode) and the simulation
+        streams through it in blocks of days, so only the current block is resident in memory.
+        :param hruids: HRU id (the HRU number in output.hru) of each column
+        :param ndays: number of simulated days
+        :param path: path of the memory-mapped file, None -> in-memory cube
+        :param blockdays: number of days in each block (out-of-core mode), default: the whole period
+        """
+        self.hruids = list(hruids)
+        self.col = {h: j for j, h in enumerate(self.hruids)}
+        self.varnames = [v for v, c in HRUVARS]
+        self.ndays = ndays
+        self.path = path
+        self.blockdays = ndays if blockdays is None or path is None else max(1, int(blockdays))
+        shape = (ndays, len(HRUVARS), len(self.hruids))
+        if path is None:
+            self.data = np.zeros(shape)
+        else:
+            self.data = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=shape)
+
+    def __repr__(self):
+        mode = "memory-mapped at {}".format(self.path) if self.path else "in memory"
+        return f"InputCube({self.ndays} days x {len(self.varnames)} variables x {len(self.hruids)} HRUs, {mode})"
+
+    def blocks(self):
+        """
+        :return: generator of (first day, last day + 1) of each block
+        """
+        for t0 in range(0, self.ndays, self.blockdays):
+            yield t0, min(t0 + self.blockdays, self.ndays)
+
+    def fill(self, reader, start):
+        """
+        Load the HRU series from the SWAT output.hru block by block, only one block of the output table is
+        kept in memory at a time.
+        :param reader: SWATreader of the SWAT project
+        :param start: the first simulated day (datetime)
+        """
+        columns = [c for v, c in HRUVARS]
+        for t0, t1 in self.blocks():
+            df = reader.read_hru(start + datetime.timedelta(days=t0), start + datetime.timedelta(days=t1 - 1))
+            nhru = len(df.index) // (t1 - t0)
+            order = {h: j for j, h in enumerate(df["HRU"].values[:nhru])}
+            pos = [order[h] for h in self.hruids]
+            arr = df[columns].values.reshape(t1 - t0, nhru, len(columns))
+            self.data[t0:t1] = arr[:, pos, :].transpose(0, 2, 1)
+            del df, arr
+        if self.path is not None:
+            self.data.flush()
+
+    def block(self, t0, t1):
+        """
+        :return: the input of days [t0, t1) as a resident array
+        """
+        if self.path is None:
+            return self.data[t0:t1]
+        return np.array(self.data[t0:t1])
+
+    def bind(self, hrus, t0, t1, block=None):
+        """
+        Point the input series of the HRUs (HRU.input) to the block of days [t0, t1), the series are then
+        indexed by (day - t0).
+        :param block: the input of the days if already read (block), None -> read here
+        """
+        if block is None:
+            block = self.block(t0, t1)
+        for h in hrus:
+            j = self.col[h.id]
+            for v, name in enumerate(self.varnames):
+                h.add_input(name, block[:, v, j])
@@ -0,0 +1,438 @@
+# Compiled kernel of the SWAT_LC HRU process (optional, requires Numba)
+import time
+import numpy as np
+import surface
+import subsurface
+import wqutils
+import stages
+import storages
+from inputcube import HRUVARS as CUBEVARS
+from outsink import HRUVARS, SUBVARS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+"""
+The daily HRU process of Simulation.run on flat arrays. The project is packed into arrays of parameters (HRU,
+pollutant, PARAMS), HRU properties (HRU, HPARAMS) and state variables (HRU, pollutant, STATES). For a range of days,
+surface_days computes the surface loads of all the HRUs, storages.lag_scan scans the surface lag storage, then
+hru_days simulates the soil layer and the aquifers and sums the sub-basin loads. With Numba, these functions and the
+process functions of surface/subsurface/wqutils are compiled, the results are the same as those of the Python engine
+within the floating point tolerance.
+"""
+
+PARAMS = ["BMAX", "KBU", "NBU", "KWOV", "NWOV", "KWOH", "NWOH", "CPREP", "DWAT", "DSOIL", "GEOFLUX", "KOC", "KDOC"]
+HPARAMS = ["AREA", "VSOIL", "ORGC", "SURLAG", "SLSUBBSN", "HRU_SLP", "OV_N", "CH_L", "CH_S1", "CH_N1", "SLSOIL",
+           "KSAT", "LAT_TTIME", "GW_DELAY", "RCHRG_DP", "ISWATER", "CBASE"]
+STATES = ["maccu", "drydays", "msurfstor", "mlatstor", "mperstor", "msoil", "msa", "mda"]
+DOCSERIES = ["cw", "mdoc", "mlat", "mgwrch", "mdgwrch"]
+BUMETHODS = ["power_build_up", "exp_build_up", "sat_build_up", "half_sat_build_up"]
+WOMETHODS = ["exponential_wash_off", "exponential_wash_off_q", "rating_curve_wash_off"]
+
+# max number of days simulated by one kernel call (size of the result buffers)
+CHUNKDAYS = 366
+
+_V = {v: i for i, (v, c) in enumerate(CUBEVARS)}
+PCP, SMT, SURQ, PERC, SWEND = _V["PRECIP"], _V["SNOMELT"], _V["SURQ"], _V["PERC"], _V["SWEND"]
+LATQ, LATQRCH, WYLD, REVAP, SAST, DAST, GWQ, DGWQ = (_V["LATQ"], _V["LATQRCH"], _V["WYLD"], _V["REVAP"], _V["SAST"],
+                                                     _V["DAST"], _V["GWQ"], _V["DGWQ"])
+
+# process functions called by surface_days and hru_days, compiled with Numba (plain Python functions without Numba)
+_jit = numba.njit(cache=True) if numba is not None else (lambda f: f)
+power_build_up = _jit(surface.power_build_up)
+exp_build_up = _jit(surface.exp_build_up)
+sat_build_up = _jit(surface.sat_build_up)
+half_sat_build_up = _jit(surface.half_sat_build_up)
+exponential_wash_off = _jit(surface.exponential_wash_off)
+exponential_wash_off_q = _jit(surface.exponential_wash_off_q)
+rating_curve_wash_off = _jit(surface.rating_curve_wash_off)
+cal_partioning = _jit(subsurface.cal_partioning)
+cal_3phase_conc = _jit(subsurface.cal_3phase_conc)
+cal_lat_load = _jit(subsurface.cal_lat_load)
+cal_gw_in_load = _jit(subsurface.cal_gw_in_load)
+decay = _jit(wqutils.decay)
+lag_scan = _jit(storages.lag_scan)
+
+
+def available():
+    """
+    :return: whether the compiled kernel can be used (Numba is installed)
+    """
+    return numba is not None
+
+
+def surface_days(inp, par, hpar, bumth, womth, state, mhrmv, surfin):
+    """
+    Surface process (build-up and wash-off) of a range of days, it does not depend on the soil layer or the aquifers.
+    :param inp: (day, inputcube.HRUVARS, HRU) HRU inputs of the days
+    :param par: (HRU, pollutant, PARAMS) parameters
+    :param hpar: (HRU, HPARAMS) HRU properties
+    :param bumth: index of the build-up method in BUMETHODS
+    :param womth: index of the wash-off method in WOMETHODS
+    :param state: (HRU, pollutant, STATES) state variables, maccu and drydays updated in place
+    :param mhrmv: (day, HRU, pollutant) load of the generated surface runoff (kg), filled in place
+    :param surfin: (day, HRU, pollutant) load going into the soil layer with the infiltration (kg), filled in place
+    """
+    ndays = inp.shape[0]
+    nhru = par.shape[0]
+    npoll = par.shape[1]
+    for i in range(nhru):
+        area = hpar[i, 0]
+        for k in range(npoll):
+            bmax = par[i, k, 0]
+            kbu = par[i, k, 1]
+            nbu = par[i, k, 2]
+            dsoil = par[i, k, 9]
+            cprep = par[i, k, 7]
+            maccu = state[i, k, 0]
+            drydays = state[i, k, 1]
+            for t in range(ndays):
+                surq = inp[t, SURQ, i]
+                wat = inp[t, PCP, i] + inp[t, SMT, i]
+                if wat == 0:
+                    if bumth == 2:
+                        oriaccu = decay(maccu / area, dsoil)
+                        mpa = sat_build_up(bmax, kbu, oriaccu)
+                    else:
+                        drydays += 1
+                        mpa = maccu / area
+                    mhrmv[t, i, k] = 0.0
+                    surfin[t, i, k] = 0.0
+                else:
+                    if bumth == 2:
+                        mpa = decay(maccu / area, dsoil)
+                    else:
+                        if drydays != 0:
+                            oriaccu = maccu / area
+                            if bumth == 0:
+                                mpa = power_build_up(bmax, kbu, nbu, oriaccu, drydays)
+                            elif bumth == 1:
+                                mpa = exp_build_up(bmax, kbu, oriaccu, drydays)
+                            else:
+                                mpa = half_sat_build_up(bmax, kbu, oriaccu, drydays)
+                        else:
+                            mpa = maccu / area
+                        drydays = 0.0
+                    mrainh = surq * 10 ** 6 * cprep / 10 ** 12
+                    mrainv = (wat - surq) * 10 ** 6 * cprep / 10 ** 12
+                    if womth == 0:
+                        mpa, mwov = exponential_wash_off(mpa, par[i, k, 3])
+                        mpa, mwoh = exponential_wash_off(mpa, par[i, k, 5])
+                    elif womth == 1:
+                        mpa, mwov = exponential_wash_off_q(mpa, par[i, k, 3], wat - surq)
+                        mpa, mwoh = exponential_wash_off_q(mpa, par[i, k, 5], surq)
+                    else:
+                        mpa, mwov = rating_curve_wash_off(mpa, par[i, k, 3], wat - surq, par[i, k, 4])
+                        mpa, mwoh = rating_curve_wash_off(mpa, par[i, k, 5], surq, par[i, k, 6])
+                    mhrmv[t, i, k] = (mrainh + mwoh) * area
+                    surfin[t, i, k] = (mrainv + mwov) * area
+                maccu = mpa * area
+            state[i, k, 0] = maccu
+            state[i, k, 1] = drydays
+
+
+def hru_days(inp, docs, surfrch, surfin, ocp, flux, par, hpar, isdoc, hsub, state, hrures, subres, hruout):
+    """
+    Simulate the soil layer and the aquifers of the HRUs for a range of days, the surface loads are given.
+    :param inp: (day, inputcube.HRUVARS, HRU) HRU inputs of the days
+    :param docs: (DOCSERIES, day, HRU) DOC series of the days (see stages.doc_series)
+    :param surfrch: (day, HRU, pollutant) surface load to the reach (see storages.lag_scan)
+    :param surfin: (day, HRU, pollutant) surface load going into the soil layer (see surface_days)
+    :param ocp: (day, sub-basin, pollutant) outcrop erosion loads (see stages.outcrop_loads)
+    :param flux: (day, sub-basin, pollutant) river surface loads (see stages.riverflux_loads), 0 if RIVERFLUX is off
+    :param par: (HRU, pollutant, PARAMS) parameters
+    :param hpar: (HRU, HPARAMS) HRU properties
+    :param isdoc: (pollutant,) 1 for DOC
+    :param hsub: (HRU,) sub-basin index of each HRU
+    :param state: (HRU, pollutant, STATES) state variables of the soil layer and the aquifers, updated in place
+    :param hrures: (day, HRU, pollutant, outsink.HRUVARS) HRU results, filled in place if hruout
+    :param subres: (day, sub-basin, pollutant, outsink.SUBVARS) sub-basin results, filled in place (zeros on entry)
+    :param hruout: whether the HRU results are written, False -> hrures is not used (may be a dummy array)
+    """
+    ndays = inp.shape[0]
+    nhru = par.shape[0]
+    npoll = par.shape[1]
+    nsub = ocp.shape[1]
+    for t in range(ndays):
+        for j in range(nsub):
+            for k in range(npoll):
+                subres[t, j, k, 0] = ocp[t, j, k]
+                subres[t, j, k, 6] = ocp[t, j, k]
+        for i in range(nhru):
+            perq = inp[t, PERC, i]
+            swend = inp[t, SWEND, i]
+            latq = inp[t, LATQ, i]
+            latqrch = inp[t, LATQRCH, i]
+            wyld = inp[t, WYLD, i]
+            revap = inp[t, REVAP, i]
+            sast = inp[t, SAST, i]
+            dast = inp[t, DAST, i]
+            gwq = inp[t, GWQ, i]
+            dgwq = inp[t, DGWQ, i]
+            area = hpar[i, 0]
+            vsoil = hpar[i, 1]
+            j = hsub[i]
+            for k in range(npoll):
+                dwat = par[i, k, 8]
+                dsoil = par[i, k, 9]
+                # I. surface loads, see surface_days and storages.lag_scan
+                msurrch = surfrch[t, i, k]
+                soilin = surfin[t, i, k]
+
+                # II. soil layer
+                vswc = (swend + perq + latq) * area * 1000
+                mlatstor = decay(state[i, k, 3], dwat)
+                if isdoc[k] == 1:
+                    msoilrem = docs[1, t, i]
+                    mper = 0.0
+                    mlat = docs[2, t, i]
+                    ctsoil = 0.0
+                else:
+                    if hpar[i, 15] == 0:
+                        msoilori = decay(state[i, k, 5], dsoil)
+                    else:
+                        msoilori = decay(state[i, k, 5], dwat)
+                    geoflxkg = par[i, k, 10] * area / (365 * 1000)
+                    msoil = soilin + msoilori + geoflxkg
+                    ctsoil = 10 ** 9 * msoil / vsoil
+                    theta = vswc / vsoil
+                    kp = par[i, k, 11] * hpar[i, 2] / 100
+                    cwdoc = docs[0, t, i] / 10 ** 6
+                    fd, fp, fdoc = cal_partioning(theta, par[i, k, 12], cwdoc, kp, 2.65 * 10 ** 6)
+                    cdsoil, cpsoil, cdocsoil = cal_3phase_conc(ctsoil, fd, fp, fdoc)
+                    if vswc != 0:
+                        mlat = ((cdsoil + cdocsoil) * vsoil) / vswc * (latq * area) / 10 ** 6
+                        mper = ((cdsoil + cdocsoil) * vsoil) / vswc * (perq * area) / 10 ** 6
+                    else:
+                        mlat = 0.0
+                        mper = 0.0
+                    msoilrem = msoil - mlat - mper
+                mlatrch, mlatrem = cal_lat_load(mlat, mlatstor, hpar[i, 10], hpar[i, 11], hpar[i, 12])
+
+                # III. groundwater
+                if isdoc[k] == 1:
+                    cgw = hpar[i, 16]
+                    mgwrch = docs[3, t, i]
+                    mdgwrch = docs[4, t, i]
+                    cdgw = cgw
+                    msarem = 0.0
+                    mdarem = 0.0
+                    mperrem = 0.0
+                else:
+                    mperstor = decay(state[i, k, 4], dsoil)
+                    mgwi, mperrem = cal_gw_in_load(mper, hpar[i, 13], mperstor)
+                    msai = mgwi * (1 - hpar[i, 14])
+                    mgw = decay(state[i, k, 6], dsoil) + msai
+                    if sast + gwq > 0:
+                        cgw = mgw / ((sast + gwq) * area) * 10 ** 6
+                    else:
+                        cgw = 0.0
+                    mgwrch = cgw * gwq * area / 10 ** 6
+                    mrevap = cgw * revap * area / 10 ** 6
+                    msarem = mgw - mgwrch - mrevap
+                    msoilrem += mrevap
+                    mdai = mgwi - msai
+                    mdgw = decay(state[i, k, 7], dsoil) + mdai
+                    if dast + dgwq > 0:
+                        cdgw = mdgw / ((dast + dgwq) * area) * 10 ** 6
+                    else:
+                        cdgw = 0.0
+                    mdgwrch = cdgw * dgwq * area / 10 ** 6
+                    mdarem = mdgw - mdgwrch
+
+                # IV. loads to the reach
+                mtrch = msurrch + mlatrch + mgwrch + mdgwrch
+                if wyld != 0:
+                    ctrch = 10 ** 6 * mtrch / (wyld * area)
+                else:
+                    ctrch = 0.0
+                if latqrch != 0:
+                    clatrch = 10 ** 6 * mlatrch / (latqrch * area)
+                else:
+                    clatrch = 0.0
+
+                # V. state variables and results
+                state[i, k, 3] = mlatrem
+                state[i, k, 4] = mperrem
+                state[i, k, 5] = msoilrem
+                state[i, k, 6] = msarem
+                state[i, k, 7] = mdarem
+                if hruout:
+                    hrures[t, i, k, 0] = mtrch
+                    hrures[t, i, k, 1] = msurrch
+                    hrures[t, i, k, 2] = mlatrch
+                    hrures[t, i, k, 3] = mgwrch
+                    hrures[t, i, k, 4] = mdgwrch
+                    hrures[t, i, k, 5] = ctrch
+                    hrures[t, i, k, 6] = clatrch
+                    hrures[t, i, k, 7] = cgw
+                    hrures[t, i, k, 8] = cdgw
+                    hrures[t, i, k, 9] = ctsoil
+                subres[t, j, k, 0] += mtrch
+                subres[t, j, k, 1] += msurrch
+                subres[t, j, k, 2] += mlatrch
+                subres[t, j, k, 3] += mgwrch
+                subres[t, j, k, 4] += mdgwrch
+        for j in range(nsub):
+            for k in range(npoll):
+                subres[t, j, k, 0] += flux[t, j, k]
+                subres[t, j, k, 5] = flux[t, j, k]
+
+
+_compiled = None
+
+
+def compiled():
+    """
+    :return: surface_days and hru_days compiled by Numba (compiled at the first call, cached on the disk)
+    """
+    global _compiled
+    if _compiled is None:
+        if numba is None:
+            raise ImportError("Numba is required for the compiled kernel.")
+        _compiled = numba.njit(cache=True)(surface_days), numba.njit(cache=True)(hru_days)
+    return _compiled
+
+
+def pack(mdl):
+    """
+    Pack the parameters and the current state variables of a loaded project (PROJmanager) into arrays, the HRUs in
+    the order of mdl.hruinput and the pollutants in the order of mdl.pollutants.
+    :return: dict of the arrays "par", "hpar", "isdoc", "hsub", "state", "lagr" (released fraction of the surface
+             lag storage, see storages.lag_factors) and the method indices "bumth", "womth"
+    """
+    subs = {h.id: (j, s) for j, s in enumerate(mdl.sublist) for h in s.hrulist}
+    hrus = {h.id: h for s in mdl.sublist for h in s.hrulist}
+    hrus = [hrus[i] for i in mdl.hruinput.hruids]
+    pollutants = mdl.pollutants
+    docsim = "DOC" in [p.name for p in pollutants]
+    par = np.zeros((len(hrus), len(pollutants), len(PARAMS)))
+    hpar = np.zeros((len(hrus), len(HPARAMS)))
+    state = np.zeros((len(hrus), len(pollutants), len(STATES)))
+    for i, h in enumerate(hrus):
+        j, sub = subs[h.id]
+        lu = mdl.lu[h.lu]
+        soil = mdl.soils[h.soiltype]
+        for k, p in enumerate(pollutants):
+            name = p.name
+            src = h if h.usrlu[name] else lu
+            par[i, k, :7] = [src.bmax[name], src.kbu[name], src.nbu[name], src.kwov[name], src.nwov[name],
+                             src.kwoh[name], src.nwoh[name]]
+            par[i, k, 7] = sub.cprep[name] if sub.usrflux[name] else p.cprep
+            par[i, k, 8] = p.dwat
+            par[i, k, 9] = p.dsoil
+            if name != "DOC":
+                par[i, k, 10] = h.geoflux[name] if h.usrsol[name] else soil.geoflx[name]
+                par[i, k, 11] = p.koc
+                par[i, k, 12] = p.kdoc
+            state[i, k] = [getattr(h.stvars[name], v) for v in STATES]
+        surlag = mdl.glbparam["SURLAG"] if h.NORparam["SURLAG"] <= 0 else h.NORparam["SURLAG"]
+        cbase = 0
+        if docsim:
+            cbase = h.cbase["DOC"] if h.usrsol["DOC"] else soil.cbase["DOC"]
+        hpar[i] = [h.area, h.vsoil, h.SOLparam["ORGC"], surlag, h.NORparam["SLSUBBSN"], h.NORparam["HRU_SLP"],
+                   h.NORparam["OV_N"], sub.NORparam["CH_L1"] * h.NORparam["HRU_FR"], sub.NORparam["CH_S1"],
+                   sub.NORparam["CH_N1"], h.NORparam["SLSOIL"], h.SOLparam["KSAT"], h.NORparam["LAT_TTIME"],
+                   h.GWparam["GW_DELAY"], h.GWparam["RCHRG_DP"], h.soiltype == mdl.flagwater, cbase]
+    return {"par": par, "hpar": hpar, "state": state,
+            "isdoc": np.array([p.name == "DOC" for p in pollutants], dtype=np.int64),
+            "hsub": np.array([subs[h.id][0] for h in hrus], dtype=np.int64), "lagr": storages.lag_factors(mdl),
+            "bumth": BUMETHODS.index(mdl.bumth.__name__), "womth": WOMETHODS.index(mdl.womth.__name__)}
+
+
+def unpack(mdl, state):
+    """
+    Write the state variables of the kernel back to the HRUs of the project.
+    """
+    hrus = {h.id: h for s in mdl.sublist for h in s.hrulist}
+    for i, hid in enumerate(mdl.hruinput.hruids):
+        for k, p in enumerate(mdl.pollutants):
+            stvars = hrus[hid].stvars[p.name]
+            for v, value in zip(STATES, state[i, k].tolist()):
+                setattr(stvars, v, int(value) if v == "drydays" else value)
+
+
+def simulate(sim, sink, layout, ocploads, fluxloads, docpar, jit=True, timer=None):
+    """
+    Run the simulation with the kernel and write the output days to the sink.
+    :param sim: main.Simulation
+    :param sink: opened output sink
+    :param layout: output layout
+    :param ocploads: outcrop erosion loads of the whole period (stages.outcrop_loads)
+    :param fluxloads: river surface loads of the whole period (stages.riverflux_loads)
+    :param docpar: DOC properties of the HRUs (stages.doc_params), None if DOC is not simulated
+    :param jit: use the compiled kernel, False -> run hru_days as Python code (slow, for checking)
+    :param timer: profiler.PhaseTimer recording the kernel and sink phases, None -> not timed
+    :return: number of simulated days (less than the simulation period if the sink stopped the simulation)
+    """
+    mdl = sim.mdl_struct
+    surf, fn = compiled() if jit else (surface_days, hru_days)
+    scan = lag_scan if jit else storages.lag_scan
+    model = pack(mdl)
+    cube = mdl.hruinput
+    ndays = len(sim.dateseries)
+    nhru, npoll = len(cube.hruids), len(mdl.pollutants)
+    if mdl.riverflux != 1:
+        fluxloads = np.zeros_like(fluxloads)
+    pk = [k for k, p in enumerate(mdl.pollutants) if p.name in layout.pollutants]
+    hruout = layout.hruout
+    # result buffers of one kernel call, reused by all the calls (the HRU buffer is a dummy without HRU output)
+    nchunk = min(CHUNKDAYS, max(b1 - b0 for b0, b1 in cube.blocks()))
+    if hruout:
+        hrubuf = np.zeros((nchunk, nhru, npoll, len(HRUVARS)))
+    else:
+        hrubuf = np.zeros((1, 1, 1, len(HRUVARS)))
+    subbuf = np.zeros((nchunk, len(mdl.sublist), npoll, len(SUBVARS)))
+    surfbuf = np.zeros((3, nchunk, nhru, npoll))     # surface loads mhrmv, surfin, surfrch
+    state = model["state"]
+    nodocs = np.zeros((len(DOCSERIES), 1, 1))   # not read by the kernel if DOC is not simulated
+    stopped = False
+    ndone = ndays
+    tlast = time.perf_counter()
+    for b0, b1 in cube.blocks():
+        block = cube.block(b0, b1)
+        docseries = None if docpar is None else stages.doc_series(mdl, docpar, block)
+        if timer is not None:
+            tlast = timer.lap("input", tlast)
+        for t0 in range(b0, b1, CHUNKDAYS):
+            t1 = min(t0 + CHUNKDAYS, b1)
+            if docseries is None:
+                docs = nodocs
+            else:
+                docs = np.stack([docseries[v][t0 - b0:t1 - b0] for v in DOCSERIES])
+            hrures = hrubuf[:t1 - t0] if hruout else hrubuf
+            subres = subbuf[:t1 - t0]
+            subres[:] = 0
+            inp = block[t0 - b0:t1 - b0]
+            mhrmv, surfin, surfrch = surfbuf[:, :t1 - t0]
+            surf(inp, model["par"], model["hpar"], model["bumth"], model["womth"], state, mhrmv, surfin)
+            # surface lag storage msurfstor scanned in place
+            scan(mhrmv, state[:, :, 2], model["par"][:, :, 8], model["lagr"], surfrch)
+            if timer is not None:
+                tlast = timer.lap("surface", tlast)
+            fn(inp, docs, surfrch, surfin, ocploads[t0:t1], fluxloads[t0:t1], model["par"], model["hpar"],
+               model["isdoc"], model["hsub"], state, hrures, subres, hruout)
+            if timer is not None:
+                tlast = timer.lap("kernel", tlast)
+            for t in range(t0, t1):
+                d = sim.dateseries[t]
+                if d in sim.outdateseries:
+                    if sink.write(d, hrures[t - t0][:, pk] if hruout else None, subres[t - t0][:, pk]):
+                        if mdl.screenshow != 0:
+                            print("\nSimulation stopped by the output sink on {}.".format(d.date()))
+                        stopped = True
+                        ndone = t + 1
+                        break
+            if timer is not None:
+                tlast = timer.lap("sink", tlast)
+            if stopped:
+                break
+            if sim.pgbar.enabled:
+                sim.pgbar.update(t1 * len(mdl.sublist))
+        if stopped:
+            break
+    unpack(mdl, state)
+    return ndone
@@ -1,13 +1,20 @@
 # Author: Qianyang Wang
 import os.path
 import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from modelutils import PROJmanager
-import datetime
+from outsink import OutputLayout, MemorySink, make_sink
+from runcache import lc_signature
 import pandas as pd
 import surface
 import subsurface
-import outcrop
+import stages
+import storages
+import kernel
+import planner
+from profiler import Profiler
 from wqutils import decay
 import progressbar
 
@@ -16,40 +23,123 @@ import progressbar
 
 class Simulation:
 
-    def __init__(self, SWATdir, LCdir):
-        self.mdl_struct = PROJmanager(SWATdir, LCdir)
+    def __init__(self, SWATdir, LCdir, cubepath=None):
+        """
+        :param SWATdir: SWAT project folder
+        :param LCdir: SWAT_LC project folder
+        :param cubepath: memory-mapped file of the HRU inputs in the out-of-core mode, see modelutils.PROJmanager
+        """
+        self.mdl_struct = PROJmanager(SWATdir, LCdir, cubepath=cubepath)
         print("Load SWAT model successfully.")
-        self.start = datetime.date(year=self.mdl_struct.settings["IYR"] + self.mdl_struct.settings["NYSKIP"], month=1,
-                                   day=1) \
-                     + datetime.timedelta(days=self.mdl_struct.settings["IDAF"] - 1)
-        self.end = datetime.date(year=self.mdl_struct.settings["IYR"] + self.mdl_struct.settings["NBYR"] - 1, month=1,
-                                 day=1) \
-                   + datetime.timedelta(days=self.mdl_struct.settings["IDAL"] - 1)
+        self.start = self.mdl_struct.simstart.date()
+        self.end = self.mdl_struct.simend.date()
         self.dateseries = pd.date_range(start=self.start, end=self.end)
         self.outdateseries = pd.date_range(start=self.mdl_struct.outstart, end=self.mdl_struct.outend)
-        total_calc = len(self.dateseries) * len(self.mdl_struct.sublist)
-        self.pgbar = progressbar.ProgressBar(total_calcs=total_calc)
-        self.outhrupath = LCdir + "\lcproj.hruout"
-        self.outsubpath = LCdir + "\lcproj.subout"
+        self.pgbar = None       # progress of the current run (progressbar.ProgressBar)
+        self.outhrupath = os.path.join(LCdir, "lcproj.hruout")
+        self.outsubpath = os.path.join(LCdir, "lcproj.subout")
+        self.nruns = 0
+        self.profile = None     # report of the last profiled run (see profiler.Profiler.report)
 
     def __repr__(self):
-        pass
-
-    def run(self):
+        return f"Simulation(SWAT: {self.mdl_struct.swatdir}, SWAT_LC: {self.mdl_struct.lcdir}, {self.start} - {self.end})"
+
+    def run(self, sink=None, output=None, hru=False, cache=None):
+        """
+        :param sink: output sink (see outsink), default: the OUTSINK setting of the .sim file (text outputs)
+        :param output: return the results in memory without writing any output file,
+                       "numpy": dict of preallocated arrays (see outsink.MemorySink.result), "xarray": xarray Dataset
+        :param hru: also return the HRU results (regardless of HRUOUT)
+        :param cache: runcache.RunCache, the results of the in-memory outputs and the objective sinks are returned
+                      from the cache if the same SWAT inputs and SWAT_LC parameters were simulated before
+        :return: the results kept by the sink (in-memory outputs), None for the file/database outputs
+        """
+        if output not in (None, "numpy", "xarray"):
+            raise ValueError("Unknown output type: {}, available: numpy, xarray.".format(output))
+        if output == "xarray" and importlib.util.find_spec("xarray") is None:
+            # fail before the run if xarray is not installed
+            raise ImportError("xarray is required for the xarray output, use output=\"numpy\" instead.")
         if self.mdl_struct.screenshow != 0:
             print("Starting simulation...")
-        fhnd = open(self.outhrupath, "w")
-        fhnd2 = open(self.outsubpath, "w")
-        self.write_hruheader(fhnd)
-        self.write_subheader(fhnd2)
+        if self.nruns > 0:
+            # every run starts from the initial conditions
+            self.mdl_struct.reset_state()
+        self.nruns += 1
+        hruout = self.mdl_struct.hruout != 0
+        if output is not None:
+            sink = MemorySink(hru=hru)
+            hruout = hruout or hru
+        elif sink is None:
+            sink = make_sink(self.mdl_struct.outsink, self.mdl_struct.lcdir, url=self.mdl_struct.outsinkurl,
+                             index=self.mdl_struct.outindex != 0)
+        self.sink = sink
+        key = None
+        if cache is not None and sink.signature() is not None:
+            key = cache.key(self.mdl_struct.fingerprint, lc_signature(self.mdl_struct),
+                            sink.signature(), [output, hruout])
+            value = cache.get(key)
+            if value is not None:
+                if self.mdl_struct.screenshow != 0:
+                    print("Results loaded from the run cache.")
+                return value
+        prof = Profiler(self.mdl_struct.profile)
+        timing = prof.enabled   # the phases are timed with chained laps, see profiler.PhaseTimer.lap
+        lap = prof.timer.lap
+        tlast = prof.start()
+        layout = self.output_layout(hruout)
+        sink.open(layout)
+        # results of the current day (unit, pollutant, variable)
+        hruday = np.zeros((len(layout.hrus), len(layout.pollutants), len(layout.hruvars)))
+        subday = np.zeros((len(layout.subs), len(layout.pollutants), len(layout.subvars)))
+        hrucol = {h: j for j, h in enumerate(layout.hrus)}
+        subcol = {s: j for j, s in enumerate(layout.subs)}
+        outp = {p: k for k, p in enumerate(layout.pollutants)}
         pg = 0
-        if self.mdl_struct.screenshow != 0:
-            self.pgbar.update(pg)
-        airtmp_ts = self.mdl_struct.SWATTmp  # for outcrop erosion temperature correction
+        hrus = [h for sub in self.mdl_struct.sublist for h in sub.hrulist]
+        progress = self.mdl_struct.progress if self.mdl_struct.screenshow != 0 else "off"
+        self.pgbar = progressbar.ProgressBar(len(self.dateseries), len(self.mdl_struct.sublist), len(hrus),
+                                             mode=progress, interval=self.mdl_struct.progressinterval)
+        showpg = self.pgbar.enabled     # no progress call at all in the silent mode
+        self.pgbar.start()
+        # stateless stages of the whole period (day, sub, pollutant)
+        ocploads = stages.outcrop_loads(self.mdl_struct, len(self.dateseries))
+        fluxloads = stages.riverflux_loads(self.mdl_struct, len(self.dateseries))
+        # DOC properties of the HRUs, the DOC series are computed for each block of input days
+        docpar = stages.doc_params(self.mdl_struct)
+        doccol = self.mdl_struct.hruinput.col
+        if timing:
+            tlast = lap("stages", tlast)
+        if self.mdl_struct.engine == "jit":
+            if kernel.available():
+                # compiled HRU process (kernel), the same results as the loop below within the floating point tolerance
+                ndays = kernel.simulate(self, sink, layout, ocploads, fluxloads, docpar,
+                                        timer=prof.timer if timing else None)
+                return self.finish_run(sink, output, cache, key, prof, ndays * len(hrus))
+            if self.mdl_struct.screenshow != 0:
+                print("Numba is not installed, the Python engine is used.")
+        blocks = dict(self.mdl_struct.hruinput.blocks())
+        bstart = 0
+        # surface process by ranges of days within the blocks, see surface_chunk
+        lagr = storages.lag_factors(self.mdl_struct)
+        chunks = {}
         for id, d in enumerate(self.dateseries):
-            tmp = airtmp_ts[id]
-            for sub in self.mdl_struct.sublist:
-                subpcp = sub.input["PRECIP"][id]
+            if id in blocks:
+                # HRU inputs of the current block of days (only this block is loaded in the out-of-core mode)
+                bstart = id
+                block = self.mdl_struct.hruinput.block(bstart, blocks[bstart])
+                self.mdl_struct.hruinput.bind(hrus, bstart, blocks[bstart], block)
+                # DOC of the block (day, HRU)
+                docseries = None if docpar is None else stages.doc_series(self.mdl_struct, docpar, block)
+                chunks = {t0: min(t0 + kernel.CHUNKDAYS, blocks[bstart])
+                          for t0 in range(bstart, blocks[bstart], kernel.CHUNKDAYS)}
+            if timing:
+                tlast = lap("input", tlast)
+            if id in chunks:
+                cstart = id
+                surfin, surfrch = self.surface_chunk(cstart, chunks[cstart], bstart, lagr)
+                if timing:
+                    tlast = lap("surface", tlast)
+            for j, sub in enumerate(self.mdl_struct.sublist):
                 """
                 0. Channel Outcrops Erosion Process:
                 Incorporate this if the outcrop erosion process is the dominant sources of PACs in the basin. A modified rating curve like equation is used.
@@ -59,175 +149,41 @@ class Simulation:
                 Environmental Science & Technology Article ASAP
                 DOI: 10.1021/acs.est.5c02074
                 """
-                rchflow = sub.input["Flow"][id]
-                rchwidth = sub.width
                 if sub.hasoutcrop is True:
-                    for pollutant in self.mdl_struct.pollutants:
+                    for k, pollutant in enumerate(self.mdl_struct.pollutants):
                         # DOC simulation does not consider outcrop erosion
                         if pollutant.name != "DOC":
-                            cocp = sub.cocp[pollutant.name]
-                            kocp = sub.kocp[pollutant.name]
-                            nocp = sub.nocp[pollutant.name]
-                            qwcr = sub.qwcr[pollutant.name]
-                            ea = sub.ea[pollutant.name]
-                            t0 = sub.t0[pollutant.name]
-                            outcropmass = outcrop.washload_equation_m(cocp, kocp, rchflow, rchwidth, nocp, qwcr, ea, t0,
-                                                                      tmp)
+                            outcropmass = ocploads[id, j, k]   # precomputed for the whole period (stages)
                             sub.stvars[pollutant.name].out_mt += outcropmass
                             sub.stvars[pollutant.name].out_mocp = outcropmass
                         else:
                             sub.stvars[pollutant.name].out_mocp = 0
+                if timing:
+                    tlast = lap("reach", tlast)
 
                 # land processes
                 for hru in sub.hrulist:
-                    pcp = hru.input["PRECIP"][id]
-                    smt = hru.input["SNOMELT"][id]
-                    surq = hru.input["SURQ"][id]
-                    surqrch = hru.input["SURQRCH"][id]
-                    perq = hru.input["PERC"][id]
-                    swini = hru.input["SWINI"][id]
-                    swend = hru.input["SWEND"][id]
-                    gwrchg = hru.input["GWRCHG"][id]
-                    latq = hru.input["LATQ"][id]
-                    latqrch = hru.input["LATQRCH"][id]
-                    wyld = hru.input["WYLD"][id]
-                    revap = hru.input["REVAP"][id]
-                    sast = hru.input["SAST"][id]
-                    dast = hru.input["DAST"][id]
-                    gwq = hru.input["GWQ"][id]
-                    dgwq = hru.input["DGWQ"][id]
-                    wat = pcp + smt
-                    for pollutant in self.mdl_struct.pollutants:
-
-                        """
-                        I. SURFACE PROCESS:
-
-                        *Basic Principle:
-                        --Mass balance. accu = accu + bu - wo - decay; srmv = wat * crain + wo - decay
-
-                        *Assumptions: 
-                        --The mass removed by the rainfall process has 2 transport pathways: 1) exported by the surface runoff; 2) go into the soil layer.
-                        --For the rating curve method, the total wash-off load (including path1 and path2) is related to the rainfall.
-                        --The quantity into the surface runoff can be determined by the overall conc. and the surface runoff. If the rainfall event does
-                          not generate the surface runoff, then all the wash-off load will go into the soil layer.
-                        """
-
-                        if hru.usrlu[pollutant.name]:
-                            # the user defined LU settings have higher priority
-                            bmax = hru.bmax[pollutant.name]
-                            kbu = hru.kbu[pollutant.name]
-                            nbu = hru.nbu[pollutant.name]
-                        else:
-                            bmax = self.mdl_struct.lu[hru.lu].bmax[pollutant.name]
-                            kbu = self.mdl_struct.lu[hru.lu].kbu[pollutant.name]
-                            nbu = self.mdl_struct.lu[hru.lu].nbu[pollutant.name]
-
-                        if wat == 0:
-                            # 1. Dry days, build-up
-                            if self.mdl_struct.bumth == surface.sat_build_up:
-                                # saturation build-up -> does not need antecedent dry days, decay considered
-                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
-                                oriaccu = decay(oriaccu, pollutant.dsoil)
-                                mpa = self.mdl_struct.bumth(bmax, kbu, oriaccu)
-                            else:
-                                # exp, pow, half-sat build-up -> need antecedent dry days, decay not considered
-                                hru.stvars[pollutant.name].drydays += 1
-                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
-                                mpa = oriaccu  # exp, half-sat method, decay not considered, mass will be added on wet day
-                            mhrmv = 0
-                            csrmv = 0
-                            soilin = 0
-                        else:
-                            if self.mdl_struct.bumth == surface.sat_build_up:
-                                # 1. Wet days, no build-up for sat build-up
-                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
-                                oriaccu = decay(oriaccu, pollutant.dsoil)
-                                mpa = oriaccu
-                            else:
-                                # 1. Wet days, add the dry days build-up for exp, pow, half-sat methods
-                                if hru.stvars[pollutant.name].drydays != 0:
-                                    oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
-                                    # power, exp, half-sat build-up, mpa: mass per unit area, kg/km2
-                                    if self.mdl_struct.bumth == surface.power_build_up:
-                                        mpa = self.mdl_struct.bumth(bmax, kbu, nbu, oriaccu,
-                                                                    hru.stvars[pollutant.name].drydays)
-                                    else:
-                                        mpa = self.mdl_struct.bumth(bmax, kbu, oriaccu,
-                                                                    hru.stvars[pollutant.name].drydays)
-                                else:
-                                    oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
-                                    mpa = oriaccu
-                                hru.stvars[pollutant.name].drydays = 0
-
-                            # 2. Mass (per unit area) of the pollutant in the generated surface runoff due to wet deposition
-                            if sub.usrflux[pollutant.name]:
-                                mrainh = surq * 10 ** 6 * sub.cprep[
-                                    pollutant.name] / 10 ** 12  # mm * km2 * 10**6 -> L  cprep: ng/L/10**12 -> kg/L  mrain:kg/HRU.AREA
-                                mrainv = (wat - surq) * 10 ** 6 * sub.cprep[pollutant.name] / 10 ** 12
-                            else:
-                                mrainh = surq * 10 ** 6 * pollutant.cprep / 10 ** 12  # mm * km2 * 10**6 -> L  cprep: ng/L/10**12 -> kg/L  mrain:kg/HRU.AREA
-                                mrainv = (wat - surq) * 10 ** 6 * pollutant.cprep / 10 ** 12
-                            # 3. Wash-off
-                            if hru.usrlu[pollutant.name]:
-                                # the user defined LU settings have higher priority
-                                kwov = hru.kwov[pollutant.name]
-                                nwov = hru.nwov[pollutant.name]
-                                kwoh = hru.kwoh[pollutant.name]
-                                nwoh = hru.nwoh[pollutant.name]
-                            else:
-                                kwov = self.mdl_struct.lu[hru.lu].kwov[pollutant.name]
-                                nwov = self.mdl_struct.lu[hru.lu].nwov[pollutant.name]
-                                kwoh = self.mdl_struct.lu[hru.lu].kwoh[pollutant.name]
-                                nwoh = self.mdl_struct.lu[hru.lu].nwoh[pollutant.name]
-                            if self.mdl_struct.womth == surface.exponential_wash_off:
-                                mpa, mwov = self.mdl_struct.womth(mpa,
-                                                                  kwov)  # nwo not used in the case of basic exponential_wash_off
-                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh)
-                            elif self.mdl_struct.womth == surface.exponential_wash_off_q:
-                                mpa, mwov = self.mdl_struct.womth(mpa, kwov,
-                                                                  wat - surq)  # for Q-driven exponential_wash_off_q
-                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh, surq)
-                            else:
-                                mpa, mwov = self.mdl_struct.womth(mpa, kwov, wat - surq,
-                                                                  nwov)  # rating curve -> removed mass directly related to the runoff intensity
-                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh, surq,
-                                                                  nwoh)  # rating curve -> removed mass directly related to the runoff intensity
-                            # 4. Mass Re-distribution
-                            mhrmv = (mrainh + mwoh) * hru.area
-                            if surq != 0:
-                                csrmv = (mhrmv / (
-                                            surq * hru.area)) * 10 ** 6  # conc. of surface removal: kg/(km2 * mm) = mg/L, mg/L = 10**6 ng/L
-                            else:
-                                csrmv = 0
-                            soilin = (mrainv + mwov) * hru.area  # Mass go into the soil layer due to the infiltration process, kg
-
-                        # kg mass to the river channel due to the time lag effect
-                        msurfstor = decay(hru.stvars[pollutant.name].msurfstor,pollutant.dwat)  # decay of the mass stored in the traveling water
-
-                        ### Note the Surlag parameter has some changes between different SWAT versions . See https://zhiqiangyu.wordpress.com/2014/07/16/swat-changes-from-rev-622-to-rev-627/
-                        ### In the previous version it is a global value, thus for old versions the self.mdl_struct.glbparam["SURLAG"] should be used.
-                        if hru.NORparam["SURLAG"] <=0:
-                            msurrch, msurfstor = surface.surface_lag(mhrmv,
-                                                                     msurfstor,
-                                                                     self.mdl_struct.glbparam["SURLAG"],
-                                                                     hru.NORparam["SLSUBBSN"],
-                                                                     hru.NORparam["HRU_SLP"],
-                                                                     hru.NORparam["OV_N"],
-                                                                     hru.area,
-                                                                     sub.NORparam["CH_L1"] * hru.NORparam["HRU_FR"],
-                                                                     sub.NORparam["CH_S1"],
-                                                                     sub.NORparam["CH_N1"])
-                        else:
-                            msurrch, msurfstor = surface.surface_lag(mhrmv,
-                                                                     msurfstor,
-                                                                     hru.NORparam["SURLAG"],
-                                                                     hru.NORparam["SLSUBBSN"],
-                                                                     hru.NORparam["HRU_SLP"],
-                                                                     hru.NORparam["OV_N"],
-                                                                     hru.area,
-                                                                     sub.NORparam["CH_L1"] * hru.NORparam["HRU_FR"],
-                                                                     sub.NORparam["CH_S1"],
-                                                                     sub.NORparam["CH_N1"])
+                    surqrch = hru.input["SURQRCH"][id - bstart]
+                    perq = hru.input["PERC"][id - bstart]
+                    swini = hru.input["SWINI"][id - bstart]
+                    swend = hru.input["SWEND"][id - bstart]
+                    gwrchg = hru.input["GWRCHG"][id - bstart]
+                    latq = hru.input["LATQ"][id - bstart]
+                    latqrch = hru.input["LATQRCH"][id - bstart]
+                    wyld = hru.input["WYLD"][id - bstart]
+                    revap = hru.input["REVAP"][id - bstart]
+                    sast = hru.input["SAST"][id - bstart]
+                    dast = hru.input["DAST"][id - bstart]
+                    gwq = hru.input["GWQ"][id - bstart]
+                    dgwq = hru.input["DGWQ"][id - bstart]
+                    h = doccol[hru.id]
+                    if timing:
+                        tlast = lap("input", tlast)
+                    for k, pollutant in enumerate(self.mdl_struct.pollutants):
+
+                        # I. surface process, computed for the range of days (surface_chunk)
+                        soilin = surfin[id - cstart, h, k]
+                        msurrch = surfrch[id - cstart, h, k]
                         """
                         II. Subsurface Process - Soil Layer
 
@@ -247,31 +203,16 @@ class Simulation:
                         vswc = (swend + perq + latq) * hru.area * 1000  # mm * km2 = 1000 m3,
                         # vswc = (swend + perq + latq - revap) * hru.area * 1000             # mm * km2 = 1000 m3,
                         if pollutant.name == "DOC":
-                            if hru.usrsol[pollutant.name]:
-                                fdoc = hru.fdoc[pollutant.name]
-                            else:
-                                fdoc = self.mdl_struct.soils[hru.soiltype].fdoc[pollutant.name]
-                            if self.mdl_struct.docmth == 0:
-                                csoc = 10 ** 6 * hru.morgc / hru.msolid  # mg/kg
-                                cdoc = csoc * fdoc  # mg/L fdoc -> oc partitioning coeff kg/L (1/L/kg)
-                                mdoc = cdoc * vswc / 1000  # kg
-                            else:
-                                if vswc != 0:
-                                    csoc = 10 ** 3 * hru.morgc / vswc  # kg/m3 = g/L * 1000 = mg/L
-                                    cdoc = csoc * fdoc  # mg/L fdoc -> doc ratio
-                                else:
-                                    cdoc = 0
-                                mdoc = cdoc * vswc / 1000  # kg
+                            # the DOC in the soil water only depends on the soil water and the soil organic carbon,
+                            # precomputed for the block of days (stages.doc_series)
+                            mdoc = docseries["mdoc"][id - bstart, h]  # kg
                             # msoil = soilin + mdoc  # kg mass of DOC in solution phase
                             msoilrem = mdoc  # not used
 
                             # No partitioning calculation for the organic carbon
-                            if vswc != 0:
-                                cswc = 10 ** 9 * mdoc / vswc  # kg/m3 = g/L = 10**9 ng/L -> Conc.
-                            else:
-                                cswc = 0
+                            cswc = docseries["cw"][id - bstart, h]  # ng/L
                             mper = 0  # do not consider interaction for DOC
-                            mlat = cswc * latq * hru.area / 10 ** 6
+                            mlat = docseries["mlat"][id - bstart, h]
                             # mlat = cswc * latqrch * hru.area / 10 ** 6
                             mlatstor = decay(hru.stvars[pollutant.name].mlatstor, pollutant.dwat)
                             mlatrch, mlatrem = subsurface.cal_lat_load(mlat,
@@ -307,7 +248,7 @@ class Simulation:
                             theta = vswc / hru.vsoil  # volumetric soil water content
                             kp = pollutant.koc * hru.SOLparam["ORGC"] / 100
                             dsoil = 2.65 * 10 ** 6  # soil solid density 2.65 kg/L -> 2.65 * 10**6 mg/L
-                            cwdoc = hru.stvars["DOC"].cw / 10 ** 6  # conc. of DOC in water, ng/L/10**6 = mg/L
+                            cwdoc = docseries["cw"][id - bstart, h] / 10 ** 6  # conc. of DOC in water, ng/L/10**6 = mg/L
                             fd, fp, fdoc = subsurface.cal_partioning(theta, pollutant.kdoc, cwdoc, kp, dsoil)
                             cdsoil, cpsoil, cdocsoil = subsurface.cal_3phase_conc(ctsoil, fd, fp, fdoc)
                             if vswc != 0:
@@ -326,6 +267,8 @@ class Simulation:
                                                                        hru.NORparam["LAT_TTIME"])
 
 
+                        if timing:
+                            tlast = lap("soil", tlast)
                         """
                         III. Subsurface Process - Groundwater
 
@@ -334,12 +277,9 @@ class Simulation:
                         --Well mixed storage.
                         """
                         if pollutant.name == "DOC":
-                            if hru.usrsol[pollutant.name]:
-                                cgw = hru.cbase[pollutant.name]
-                            else:
-                                cgw = self.mdl_struct.soils[hru.soiltype].cbase[pollutant.name]
-                            mgwrch = cgw * gwq * hru.area / 10 ** 6  # ng/L * mm * km2 = ng/L * 1000m3 = mg; mg/10**6 = kg
-                            mdgwrch = cgw * dgwq * hru.area / 10 ** 6
+                            cgw = docseries["cbase"][h]
+                            mgwrch = docseries["mgwrch"][id - bstart, h]  # kg, precomputed (stages.doc_series)
+                            mdgwrch = docseries["mdgwrch"][id - bstart, h]
                             msarem = 0  # keep the format
                             mdarem = 0
                             mperrem = 0
@@ -374,6 +314,8 @@ class Simulation:
                             mdgwrch = cdgw * dgwq * hru.area / 10 ** 6
                             mdarem = mdgw - mdgwrch
 
+                        if timing:
+                            tlast = lap("groundwater", tlast)
                         """
                         IV. Overall Mass and Concentration to the Reach 
                         """
@@ -398,11 +340,9 @@ class Simulation:
                         """
                         V. Update HRU State Variables
                         """
-                        # 1. surface storage
-                        hru.stvars[pollutant.name].maccu = mpa * hru.area  # kg stored in the state variable
+                        # 1. surface storage: updated by surface_chunk
 
                         # 2. traveling storage
-                        hru.stvars[pollutant.name].msurfstor = msurfstor
                         hru.stvars[pollutant.name].mlatstor = mlatrem
                         hru.stvars[pollutant.name].mperstor = mperrem
 
@@ -414,7 +354,6 @@ class Simulation:
                         hru.stvars[pollutant.name].mda = mdarem
 
                         # 5. concentration
-                        hru.stvars[pollutant.name].csurf = csrmv
                         hru.stvars[pollutant.name].cw = cswc
                         hru.stvars[pollutant.name].ctsoil = ctsoil
                         hru.stvars[pollutant.name].cpsoil = cpsoil
@@ -423,7 +362,6 @@ class Simulation:
                         hru.stvars[pollutant.name].csaq = cgw
 
                         # 6. other variables
-                        hru.stvars[pollutant.name].msurf = mhrmv
                         hru.stvars[pollutant.name].mlat = mlat
                         hru.stvars[pollutant.name].mper = mper
                         hru.stvars[pollutant.name].mrevap = mrevap
@@ -448,28 +386,22 @@ class Simulation:
                         """
                         VII. Write HRU Output
                         """
-                        if self.mdl_struct.hruout != 0:
+                        if hruout:
                             if d in self.outdateseries:
                                 if (pollutant.name == "DOC" and self.mdl_struct.docout != 0) or pollutant.name != "DOC":
-                                    self.write_hrurow(fhnd, d, sub.name, hru.id, pollutant.name, mtrch, msurrch,
-                                                      mlatrch, mgwrch, mdgwrch, ctrch, clatrch, cgw, cdgw, ctsoil)
+                                    hruday[hrucol[hru.id], outp[pollutant.name]] = (mtrch, msurrch, mlatrch, mgwrch,
+                                                                                    mdgwrch, ctrch, clatrch, cgw, cdgw,
+                                                                                    ctsoil)
+                        if timing:
+                            tlast = lap("output", tlast)
 
                 if self.mdl_struct.riverflux == 1:
-                    for pollutant in self.mdl_struct.pollutants:
-                        if sub.usrflux[pollutant.name]:
-                            fluxmass = sub.watsurf * (sub.riverflux[pollutant.name] / 365) / (
-                                        10 ** 9)  # m2 * ug/(m2 * yr) ug -> kg
-                        else:
-                            fluxmass = sub.watsurf * (pollutant.flux / 365) / (10 ** 9)  # m2 * ug/(m2 * yr) ug -> kg
-                        if subpcp != 0:
-                            if sub.usrflux[pollutant.name]:
-                                fluxmass += sub.watsurf * subpcp * sub.cprep[pollutant.name] / (
-                                            10 ** 12)  # m2 * mm -> 0.001 m3 -> L    ng/10**12 -> kg
-                            else:
-                                fluxmass += sub.watsurf * subpcp * pollutant.cprep / (
-                                            10 ** 12)  # m2 * mm -> 0.001 m3 -> L    ng/10**12 -> kg
+                    for k, pollutant in enumerate(self.mdl_struct.pollutants):
+                        fluxmass = fluxloads[id, j, k]  # precomputed for the whole period (stages)
                         sub.stvars[pollutant.name].out_mrchflux = fluxmass
                         sub.stvars[pollutant.name].out_mt += fluxmass
+                if timing:
+                    tlast = lap("reach", tlast)
 
                 """
                 VIII. Write SUBBASIN Output
@@ -478,7 +410,7 @@ class Simulation:
                 for pollutant in self.mdl_struct.pollutants:
                     if d in self.outdateseries:
                         if (pollutant.name == "DOC" and self.mdl_struct.docout != 0) or pollutant.name != "DOC":
-                            self.write_subrow(fhnd2, d, sub.name, pollutant.name,
+                            subday[subcol[sub.name], outp[pollutant.name]] = (
                                               sub.stvars[pollutant.name].out_mt,
                                               sub.stvars[pollutant.name].out_msurf,
                                               sub.stvars[pollutant.name].out_mlat,
@@ -490,32 +422,228 @@ class Simulation:
                     sub.stvars[pollutant.name].reset0()
 
                 pg += 1
-                if self.mdl_struct.screenshow != 0:
+                if showpg:
                     self.pgbar.update(pg)
-        fhnd.close()
-
-    def write_hrurow(self, fhnd, date, subname, hruid, pollutant, mtrch, msurrch, mlatrch, mgwrch, mdgwrch, ctrch,
-                     clatrch, cgwrch, cdgwrch, ctsoil):
-        date = date.strftime("%Y-%m-%d")
-        row = f"{date},{subname},{hruid},{pollutant},{mtrch},{msurrch},{mlatrch},{mgwrch},{mdgwrch},{ctrch},{clatrch},{cgwrch},{cdgwrch},{ctsoil}\n"
-        fhnd.write(row)
-
-    def write_hruheader(self, fhnd):
-        headers = ",".join(
-            ["DATE", "SUB", "HRU", "POLLUTANT", "MTkg", "MSURkg", "MLATkg", "MGWkg", "MDGWkg", "CTng/L", "CLATng/L",
-             "CGWng/L", "CDGWng/L", "CTSOILng/L"]) + "\n"
-        fhnd.write(headers)
-
-    def write_subrow(self, fhnd, date, subname, pollutant, mtrch, msurrch, mlatrch, mgwrch, mdgwrch, mflux, mocp):
-        date = date.strftime("%Y-%m-%d")
-        row = f"{date},{subname},{pollutant},{mtrch},{msurrch},{mlatrch},{mgwrch},{mdgwrch},{mflux},{mocp}\n"
-        fhnd.write(row)
-
-    def write_subheader(self, fhnd):
-        headers = ",".join(
-            ["DATE", "SUB", "POLLUTANT", "MTkg", "MSURkg", "MLATkg", "MGWkg", "MDGWkg", "MFLUXkg", "MOCPkg"]) + "\n"
-        fhnd.write(headers)
+                if timing:
+                    tlast = lap("output", tlast)
+            if d in self.outdateseries:
+                if sink.write(d, hruday if hruout else None, subday):
+                    if self.mdl_struct.screenshow != 0:
+                        print("\nSimulation stopped by the output sink on {}.".format(d.date()))
+                    break
+            if timing:
+                tlast = lap("sink", tlast)
+        return self.finish_run(sink, output, cache, key, prof, (id + 1) * len(hrus))
+
+    def surface_chunk(self, t0, t1, bstart, lagr):
+        """
+        Surface process of a range of days for all the HRUs. The build-up and wash-off do not depend on the soil layer
+        or the aquifers, so the loads of all the days are computed first, then the surface lag storage is solved for
+        all the HRUs and pollutants at once (storages.surface_lag_series). The surface state variables are those of
+        the end of the range, also if the sink stops the simulation within the range (as with the kernel).
+        :param t0: first day of the range (index in the simulation period)
+        :param t1: end of the range (excluded), within the input block bound to the HRUs
+        :param bstart: first day of the bound input block
+        :param lagr: (HRU,) released fraction of the surface lag storage (storages.lag_factors)
+        :return: (day, HRU, pollutant) loads going into the soil layer and loads to the reach (kg), the HRUs in the
+                 order of mdl_struct.hruinput
+        """
+        pollutants = self.mdl_struct.pollutants
+        shape = (t1 - t0, len(lagr), len(pollutants))
+        mhrmvs = np.zeros(shape)
+        soilins = np.zeros(shape)
+        msurfstor = np.zeros(shape[1:])
+        for sub in self.mdl_struct.sublist:
+            for hru in sub.hrulist:
+                h = self.mdl_struct.hruinput.col[hru.id]
+                pcps = hru.input["PRECIP"][t0 - bstart:t1 - bstart]
+                smts = hru.input["SNOMELT"][t0 - bstart:t1 - bstart]
+                surqs = hru.input["SURQ"][t0 - bstart:t1 - bstart]
+                for k, pollutant in enumerate(pollutants):
+                    for t in range(t1 - t0):
+                        wat = pcps[t] + smts[t]
+                        surq = surqs[t]
+                        """
+                        I. SURFACE PROCESS:
+
+                        *Basic Principle:
+                        --Mass balance. accu = accu + bu - wo - decay; srmv = wat * crain + wo - decay
+
+                        *Assumptions: 
+                        --The mass removed by the rainfall process has 2 transport pathways: 1) exported by the surface runoff; 2) go into the soil layer.
+                        --For the rating curve method, the total wash-off load (including path1 and path2) is related to the rainfall.
+                        --The quantity into the surface runoff can be determined by the overall conc. and the surface runoff. If the rainfall event does
+                          not generate the surface runoff, then all the wash-off load will go into the soil layer.
+                        """
+
+                        if hru.usrlu[pollutant.name]:
+                            # the user defined LU settings have higher priority
+                            bmax = hru.bmax[pollutant.name]
+                            kbu = hru.kbu[pollutant.name]
+                            nbu = hru.nbu[pollutant.name]
+                        else:
+                            bmax = self.mdl_struct.lu[hru.lu].bmax[pollutant.name]
+                            kbu = self.mdl_struct.lu[hru.lu].kbu[pollutant.name]
+                            nbu = self.mdl_struct.lu[hru.lu].nbu[pollutant.name]
+
+                        if wat == 0:
+                            # 1. Dry days, build-up
+                            if self.mdl_struct.bumth == surface.sat_build_up:
+                                # saturation build-up -> does not need antecedent dry days, decay considered
+                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
+                                oriaccu = decay(oriaccu, pollutant.dsoil)
+                                mpa = self.mdl_struct.bumth(bmax, kbu, oriaccu)
+                            else:
+                                # exp, pow, half-sat build-up -> need antecedent dry days, decay not considered
+                                hru.stvars[pollutant.name].drydays += 1
+                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
+                                mpa = oriaccu  # exp, half-sat method, decay not considered, mass will be added on wet day
+                            mhrmv = 0
+                            csrmv = 0
+                            soilin = 0
+                        else:
+                            if self.mdl_struct.bumth == surface.sat_build_up:
+                                # 1. Wet days, no build-up for sat build-up
+                                oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
+                                oriaccu = decay(oriaccu, pollutant.dsoil)
+                                mpa = oriaccu
+                            else:
+                                # 1. Wet days, add the dry days build-up for exp, pow, half-sat methods
+                                if hru.stvars[pollutant.name].drydays != 0:
+                                    oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
+                                    # power, exp, half-sat build-up, mpa: mass per unit area, kg/km2
+                                    if self.mdl_struct.bumth == surface.power_build_up:
+                                        mpa = self.mdl_struct.bumth(bmax, kbu, nbu, oriaccu,
+                                                                    hru.stvars[pollutant.name].drydays)
+                                    else:
+                                        mpa = self.mdl_struct.bumth(bmax, kbu, oriaccu,
+                                                                    hru.stvars[pollutant.name].drydays)
+                                else:
+                                    oriaccu = hru.stvars[pollutant.name].maccu / hru.area  # kg/km2
+                                    mpa = oriaccu
+                                hru.stvars[pollutant.name].drydays = 0
 
+                            # 2. Mass (per unit area) of the pollutant in the generated surface runoff due to wet deposition
+                            if sub.usrflux[pollutant.name]:
+                                mrainh = surq * 10 ** 6 * sub.cprep[
+                                    pollutant.name] / 10 ** 12  # mm * km2 * 10**6 -> L  cprep: ng/L/10**12 -> kg/L  mrain:kg/HRU.AREA
+                                mrainv = (wat - surq) * 10 ** 6 * sub.cprep[pollutant.name] / 10 ** 12
+                            else:
+                                mrainh = surq * 10 ** 6 * pollutant.cprep / 10 ** 12  # mm * km2 * 10**6 -> L  cprep: ng/L/10**12 -> kg/L  mrain:kg/HRU.AREA
+                                mrainv = (wat - surq) * 10 ** 6 * pollutant.cprep / 10 ** 12
+                            # 3. Wash-off
+                            if hru.usrlu[pollutant.name]:
+                                # the user defined LU settings have higher priority
+                                kwov = hru.kwov[pollutant.name]
+                                nwov = hru.nwov[pollutant.name]
+                                kwoh = hru.kwoh[pollutant.name]
+                                nwoh = hru.nwoh[pollutant.name]
+                            else:
+                                kwov = self.mdl_struct.lu[hru.lu].kwov[pollutant.name]
+                                nwov = self.mdl_struct.lu[hru.lu].nwov[pollutant.name]
+                                kwoh = self.mdl_struct.lu[hru.lu].kwoh[pollutant.name]
+                                nwoh = self.mdl_struct.lu[hru.lu].nwoh[pollutant.name]
+                            if self.mdl_struct.womth == surface.exponential_wash_off:
+                                mpa, mwov = self.mdl_struct.womth(mpa,
+                                                                  kwov)  # nwo not used in the case of basic exponential_wash_off
+                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh)
+                            elif self.mdl_struct.womth == surface.exponential_wash_off_q:
+                                mpa, mwov = self.mdl_struct.womth(mpa, kwov,
+                                                                  wat - surq)  # for Q-driven exponential_wash_off_q
+                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh, surq)
+                            else:
+                                mpa, mwov = self.mdl_struct.womth(mpa, kwov, wat - surq,
+                                                                  nwov)  # rating curve -> removed mass directly related to the runoff intensity
+                                mpa, mwoh = self.mdl_struct.womth(mpa, kwoh, surq,
+                                                                  nwoh)  # rating curve -> removed mass directly related to the runoff intensity
+                            # 4. Mass Re-distribution
+                            mhrmv = (mrainh + mwoh) * hru.area
+                            if surq != 0:
+                                csrmv = (mhrmv / (
+                                            surq * hru.area)) * 10 ** 6  # conc. of surface removal: kg/(km2 * mm) = mg/L, mg/L = 10**6 ng/L
+                            else:
+                                csrmv = 0
+                            soilin = (mrainv + mwov) * hru.area  # Mass go into the soil layer due to the infiltration process, kg
+
+                        hru.stvars[pollutant.name].maccu = mpa * hru.area  # kg stored in the state variable
+                        hru.stvars[pollutant.name].csurf = csrmv
+                        hru.stvars[pollutant.name].msurf = mhrmv
+                        mhrmvs[t, h, k] = mhrmv
+                        soilins[t, h, k] = soilin
+                    msurfstor[h, k] = hru.stvars[pollutant.name].msurfstor
+
+        # kg mass to the river channel due to the time lag effect, with the decay of the mass stored in the traveling water
+        ### Note the Surlag parameter has some changes between different SWAT versions . See https://zhiqiangyu.wordpress.com/2014/07/16/swat-changes-from-rev-622-to-rev-627/
+        ### In the previous version it is a global value, thus for old versions the self.mdl_struct.glbparam["SURLAG"] is used (storages.lag_factors).
+        msurrch, msurfstor = storages.surface_lag_series(mhrmvs, msurfstor, np.array([p.dwat for p in pollutants]),
+                                                         lagr[:, None])
+        for sub in self.mdl_struct.sublist:
+            for hru in sub.hrulist:
+                h = self.mdl_struct.hruinput.col[hru.id]
+                for k, pollutant in enumerate(pollutants):
+                    hru.stvars[pollutant.name].msurfstor = msurfstor[h, k]
+        return soilins, msurrch
+
+    def finish_run(self, sink, output, cache, key, prof=None, hrudays=None):
+        """
+        Close the output sink and return (and cache) the results kept by the sink. The report of the profiled runs
+        is written to lcproj.profile.json/.txt in the SWAT_LC project folder.
+        """
+        self.pgbar.finish()
+        if prof is not None and prof.enabled:
+            tlast = time.perf_counter()
+        sink.close()
+        value = sink.to_xarray() if output == "xarray" else sink.result()
+        if key is not None:
+            cache.put(key, value)
+        if prof is not None and prof.enabled:
+            prof.timer.lap("close", tlast)
+            prof.stop()
+            self.profile = prof.write(self.mdl_struct.lcdir, self.mdl_struct.timer, hrudays)
+            if self.mdl_struct.screenshow != 0:
+                print("\n" + Profiler.text(self.profile))
+        return value
+
+    @staticmethod
+    def plan(SWATdir, LCdir, costs=None, memory=None):
+        """
+        Dry run: project the memory, the output size and the runtime of the simulation of a project without loading
+        the SWAT results, see planner.plan.
+        :return: dict of the plan (planner.text for a readable summary)
+        """
+        return planner.plan(SWATdir, LCdir, costs, memory)
+
+    def output_layout(self, hruout=None):
+        """
+        :param hruout: whether the HRU results are written, default: HRUOUT of the .sim file
+        :return: the layout of the output (outsink.OutputLayout), the DOC results are written if DOCOUT is on
+        """
+        if hruout is None:
+            hruout = self.mdl_struct.hruout != 0
+        dates = [d for d in self.dateseries if d in self.outdateseries]
+        pollutants = [p.name for p in self.mdl_struct.pollutants if p.name != "DOC" or self.mdl_struct.docout != 0]
+        subs = [sub.name for sub in self.mdl_struct.sublist]
+        hrus = [h.id for sub in self.mdl_struct.sublist for h in sub.hrulist]
+        hrusubs = [sub.name for sub in self.mdl_struct.sublist for h in sub.hrulist]
+        return OutputLayout(dates, subs, hrus, hrusubs, pollutants, hruout=hruout)
+
+
+def run_projects(projects, max_workers=None):
+    """
+    Load and run several SWAT_LC projects (e.g. scenarios) concurrently in one process.
+    All the project I/O is path-explicit, so the projects do not interfere with each other.
+    :param projects: list of (SWAT project folder, SWAT_LC project folder)
+    :param max_workers: max number of threads, default: one per project
+    :return: list of the Simulation objects (same order as the projects)
+    """
+    def load_and_run(swatdir, lcdir):
+        s = Simulation(swatdir, lcdir)
+        s.run()
+        return s
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(projects)) as executor:
+        futures = [executor.submit(load_and_run, swatdir, lcdir) for swatdir, lcdir in projects]
+        return [f.result() for f in futures]
 
 
 if __name__ == "__main__":
@@ -8,49 +8,69 @@ import numpy as np
 import pandas as pd
 import datetime
 from wqutils import PAH,DOC,Landuse,Soil
+from inputcube import InputCube
+from profiler import PhaseTimer, MODES as PROFILEMODES
+from runcache import swat_fingerprint
 from surface import power_build_up, exp_build_up, sat_build_up, half_sat_build_up
 from surface import exponential_wash_off,rating_curve_wash_off,exponential_wash_off_q
 
 
 class PROJmanager:
 
-    def __init__(self, swatdir, lcdir):
+    def __init__(self, swatdir, lcdir, dryrun=False, cubepath=None):
+        """
+        :param swatdir: SWAT project folder
+        :param lcdir: SWAT_LC project folder
+        :param dryrun: only scan the settings, the number of HRUs of each sub-basin (hrucount) and the pollutants,
+                       nothing else is loaded (capacity planning, see planner)
+        :param cubepath: memory-mapped file of the HRU inputs in the out-of-core mode (OUTOFCORE),
+                         default: lcproj.cube.npy in the SWAT_LC project folder
+        """
         self.bumth = None
         self.womth = None
         self.SWATTmp = None
+        self.SWATTmpStations = None
+        self.hruinput = None
+        self.fingerprint = None     # SWAT files of the loaded inputs (runcache.swat_fingerprint)
 
         self.swatdir = swatdir
-        os.chdir(self.swatdir)
+        self.lcdir = lcdir
+        self.cubepath = cubepath if cubepath is not None else os.path.join(lcdir, "lcproj.cube.npy")
         self.settings = {}
         self.glbparam = {}
-        self.scan_swat_settings()
-        self.scan_swat_glbparams()
+        self.timer = PhaseTimer()   # time of each loading step
+        timed = self.timer.timed
+        timed(self.scan_swat_settings)
+        timed(self.scan_swat_glbparams)
+        timed(self.scan_lc_settings)  # the simulation period is required for loading the SWAT results
         self.sublist = []
-        self.scan_sub()
-        self.load_swat_result()  # input series for the SWAT_LC
-        self.lcdir = lcdir
-        os.chdir(self.lcdir)
+        if dryrun:
+            timed(self.count_hru)
+            self.pollutants = []
+            timed(self.scan_lc_pollutants)
+            return
+        timed(self.scan_sub)
+        timed(self.load_swat_result)  # input series for the SWAT_LC
         self.lu = {}
         self.pollutants = []
         self.soils = {}
-        self.scan_lc_pollutants()
-        self._pollutant_sequence()
-        self.scan_lc_landuse()
-        self.scan_lc_settings()
-        self.scan_lc_sol()
-        self.check_conflict()
-        self.ini_state_vars()
-        self.set_ini_cond()
-        self.scan_usr_lu_params()
-        self.scan_usr_flux()
-        self.scan_usr_sol()
-        self.scan_lc_ocp()
-        self.cliptmp()
+        timed(self.scan_lc_pollutants)
+        timed(self._pollutant_sequence)
+        timed(self.scan_lc_landuse)
+        timed(self.scan_lc_sol)
+        timed(self.check_conflict)
+        timed(self.ini_state_vars)
+        timed(self.set_ini_cond)
+        timed(self.scan_usr_lu_params)
+        timed(self.scan_usr_flux)
+        timed(self.scan_usr_sol)
+        timed(self.scan_lc_ocp)
+        timed(self.cliptmp)
 
 
     def scan_swat_settings(self):
         print("Scanning SWAT simulation settings...")
-        cio = ParamIO("file.cio")
+        cio = ParamIO(os.path.join(self.swatdir, "file.cio"))
         self.settings["NBYR"] = cio.parameters["NBYR"]
         self.settings["IYR"] = cio.parameters["IYR"]
         self.settings["IDAF"] = cio.parameters["IDAF"]
@@ -59,14 +79,14 @@ class PROJmanager:
 
     def scan_swat_glbparams(self):
         print("Scanning SWAT global parameters...")
-        bsn = ParamIO("basins.bsn")
+        bsn = ParamIO(os.path.join(self.swatdir, "basins.bsn"))
         self.glbparam["SURLAG"] = bsn.parameters["SURLAG"]
 
     def scan_lc_settings(self):
         print("Loading SWAT_LC pollutant parameters...")
         budict = {0:power_build_up, 1:exp_build_up, 2:sat_build_up,3:half_sat_build_up}
         wodict = {0:exponential_wash_off,1:exponential_wash_off_q,2:rating_curve_wash_off}
-        flist = glob.glob(self.lcdir + "\*.sim")
+        flist = glob.glob(os.path.join(self.lcdir, "*.sim"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 global setting files in the project folder.")
         elif len(flist) == 0:
@@ -86,6 +106,18 @@ class PROJmanager:
             initype = config.get("General Settings", "INITYPE")
             flagwater = config.get("General Settings", "FWATER")
             riverflux = int(config.get("General Settings", "RIVERFLUX"))
+            tmpgage = int(config.get("General Settings", "TMPGAGE", fallback=0))
+            simstart = config.get("General Settings", "SIMSTART", fallback=None)
+            simend = config.get("General Settings", "SIMEND", fallback=None)
+            outofcore = int(config.get("General Settings", "OUTOFCORE", fallback=0))
+            blockdays = int(config.get("General Settings", "BLOCKDAYS", fallback=365))
+            outindex = int(config.get("General Settings", "OUTINDEX", fallback=0))
+            outsink = config.get("General Settings", "OUTSINK", fallback="csv")
+            outsinkurl = config.get("General Settings", "OUTSINKURL", fallback=None)
+            engine = config.get("General Settings", "ENGINE", fallback="python").lower()
+            profile = config.get("General Settings", "PROFILE", fallback="off").lower()
+            progress = config.get("General Settings", "PROGRESS", fallback="bar").lower()
+            progressinterval = float(config.get("General Settings", "PROGRESSINTERVAL", fallback=1.0))
         self.bumth = budict[bumth]
         self.womth = wodict[womth]
         self.outstart = datetime.datetime.strptime(outstart,"%Y-%m-%d")
@@ -97,15 +129,43 @@ class PROJmanager:
         self.flagwater = flagwater
         self.docmth = docmth
         self.riverflux = riverflux
+        self.tmpgage = tmpgage
+        self.outofcore = outofcore
+        self.blockdays = blockdays
+        self.outindex = outindex
+        self.outsink = outsink
+        self.outsinkurl = outsinkurl
+        if engine not in ("python", "jit"):
+            raise ValueError("The simulation engine (ENGINE) should be python or jit.")
+        self.engine = engine
+        if profile not in PROFILEMODES:
+            raise ValueError("The profiling mode (PROFILE) should be one of {}.".format(", ".join(PROFILEMODES)))
+        self.profile = profile
+        if progress not in ("bar", "json", "off"):
+            raise ValueError("The progress mode (PROGRESS) should be bar, json or off.")
+        self.progress = progress
+        self.progressinterval = progressinterval
+
+        # simulation period, the whole SWAT simulation period by default
+        swatstart = datetime.datetime(year=self.settings["IYR"] + self.settings["NYSKIP"], month=1, day=1) \
+                    + datetime.timedelta(days=self.settings["IDAF"] - 1)
+        swatend = datetime.datetime(year=self.settings["IYR"] + self.settings["NBYR"] - 1, month=1, day=1) \
+                  + datetime.timedelta(days=self.settings["IDAL"] - 1)
+        self.swatstart = swatstart
+        self.swatend = swatend
+        self.simstart = datetime.datetime.strptime(simstart, "%Y-%m-%d") if simstart else swatstart
+        self.simend = datetime.datetime.strptime(simend, "%Y-%m-%d") if simend else swatend
+        if self.simstart < swatstart or self.simend > swatend or self.simstart > self.simend:
+            raise ValueError("The simulation period should be within the SWAT simulation period.")
 
 
     def scan_sub(self):
         print("Scanning SWAT project structure...")
-        subpath = glob.glob("*.sub")
-        subpath.remove("output.sub")
+        subpath = sorted(glob.glob(os.path.join(self.swatdir, "*.sub")))
+        subpath.remove(os.path.join(self.swatdir, "output.sub"))
         for p in subpath:
-            subname = int(p[:5])
-            subobj = SUBBASIN(name=subname)
+            subname = int(os.path.basename(p)[:5])
+            subobj = SUBBASIN(name=subname, swatdir=self.swatdir)
             subobj.scan_hru(subname,subobj.area)
             rtepath = p[:-4] + ".rte"
             rparam = ParamIO(rtepath)
@@ -117,62 +177,49 @@ class PROJmanager:
             self.sublist.append(subobj)
 
 
+    def count_hru(self):
+        """
+        Number of HRUs of each sub-basin from the names of the .sub and .hru files, no file is parsed.
+        """
+        files = os.listdir(self.swatdir)
+        subs = sorted(int(f[:5]) for f in files if f.endswith(".sub") and f != "output.sub")
+        self.hrucount = dict.fromkeys(subs, 0)
+        for f in files:
+            if f.endswith(".hru") and f[:5].isdigit() and int(f[:5]) in self.hrucount:
+                self.hrucount[int(f[:5])] += 1
+
     def load_swat_result(self):
         print("Loading SWAT simulation results...")
-        reader = SWATreader(self.swatdir)
-        reader.read_hru()
+        # fingerprint of the loaded SWAT inputs, used by all the runs of the project (run cache)
+        self.fingerprint = swat_fingerprint(self.swatdir)
+        # only the days within the simulation period are read
         reader2 = SWATreader(self.swatdir)
-        reader2.read_sub()
+        reader2.read_sub(self.simstart, self.simend)
         reader3 = SWATreader(self.swatdir)
-        reader3.read_rch()
+        reader3.read_rch(self.simstart, self.simend)
         reader4 = SWATreader(self.swatdir)
-        tmpdf = reader4.read_TMP()              # read the temperature file, currently using the observed temperature
-        self.SWATTmp = tmpdf
+        tmpstations = reader4.read_TMP_stations()   # read the temperature file, currently using the observed temperature
+        self.SWATTmp = reader4.read_TMP(tmpstations)
+        self.SWATTmpStations = SWATreader.station_avg_TMP(tmpstations)
         for s in self.sublist:
             subpcp = reader2.inquireSUB(s.name, "PRECIPmm")
             rchflow = reader3.inquireRchFlow(s.name)
             s.add_input("PRECIP",subpcp)
             s.add_input("Flow",rchflow)
-            for h in s.hrulist:
-                pcp = reader.inquireHRU(h.id,"PRECIPmm")
-                perc = reader.inquireHRU(h.id,"PERCmm")
-                surq = reader.inquireHRU(h.id,"SURQ_GENmm")
-                surqrch = reader.inquireHRU(h.id, "SURQ_CNTmm")
-                swini = reader.inquireHRU(h.id, "SW_INITmm")
-                swend = reader.inquireHRU(h.id, "SW_ENDmm")
-                gwrchg = reader.inquireHRU(h.id, "GW_RCHGmm")
-                latq = reader.inquireHRU(h.id, "LATQGENmm")
-                latqrch = reader.inquireHRU(h.id,"LATQCNTmm")
-                wyld = reader.inquireHRU(h.id, "WYLDmm")
-                revap = reader.inquireHRU(h.id, "REVAPmm")
-                sast = reader.inquireHRU(h.id, "SA_STmm")
-                dast = reader.inquireHRU(h.id, "DA_STmm")
-                tloss = reader.inquireHRU(h.id, "TLOSSmm")
-                snowmelt = reader.inquireHRU(h.id, "SNOMELTmm")
-                gwq = reader.inquireHRU(h.id,"GW_Qmm")
-                dgwq = reader.inquireHRU(h.id,"GW_Q_Dmm")
-
-                h.add_input("PRECIP",pcp)
-                h.add_input("PERC",perc)
-                h.add_input("SURQ",surq)
-                h.add_input("SWINI",swini)
-                h.add_input("SWEND", swend)
-                h.add_input("GWRCHG",gwrchg)
-                h.add_input("LATQ",latq)
-                h.add_input("LATQRCH",latqrch)
-                h.add_input("WYLD", wyld)
-                h.add_input("REVAP", revap)
-                h.add_input("SAST",sast)
-                h.add_input("DAST",dast)
-                h.add_input("TLOSS",tloss)
-                h.add_input("SNOMELT",snowmelt)
-                h.add_input("SURQRCH", surqrch)
-                h.add_input("GWQ",gwq)
-                h.add_input("DGWQ",dgwq)
+
+        # HRU input series, memory-mapped file in the out-of-core mode, see inputcube.HRUVARS for the variables
+        hrus = [h for s in self.sublist for h in s.hrulist]
+        ndays = (self.simend - self.simstart).days + 1
+        if self.outofcore != 0:
+            self.hruinput = InputCube([h.id for h in hrus], ndays, self.cubepath, self.blockdays)
+        else:
+            self.hruinput = InputCube([h.id for h in hrus], ndays)
+        self.hruinput.fill(SWATreader(self.swatdir), self.simstart)
+        self.hruinput.bind(hrus, *next(self.hruinput.blocks()))
 
     def scan_lc_pollutants(self):
         print("Loading SWAT_LC pollutant parameters...")
-        flist = glob.glob(self.lcdir + "\*.plt")
+        flist = glob.glob(os.path.join(self.lcdir, "*.plt"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 pollutant setting files in the project folder.")
         elif len(flist) == 0:
@@ -204,7 +251,7 @@ class PROJmanager:
 
     def scan_lc_landuse(self):
         #print("Loading SWAT_LC landuse parameters...")
-        flist = glob.glob(self.lcdir + "\*.lu")
+        flist = glob.glob(os.path.join(self.lcdir, "*.lu"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 landuse setting files in the project folder.")
         elif len(flist) == 0:
@@ -227,7 +274,7 @@ class PROJmanager:
 
     def scan_lc_sol(self):
         print("Loading SWAT_LC soil parameters...")
-        flist = glob.glob(self.lcdir + "\*.sol")
+        flist = glob.glob(os.path.join(self.lcdir, "*.sol"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 pollutant setting files in the project folder.")
         elif len(flist) == 0:
@@ -238,33 +285,40 @@ class PROJmanager:
             raise RuntimeError("There is not DOC settings in the .sol file, it is a mandatory pollutant species.")
         plist = list(set(df["POLLUTANT"].values))
         slist = list(set(df["SOIL"].values))
+        index = index_table(df, ["SOIL", "POLLUTANT"])
         for s in slist:
             obj = Soil(s)
             for p in plist:
-                row = df[(df["SOIL"]==s) & (df["POLLUTANT"]==p)]
-                obj.fdoc[p] = float(row["fdoc"].values)
-                obj.cbase[p] = float(row["cbase"].values)
-                obj.geoflx[p] = float(row["geoflx"].values)
+                rows = index.get((s, p), [])
+                if len(rows) != 1:
+                    raise RuntimeError("The .sol file should have exactly 1 row for soil {} and pollutant {}.".format(s, p))
+                obj.fdoc[p] = float(rows[0].fdoc)
+                obj.cbase[p] = float(rows[0].cbase)
+                obj.geoflx[p] = float(rows[0].geoflx)
             self.soils[s] = obj
 
     def check_conflict(self):
-        flist = glob.glob(self.lcdir + "\*.conflict")
+        flist = glob.glob(os.path.join(self.lcdir, "*.conflict"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 conflict setting files in the project folder.")
         elif len(flist) == 0:
             raise FileNotFoundError("There is no SWAT_LC conflict setting file in the folder.")
         conflictf = flist[0]
         df = pd.read_csv(conflictf, header=0)
-        conflictsoil = list(set(df["SOIL"].values))
+        pairs = index_table(df, ["SOIL", "LU"])
+        soils = index_table(df, ["SOIL"])
         for s in self.sublist:
             for h in s.hrulist:
-                if h.soiltype in conflictsoil:
-                    if len(df[(df["SOIL"]==h.soiltype) & (df["LU"]==h.lu)])>0:
-                        h.soiltype = df[(df["SOIL"]==h.soiltype) & (df["LU"]==h.lu)]["RSOIL"].values[0]
-                        h.lutype = df[(df["SOIL"] == h.soiltype) & (df["LU"] == h.lu)]["RLU"].values[0]
-                    elif df[df["SOIL"]==h.soiltype]["LU"].values[0] =="ANY":
-                        h.soiltype = df[df["SOIL"] == h.soiltype]["RSOIL"].values[0]
-                        h.lu = df[df["SOIL"] == h.soiltype]["RLU"].values[0]
+                if (h.soiltype,) in soils:
+                    # the exact soil-landuse pair has higher priority than the "ANY" landuse setting
+                    if (h.soiltype, h.lu) in pairs:
+                        r = pairs[(h.soiltype, h.lu)][0]
+                    elif soils[(h.soiltype,)][0].LU == "ANY":
+                        r = soils[(h.soiltype,)][0]
+                    else:
+                        continue
+                    h.soiltype = r.RSOIL
+                    h.lu = r.RLU
 
     def ini_state_vars(self):
         print("Initializing SWAT_LC state variables...")
@@ -279,66 +333,81 @@ class PROJmanager:
     def set_ini_cond(self):
         print("Setting initial conditions...")
         # scan the global initial condition settings
-        flist = glob.glob(self.lcdir + "\*.init")
+        flist = glob.glob(os.path.join(self.lcdir, "*.init"))
         if len(flist) > 1:
             raise RuntimeError("There are more than 1 initial condition files in the project folder.")
         if len(flist) == 1:
             condfile = flist[0]
             df = pd.read_csv(condfile,header=0)
+            if self.initype == "SOIL":
+                index = index_table(df, ["SOIL", "POLLUTANT"])
+            elif self.initype == "LU":
+                index = index_table(df, ["LANDUSE", "POLLUTANT"])
+            elif self.initype == "SOIL-LU":
+                index = index_table(df, ["LANDUSE", "SOIL", "POLLUTANT"])
+            else:
+                raise NotImplementedError("The setting of initial condition only accepts SOIL, LU, or SOIL-LU.")
             for s in self.sublist:
                 for h in s.hrulist:
                     for p in self.pollutants:
                         if self.initype == "SOIL":
-                            inir = df[(df["SOIL"] == h.soiltype) & (df["POLLUTANT"] == p.name)]
+                            inir = index.get((h.soiltype, p.name), [])
                         elif self.initype == "LU":
-                            inir = df[(df["LANDUSE"] == h.lu) & (df["POLLUTANT"] == p.name)]
-                        elif self.initype == "SOIL-LU":
-                            inir = df[(df["LANDUSE"] == h.lu) & (df["SOIL"] == h.soiltype) & (df["POLLUTANT"] == p.name)]
+                            inir = index.get((h.lu, p.name), [])
                         else:
-                            raise NotImplementedError("The setting of initial condition only accepts SOIL, LU, or SOIL-LU.")
+                            inir = index.get((h.lu, h.soiltype, p.name), [])
                         if len(inir) > 0:
-                            ctsoil = float(inir["ctsoil"].values)
+                            ctsoil = float(inir[0].ctsoil)
                             msoil = ctsoil * h.vsoil / 10**9    # kg
                             h.stvars[p.name].msoil = msoil
 
         # scan the user defined initial condition settings
         # the user-specific settings have higher priority
-        fusrlist = glob.glob(self.lcdir + "\*.usrinit")
+        fusrlist = glob.glob(os.path.join(self.lcdir, "*.usrinit"))
         if len(fusrlist) > 1:
             raise RuntimeError("There are more than 1 user-specific initial condition files in the project folder.")
         if len(fusrlist) == 1:
             usrfile = fusrlist[0]
             df2 = pd.read_csv(usrfile,header=0)
-            subdf2 = df2[df2["CTLTYPE"]=="SUB"]
-            hrudf2 = df2[df2["CTLTYPE"]=="HRU"]
-            subval = subdf2["ID"].values
-            hruval = hrudf2["ID"].values
-            if len(subdf2.index) > 0:
-                for s in self.sublist:
-                    if s.name in subval:
-                        for p in self.pollutants:
-                            row = subdf2[(subdf2["ID"]==s.name) & (subdf2["POLLUTANT"]==p.name)]
-                            if len(row.index) == 1:  # only valid if there is no conflict
-                                for sh in s.hrulist:
-                                    ctsoil = float(row["ctsoil"].values)
-                                    msoil = ctsoil * sh.vsoil / 10 ** 9  # kg
-                                    sh.stvars[p.name].msoil = msoil
-                            elif len(row.index) > 1:
-                                raise UserWarning("There are some conflicts in the user-specific sub-basin ini condition settings.")
-
-            if len(hrudf2.index) > 0:
-                for s in self.sublist:
-                    for sh in s.hrulist:
-                        if sh.id in hruval:
-                            for p in self.pollutants:
-                                row = hrudf2[(hrudf2["ID"] == sh.id) & (hrudf2["POLLUTANT"] == p.name)]
-                                if len(row.index) == 1:  # only valid if there is no conflict
-                                    ctsoil = float(row["ctsoil"].values)
-                                    msoil = ctsoil * sh.vsoil / 10 ** 9  # kg
-                                    sh.stvars[p.name].msoil = msoil
-                                elif len(row.index) > 1:
-                                    raise UserWarning("There are some conflicts in the user-specific hru ini condition settings.")
+            subidx = index_table(df2[df2["CTLTYPE"]=="SUB"], ["ID", "POLLUTANT"])
+            hruidx = index_table(df2[df2["CTLTYPE"]=="HRU"], ["ID", "POLLUTANT"])
+            for s in self.sublist:
+                for p in self.pollutants:
+                    rows = subidx.get((s.name, p.name), [])
+                    if len(rows) == 1:  # only valid if there is no conflict
+                        ctsoil = float(rows[0].ctsoil)
+                        for sh in s.hrulist:
+                            msoil = ctsoil * sh.vsoil / 10 ** 9  # kg
+                            sh.stvars[p.name].msoil = msoil
+                    elif len(rows) > 1:
+                        raise UserWarning("There are some conflicts in the user-specific sub-basin ini condition settings.")
 
+            for s in self.sublist:
+                for sh in s.hrulist:
+                    for p in self.pollutants:
+                        rows = hruidx.get((sh.id, p.name), [])
+                        if len(rows) == 1:  # only valid if there is no conflict
+                            ctsoil = float(rows[0].ctsoil)
+                            msoil = ctsoil * sh.vsoil / 10 ** 9  # kg
+                            sh.stvars[p.name].msoil = msoil
+                        elif len(rows) > 1:
+                            raise UserWarning("There are some conflicts in the user-specific hru ini condition settings.")
+
+        # initial soil mass of each HRU, used to reset the state variables
+        self.inimsoil = {(h.id, p.name): h.stvars[p.name].msoil
+                         for s in self.sublist for h in s.hrulist for p in self.pollutants}
+
+    def reset_state(self):
+        """
+        Reset the state variables to the initial conditions, so that the loaded project can be simulated again
+        (e.g. calibration runs).
+        """
+        for s in self.sublist:
+            for p in self.pollutants:
+                s.add_state_vars(p.name, StateVariables(p.name))
+                for h in s.hrulist:
+                    h.add_state_vars(p.name, StateVariables(p.name))
+                    h.stvars[p.name].msoil = self.inimsoil[(h.id, p.name)]
 
     def _pollutant_sequence(self):
         for p in self.pollutants:
@@ -351,54 +420,29 @@ class PROJmanager:
 
     def scan_usr_lu_params(self):
         # scan the user-defined LU parameters (designed for regional variability)
-        usrluflist = glob.glob(self.lcdir + "\*.usrlu")
+        usrluflist = glob.glob(os.path.join(self.lcdir, "*.usrlu"))
         if len(usrluflist) > 1:
             raise RuntimeError("There are more than 1 user-specific initial condition files in the project folder.")
         if len(usrluflist) == 1:
             usrlu = usrluflist[0]
             df = pd.read_csv(usrlu, header=0)
-            subdf = df[df["CTLTYPE"]=="SUB"]
-            hrudf = df[df["CTLTYPE"]=="HRU"]
-            subval = subdf["ID"].values
-            hruval = hrudf["ID"].values
+            subidx = index_table(df[df["CTLTYPE"]=="SUB"], ["ID", "POLLUTANT"])
+            hruidx = index_table(df[df["CTLTYPE"]=="HRU"], ["ID", "POLLUTANT"])
             for s in self.sublist:
-                if s.name in subval:
-                    for p in self.pollutants:
-                        row = subdf[(subdf["ID"] == s.name) & (subdf["POLLUTANT"] == p.name)]
-                        if len(row.index) == 1:  # only valid if there is no conflict
-                            for sh in s.hrulist:
-                                sh.usrlu[p.name] = True
-                                sh.bmax[p.name] = float(row["bmax"].values)
-                                sh.kbu[p.name] = float(row["kbu"].values)
-                                sh.nbu[p.name] = float(row["nbu"].values)
-                                sh.kwov[p.name] = float(row["kwov"].values)
-                                sh.nwov[p.name] = float(row["nwov"].values)
-                                sh.kwoh[p.name] = float(row["kwoh"].values)
-                                sh.nwoh[p.name] = float(row["nwoh"].values)
-
-                        else:
-                            for sh in s.hrulist:
-                                sh.usrlu[p.name] = False
-
-                else:
+                for p in self.pollutants:
+                    rows = subidx.get((s.name, p.name), [])
                     for sh in s.hrulist:
-                        for p in self.pollutants:
+                        if len(rows) == 1:  # only valid if there is no conflict
+                            self._set_usr_lu(sh, p.name, rows[0])
+                        else:
                             sh.usrlu[p.name] = False
 
                 # overwrite the sub-basin setting using the hru setting
                 for sh in s.hrulist:
-                    if sh.id in hruval:
-                        for p in self.pollutants:
-                            rowadv = hrudf[(hrudf["ID"] == sh.id) & (hrudf["POLLUTANT"] == p.name)]
-                            if len(rowadv.index) == 1:
-                                sh.usrlu[p.name] = True
-                                sh.bmax[p.name] = float(rowadv["bmax"].values)
-                                sh.kbu[p.name] = float(rowadv["kbu"].values)
-                                sh.nbu[p.name] = float(rowadv["nbu"].values)
-                                sh.kwov[p.name] = float(rowadv["kwov"].values)
-                                sh.nwov[p.name] = float(rowadv["nwov"].values)
-                                sh.kwoh[p.name] = float(rowadv["kwoh"].values)
-                                sh.nwoh[p.name] = float(rowadv["nwoh"].values)
+                    for p in self.pollutants:
+                        rowadv = hruidx.get((sh.id, p.name), [])
+                        if len(rowadv) == 1:
+                            self._set_usr_lu(sh, p.name, rowadv[0])
 
         else:
             for s in self.sublist:
@@ -406,26 +450,33 @@ class PROJmanager:
                     for sh in s.hrulist:
                         sh.usrlu[p.name] = False
 
+    @staticmethod
+    def _set_usr_lu(hru, pname, r):
+        hru.usrlu[pname] = True
+        hru.bmax[pname] = float(r.bmax)
+        hru.kbu[pname] = float(r.kbu)
+        hru.nbu[pname] = float(r.nbu)
+        hru.kwov[pname] = float(r.kwov)
+        hru.nwov[pname] = float(r.nwov)
+        hru.kwoh[pname] = float(r.kwoh)
+        hru.nwoh[pname] = float(r.nwoh)
+
     def scan_usr_flux(self):
-        usrfluxflist = glob.glob(self.lcdir + "\*.usrflux")
+        usrfluxflist = glob.glob(os.path.join(self.lcdir, "*.usrflux"))
         if len(usrfluxflist) > 1:
             raise RuntimeError("There are more than 1 user-specific flux setting files in the project folder.")
         if len(usrfluxflist) == 1:
             usrflux = usrfluxflist[0]
             df = pd.read_csv(usrflux, header=0)
-            subval = df["RCH"].values
+            index = index_table(df, ["RCH", "POLLUTANT"])
             for s in self.sublist:
-                if s.name in subval:
-                    for p in self.pollutants:
-                        row = df[(df["RCH"] == s.name) & (df["POLLUTANT"] == p.name)]
-                        if len(row.index) == 1:
-                            s.usrflux[p.name] = True
-                            s.cprep[p.name] = float(row["cprep"].values)
-                            s.riverflux[p.name] = float(row["riverflux"].values)
-                        else:
-                            s.usrflux[p.name] = False
-                else:
-                    for p in self.pollutants:
+                for p in self.pollutants:
+                    rows = index.get((s.name, p.name), [])
+                    if len(rows) == 1:
+                        s.usrflux[p.name] = True
+                        s.cprep[p.name] = float(rows[0].cprep)
+                        s.riverflux[p.name] = float(rows[0].riverflux)
+                    else:
                         s.usrflux[p.name] = False
         else:
             for s in self.sublist:
@@ -433,67 +484,50 @@ class PROJmanager:
                     s.usrflux[p.name] = False
 
     def scan_lc_ocp(self):
-        outcropflist = glob.glob(self.lcdir + "\*.ocp")
+        outcropflist = glob.glob(os.path.join(self.lcdir, "*.ocp"))
         if len(outcropflist) > 1:
             raise RuntimeError("There are more than 1 outcrop erosion setting files in the project folder.")
         if len(outcropflist) == 1:
             outcrops = outcropflist[0]
             df = pd.read_csv(outcrops, header=0)
-            subval = df["RCH"].values
+            index = index_table(df, ["RCH", "POLLUTANT"])
             for s in self.sublist:
-                if s.name in subval:
-                    for p in self.pollutants:
-                        row = df[(df["RCH"] == s.name) & (df["POLLUTANT"] == p.name)]
-                        if len(row.index) == 1:
-                            s.hasoutcrop = True
-                            s.cocp[p.name] = float(row["COCP"].values)
-                            s.kocp[p.name] = float(row["KOCP"].values)
-                            s.nocp[p.name] = float(row["NOCP"].values)
-                            s.qwcr[p.name] = float(row["QWCR"].values)
-                            s.ea[p.name] = float(row["EA"].values)
-                            s.t0[p.name] = float(row["T0"].values)
+                for p in self.pollutants:
+                    rows = index.get((s.name, p.name), [])
+                    if len(rows) == 1:
+                        r = rows[0]
+                        s.hasoutcrop = True
+                        s.cocp[p.name] = float(r.COCP)
+                        s.kocp[p.name] = float(r.KOCP)
+                        s.nocp[p.name] = float(r.NOCP)
+                        s.qwcr[p.name] = float(r.QWCR)
+                        s.ea[p.name] = float(r.EA)
+                        s.t0[p.name] = float(r.T0)
 
     def scan_usr_sol(self):
-        usrsolflist = glob.glob(self.lcdir + "\*.usrsol")
+        usrsolflist = glob.glob(os.path.join(self.lcdir, "*.usrsol"))
         if len(usrsolflist) > 1:
             raise RuntimeError("There are more than 1 user-specific soil setting files in the project folder.")
         if len(usrsolflist) == 1:
             usrsol = usrsolflist[0]
             df = pd.read_csv(usrsol, header=0)
-            subdf = df[df["CTLTYPE"] == "SUB"]
-            hrudf = df[df["CTLTYPE"] == "HRU"]
-            subval = subdf["ID"].values
-            hruval = hrudf["ID"].values
+            subidx = index_table(df[df["CTLTYPE"] == "SUB"], ["ID", "POLLUTANT"])
+            hruidx = index_table(df[df["CTLTYPE"] == "HRU"], ["ID", "POLLUTANT"])
             for s in self.sublist:
-                if s.name in subval:
-                    for p in self.pollutants:
-                        row = subdf[(subdf["ID"] == s.name) & (subdf["POLLUTANT"] == p.name)]
-                        if len(row.index) == 1:  # only valid if there is no conflict
-                            for sh in s.hrulist:
-                                sh.usrsol[p.name] = True
-                                sh.fdoc[p.name] = float(row["fdoc"].values)
-                                sh.cbase[p.name] = float(row["cbase"].values)
-                                sh.geoflux[p.name] = float(row["geoflx"].values)
-
-                        else:
-                            for sh in s.hrulist:
-                                sh.usrsol[p.name] = False
-
-                else:
+                for p in self.pollutants:
+                    rows = subidx.get((s.name, p.name), [])
                     for sh in s.hrulist:
-                        for p in self.pollutants:
+                        if len(rows) == 1:  # only valid if there is no conflict
+                            self._set_usr_sol(sh, p.name, rows[0])
+                        else:
                             sh.usrsol[p.name] = False
 
                 # overwrite the sub-basin setting using the hru setting
                 for sh in s.hrulist:
-                    if sh.id in hruval:
-                        for p in self.pollutants:
-                            rowadv = hrudf[(hrudf["ID"] == sh.id) & (hrudf["POLLUTANT"] == p.name)]
-                            if len(rowadv.index) == 1:
-                                sh.usrsol[p.name] = True
-                                sh.fdoc[p.name] = float(rowadv["fdoc"].values)
-                                sh.cbase[p.name] = float(rowadv["cbase"].values)
-                                sh.geoflux[p.name] = float(rowadv["geoflx"].values)
+                    for p in self.pollutants:
+                        rowadv = hruidx.get((sh.id, p.name), [])
+                        if len(rowadv) == 1:
+                            self._set_usr_sol(sh, p.name, rowadv[0])
 
         else:
             for s in self.sublist:
@@ -501,23 +535,52 @@ class PROJmanager:
                     for sh in s.hrulist:
                         sh.usrsol[p.name] = False
 
+    @staticmethod
+    def _set_usr_sol(hru, pname, r):
+        hru.usrsol[pname] = True
+        hru.fdoc[pname] = float(r.fdoc)
+        hru.cbase[pname] = float(r.cbase)
+        hru.geoflux[pname] = float(r.geoflx)
+
     def cliptmp(self):
-        start = pd.to_datetime(datetime.date(year=self.settings["IYR"] + self.settings["NYSKIP"], month= 1, day=1) \
-                     + datetime.timedelta(days=self.settings["IDAF"] - 1))
-        end = pd.to_datetime(datetime.date(year=self.settings["IYR"] + self.settings["NBYR"] - 1, month= 1, day=1) \
-                     + datetime.timedelta(days=self.settings["IDAL"] - 1))
+        start = pd.to_datetime(self.simstart)
+        end = pd.to_datetime(self.simend)
 
         mask = (self.SWATTmp['Date'] >= start) & (self.SWATTmp['Date'] <= end)
         filtered_df = self.SWATTmp[mask]
         filtered_df.loc[:,"AvgTmp"] = filtered_df["AvgTmp"].interpolate()
         self.SWATTmp = np.array(filtered_df["AvgTmp"])
 
+        # air temperature for the outcrop erosion of each sub-basin: the temperature gage of the sub-basin
+        # (ITGAGE in the .sub file) if TMPGAGE is on, otherwise the basin average
+        stations = self.SWATTmpStations.loc[start:end].interpolate()
+        for s in self.sublist:
+            if self.tmpgage != 0 and s.NORparam["ITGAGE"] in stations.columns:
+                s.add_input("TMP", np.array(stations[s.NORparam["ITGAGE"]]))
+            else:
+                s.add_input("TMP", self.SWATTmp)
+
+
+
+def index_table(df, keys):
+    """
+    Group the rows of a SWAT_LC setting table by the key columns, so that the HRU/sub-basin loops
+    can look up their settings directly instead of filtering the whole table each time.
+    :param df: setting table (DataFrame)
+    :param keys: list of the key column names
+    :return: dict {tuple of key values: list of rows (namedtuple)}
+    """
+    index = {}
+    for r in df.itertuples(index=False):
+        index.setdefault(tuple(getattr(r, k) for k in keys), []).append(r)
+    return index
 
 
 class SUBBASIN:
 
-    def __init__(self,name):
+    def __init__(self,name,swatdir):
         self.name = name
+        self.swatdir = swatdir
         self.hrulist = []
         self.NORparam = {}
         self.area = self.scan_param()
@@ -540,14 +603,14 @@ class SUBBASIN:
 
 
     def scan_hru(self,subname,subarea):
-        hrupath = glob.glob("{}*.hru".format(str(self.name).zfill(5)))
+        hrupath = sorted(glob.glob(os.path.join(self.swatdir, "{}*.hru".format(str(self.name).zfill(5)))))
         for p in hrupath:
-            hruname = int(p[5:9])
-            hruobj = HRU(subname,subarea,hruname)
+            hruname = int(os.path.basename(p)[5:9])
+            hruobj = HRU(subname,subarea,hruname,self.swatdir)
             self.hrulist.append(hruobj)
 
     def scan_param(self):
-        fname = str(self.name).zfill(5) + "0000"
+        fname = os.path.join(self.swatdir, str(self.name).zfill(5) + "0000")
         fsub = ParamIO(fname + ".sub")
         area = fsub.parameters["SUB_KM"]
         self.NORparam["SUB_KM"] = fsub.parameters["SUB_KM"]
@@ -555,6 +618,7 @@ class SUBBASIN:
         self.NORparam["CH_S1"] = fsub.parameters["CH_S1"]
         self.NORparam["CH_W1"] = fsub.parameters["CH_W1"]
         self.NORparam["CH_N1"] = fsub.parameters["CH_N1"]
+        self.NORparam["ITGAGE"] = fsub.parameters.get("ITGAGE", 0)   # temperature gage of the sub-basin
         return area
 
     def __repr__(self):
@@ -584,13 +648,15 @@ class SUBBASIN:
 
 class HRU:
 
-    def __init__(self, subname,subarea,name):
+    def __init__(self, subname,subarea,name,swatdir):
         """
         HRU class for SWAT_LC calculation.
         :param name: code of the HRU in
+        :param swatdir: SWAT project folder
         """
         self.sub = subname
         self.name = name
+        self.swatdir = swatdir
         self.id = None
         self.lu = None
         self.soiltype = None
@@ -621,7 +687,7 @@ class HRU:
         return f"HRU{self.name}"
 
     def scan_param(self):
-        fname = str(self.sub).zfill(5) + str(self.name).zfill(4)
+        fname = os.path.join(self.swatdir, str(self.sub).zfill(5) + str(self.name).zfill(4))
 
         fhru = ParamIO(fname + ".hru")
         self.NORparam["HRU_FR"] = fhru.parameters["HRU_FR"]         # Fraction of subbasin area contained in HRU
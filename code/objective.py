@@ -0,0 +1,156 @@
+# Goodness-of-fit of the simulated sub-basin loads against observations, evaluated online during the simulation
+import hashlib
+import numpy as np
+import pandas as pd
+from outsink import OutputSink, SUBVARS
+
+
+METRICS = ["NSE", "KGE", "PBIAS", "LOGRMSE"]
+
+
+def read_obs(obs):
+    """
+    Read the observations (comma separated) with the columns:
+    DATE (YYYY-MM-DD), SUB (reach/sub-basin id), POLLUTANT, VALUE, ITEM (optional, sub-basin output item, default:
+    MTkg), WEIGHT (optional, weight of the series in the objective, default: 1)
+    :param obs: path of the observation file, or a DataFrame with the same columns
+    :return: DataFrame of the observations
+    """
+    obs = pd.read_csv(obs) if isinstance(obs, str) else obs.copy()
+    obs["DATE"] = pd.to_datetime(obs["DATE"])
+    if "ITEM" not in obs.columns:
+        obs["ITEM"] = "MTkg"
+    if "WEIGHT" not in obs.columns:
+        obs["WEIGHT"] = 1.0
+    return obs.dropna(subset=["VALUE"])
+
+
+class ObjectiveSink(OutputSink):
+
+    def __init__(self, obs, metric="NSE", bound=None, eps=None):
+        """
+        Accumulate NSE, KGE, PBIAS and log-RMSE of the simulated sub-basin results against the observations as each
+        day is computed, nothing is written to the disk.
+        The objective is the weighted mean of one metric over the observed series. The run is stopped as soon as the
+        objective can no longer reach the bound, this is possible for the metrics that only get worse with more
+        days: NSE (bound is the lowest acceptable value) and LOGRMSE (bound is the highest acceptable value).
+        :param obs: observations, DataFrame or path of the observation file (see read_obs)
+        :param metric: metric of the objective, one of METRICS
+        :param bound: bound of the objective for the early abort, None -> no early abort
+        :param eps: offset added before taking the logarithm (LOGRMSE), default: 1% of the mean observation of
+                    each series
+        """
+        if metric not in METRICS:
+            raise ValueError("Unknown metric: {}, available: {}.".format(metric, ", ".join(METRICS)))
+        if bound is not None and metric not in ("NSE", "LOGRMSE"):
+            raise ValueError("The early abort is only available for NSE and LOGRMSE.")
+        self.obs = read_obs(obs)
+        self.metric = metric
+        self.bound = bound
+        self.eps = eps
+
+    def signature(self):
+        obs = hashlib.sha256(self.obs.to_csv(index=False).encode()).hexdigest()
+        return {"sink": "objective", "metric": self.metric, "bound": self.bound, "eps": self.eps, "obs": obs}
+
+    def open(self, layout):
+        self.layout = layout
+        obs = self.obs[self.obs["DATE"].isin(layout.dates)]
+        keys = list(dict.fromkeys(zip(obs["SUB"], obs["POLLUTANT"], obs["ITEM"])))
+        subcol = {s: j for j, s in enumerate(layout.subs)}
+        pcol = {p: k for k, p in enumerate(layout.pollutants)}
+        for s, p, item in keys:
+            if s not in subcol or p not in pcol or item not in SUBVARS:
+                raise ValueError("The observed series ({}, {}, {}) is not in the sub-basin output.".format(s, p, item))
+        self.keys = keys
+        self.js = np.array([subcol[s] for s, p, item in keys], dtype=int)
+        self.ks = np.array([pcol[p] for s, p, item in keys], dtype=int)
+        self.vs = np.array([SUBVARS.index(item) for s, p, item in keys], dtype=int)
+        # observations (day, series), NaN -> not observed
+        table = obs.pivot_table(index="DATE", columns=["SUB", "POLLUTANT", "ITEM"], values="VALUE", aggfunc="mean")
+        self.obsarr = table.reindex(index=layout.dates, columns=pd.MultiIndex.from_tuples(keys)).values
+        weights = obs.groupby(["SUB", "POLLUTANT", "ITEM"])["WEIGHT"].first()
+        self.weights = np.array([weights[k] for k in keys], dtype=float)
+        # totals of the whole observation period (for the early abort)
+        self.ntotal = np.sum(~np.isnan(self.obsarr), axis=0)
+        self.sso = np.nansum((self.obsarr - np.nanmean(self.obsarr, axis=0)) ** 2, axis=0)
+        self.logeps = 0.01 * np.nanmean(self.obsarr, axis=0) if self.eps is None else np.full(len(keys), self.eps)
+        # running statistics (Welford)
+        n = len(keys)
+        self.n = np.zeros(n)
+        self.means = np.zeros(n)
+        self.meano = np.zeros(n)
+        self.m2s = np.zeros(n)
+        self.m2o = np.zeros(n)
+        self.cso = np.zeros(n)
+        self.sumo = np.zeros(n)
+        self.sums = np.zeros(n)
+        self.sse = np.zeros(n)
+        self.slog = np.zeros(n)
+        self.t = 0
+        self.aborted = None
+
+    def write(self, date, hru, sub):
+        o = self.obsarr[self.t]
+        self.t += 1
+        m = ~np.isnan(o)
+        if not m.any():
+            return False
+        o = o[m]
+        s = sub[self.js[m], self.ks[m], self.vs[m]]
+        self.n[m] += 1
+        n = self.n[m]
+        ds = s - self.means[m]
+        do = o - self.meano[m]
+        self.means[m] += ds / n
+        self.meano[m] += do / n
+        self.m2s[m] += ds * (s - self.means[m])
+        self.m2o[m] += do * (o - self.meano[m])
+        self.cso[m] += ds * (o - self.meano[m])
+        self.sums[m] += s
+        self.sumo[m] += o
+        self.sse[m] += (s - o) ** 2
+        eps = self.logeps[m]
+        self.slog[m] += (np.log(np.maximum(s, 0) + eps) - np.log(np.maximum(o, 0) + eps)) ** 2
+        if self.bound is not None and self.out_of_bound():
+            self.aborted = date
+            return True
+        return False
+
+    def out_of_bound(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.metric == "NSE":
+                best = np.where(self.sso > 0, 1 - self.sse / self.sso, 1.0)
+                return np.average(best, weights=self.weights) < self.bound
+            best = np.sqrt(self.slog / np.maximum(self.ntotal, 1))
+            return np.average(best, weights=self.weights) > self.bound
+
+    def metrics(self):
+        """
+        :return: DataFrame of the metrics of each observed series (of the days simulated so far)
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            nse = 1 - self.sse / self.m2o
+            r = self.cso / np.sqrt(self.m2s * self.m2o)
+            alpha = np.sqrt(self.m2s / self.m2o)
+            beta = self.means / self.meano
+            kge = 1 - np.sqrt((r - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+            pbias = 100 * (self.sumo - self.sums) / self.sumo
+            logrmse = np.sqrt(self.slog / self.n)
+        df = pd.DataFrame(self.keys, columns=["SUB", "POLLUTANT", "ITEM"])
+        df["N"] = self.n.astype(int)
+        df["NSE"] = nse
+        df["KGE"] = kge
+        df["PBIAS"] = pbias
+        df["LOGRMSE"] = logrmse
+        df["WEIGHT"] = self.weights
+        return df
+
+    def result(self):
+        """
+        :return: {"objective": weighted mean of the metric, "metric", "metrics": DataFrame of each series,
+                  "aborted": date of the early abort or None}
+        """
+        df = self.metrics()
+        return {"objective": float(np.average(df[self.metric].values, weights=self.weights)),
+                "metric": self.metric, "metrics": df, "aborted": self.aborted}
@@ -30,10 +30,6 @@ def washload_equation_m1(cocp,kocp,q,w,nocp,qwcr):
     :param qwcr: threshold/critical water flux (Q/Width)
     :return m: kg daily erosion mass
     """
-    if q/w > qwcr:
-
-        m = cocp * kocp * np.maximum(q/w,0) ** nocp
-    else:
-        m = 0
+    m = np.where(q/w > qwcr, cocp * kocp * np.maximum(q/w,0) ** nocp, 0)[()]
     return m
 
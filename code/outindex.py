@@ -0,0 +1,118 @@
+# Sidecar byte-offset index of the SWAT_LC text outputs
+import os
+import numpy as np
+
+
+class OutputIndex:
+
+    def __init__(self, unit, columns, units, pollutants, dates, starts, size, mtime):
+        """
+        Byte-offset index of a SWAT_LC output file (lcproj.hruout / lcproj.subout).
+        The rows are written in a fixed order: date -> sub-basin -> HRU -> pollutant, so each day is a block of
+        (units x pollutants) rows and the rows of one unit on one day are a block of (pollutants) rows. The index
+        records the byte offset of each (day, unit) block, the rows of a pollutant are found by their position
+        (stride) in the block.
+        :param unit: "HRU" or "SUB"
+        :param columns: header of the output file
+        :param units: HRU/SUB ids in the row order
+        :param pollutants: pollutant names in the row order
+        :param dates: output dates (YYYY-MM-DD)
+        :param starts: byte offset of the first row of each (day, unit) block, (days x units + 1), the last one is
+                       the end of the file
+        :param size: size of the indexed file (bytes)
+        :param mtime: modification time of the indexed file (ns)
+        """
+        self.unit = unit
+        self.columns = list(columns)
+        self.units = list(units)
+        self.pollutants = list(pollutants)
+        self.dates = list(dates)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.size = int(size)
+        self.mtime = int(mtime)
+        self.col = {u: j for j, u in enumerate(self.units)}
+        self.pcol = {p: k for k, p in enumerate(self.pollutants)}
+
+    def __repr__(self):
+        return f"OutputIndex({len(self.dates)} days x {len(self.units)} {self.unit} x {len(self.pollutants)} pollutants)"
+
+    @staticmethod
+    def sidecar(outpath):
+        """
+        :return: path of the index file of an output file
+        """
+        return outpath + ".idx.npz"
+
+    @classmethod
+    def build(cls, outpath, unit, units, pollutants, dates, bufsize=64 * 1024 * 1024):
+        """
+        Index an output file with one pass over its bytes (the rows are not parsed).
+        :param outpath: path of the output file
+        :param unit: "HRU" or "SUB"
+        :param units: HRU/SUB ids in the row order
+        :param pollutants: pollutant names in the row order
+        :param dates: output dates
+        :param bufsize: size of the read buffer (bytes)
+        """
+        stride = len(pollutants)
+        nblocks = len(dates) * len(units)
+        nrows = nblocks * stride
+        starts = np.zeros(nblocks + 1, dtype=np.int64)
+        row = -1    # the header
+        pos = 0
+        with open(outpath, "rb") as f:
+            columns = f.readline().decode().strip().split(",")
+            f.seek(0)
+            while True:
+                buf = f.read(bufsize)
+                if not buf:
+                    break
+                nxt = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10) + pos + 1   # start of the next row
+                r = row + 1 + np.arange(len(nxt))
+                sel = (r % stride == 0) & (r <= nrows)
+                starts[r[sel] // stride] = nxt[sel]
+                row += len(nxt)
+                pos += len(buf)
+        if row != nrows:
+            raise ValueError("The number of rows in {} ({}) does not match the output layout ({}).".format(
+                outpath, row, nrows))
+        stat = os.stat(outpath)
+        return cls(unit, columns, units, pollutants, [str(d)[:10] for d in dates], starts, stat.st_size,
+                   stat.st_mtime_ns)
+
+    def save(self, outpath):
+        np.savez(self.sidecar(outpath), unit=self.unit, columns=np.array(self.columns), units=np.array(self.units),
+                 pollutants=np.array(self.pollutants), dates=np.array(self.dates), starts=self.starts,
+                 size=self.size, mtime=self.mtime)
+
+    @classmethod
+    def load(cls, outpath):
+        """
+        :return: the index of an output file, None if there is no index or the output was changed after indexing
+        """
+        path = cls.sidecar(outpath)
+        if not os.path.exists(path) or not os.path.exists(outpath):
+            return None
+        with np.load(path) as z:
+            idx = cls(str(z["unit"]), z["columns"].tolist(), z["units"].tolist(), z["pollutants"].tolist(),
+                      z["dates"].tolist(), z["starts"], z["size"], z["mtime"])
+        stat = os.stat(outpath)
+        if stat.st_size != idx.size or stat.st_mtime_ns != idx.mtime:
+            return None
+        return idx
+
+    def read_rows(self, fhnd, unitid, pollutant):
+        """
+        Read the rows of one unit and pollutant.
+        :param fhnd: output file opened in binary mode
+        :return: the rows (bytes, without the header), empty if the unit or pollutant is not in the output
+        """
+        if unitid not in self.col or pollutant not in self.pcol:
+            return b""
+        k = self.pcol[pollutant]
+        blocks = np.arange(len(self.dates)) * len(self.units) + self.col[unitid]
+        rows = []
+        for b in blocks:
+            fhnd.seek(self.starts[b])
+            rows.append(fhnd.read(self.starts[b + 1] - self.starts[b]).split(b"\n")[k])
+        return b"\n".join(rows) + b"\n"
@@ -0,0 +1,307 @@
+# Output sinks of the SWAT_LC simulation
+import os
+import numpy as np
+import pandas as pd
+from outindex import OutputIndex
+
+
+# result variables of the HRU and sub-basin outputs
+HRUVARS = ["MTkg", "MSURkg", "MLATkg", "MGWkg", "MDGWkg", "CTng/L", "CLATng/L", "CGWng/L", "CDGWng/L", "CTSOILng/L"]
+SUBVARS = ["MTkg", "MSURkg", "MLATkg", "MGWkg", "MDGWkg", "MFLUXkg", "MOCPkg"]
+
+
+class OutputLayout:
+
+    def __init__(self, dates, subs, hrus, hrusubs, pollutants, hruout=True):
+        """
+        Shape of the simulation output, the per-day arrays passed to the sinks are (unit, pollutant, variable).
+        :param dates: output dates
+        :param subs: sub-basin ids
+        :param hrus: HRU ids
+        :param hrusubs: sub-basin id of each HRU
+        :param pollutants: names of the output pollutants
+        :param hruout: whether the HRU results are written
+        """
+        self.dates = pd.DatetimeIndex(dates)
+        self.subs = list(subs)
+        self.hrus = list(hrus)
+        self.hrusubs = list(hrusubs)
+        self.pollutants = list(pollutants)
+        self.hruvars = HRUVARS
+        self.subvars = SUBVARS
+        self.hruout = hruout
+
+
+class OutputSink:
+    """
+    Base class of the output sinks. The simulation calls open() once, write() for every output day and close()
+    at the end of the run.
+    """
+
+    def open(self, layout):
+        self.layout = layout
+
+    def write(self, date, hru, sub):
+        """
+        :param date: the simulated day
+        :param hru: HRU results of the day (HRU, pollutant, HRUVARS), None if the HRU output is off
+        :param sub: sub-basin results of the day (SUB, pollutant, SUBVARS)
+        :return: True to stop the simulation (e.g. the early abort of a calibration run)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def result(self):
+        """
+        :return: the results kept by the sink (in-memory sinks), None otherwise
+        """
+        return None
+
+    def signature(self):
+        """
+        :return: description of what the sink keeps (for the run cache, see runcache), None -> not cacheable
+        """
+        return None
+
+
+class CSVSink(OutputSink):
+
+    def __init__(self, lcdir, index=False):
+        """
+        The text outputs lcproj.hruout and lcproj.subout in the SWAT_LC project folder.
+        :param lcdir: SWAT_LC project folder
+        :param index: write the sidecar byte-offset index of the outputs (see outindex.OutputIndex)
+        """
+        self.hrupath = os.path.join(lcdir, "lcproj.hruout")
+        self.subpath = os.path.join(lcdir, "lcproj.subout")
+        self.index = index
+
+    def open(self, layout):
+        self.layout = layout
+        self.fhru = open(self.hrupath, "w")
+        self.fsub = open(self.subpath, "w")
+        self.fhru.write(",".join(["DATE", "SUB", "HRU", "POLLUTANT"] + HRUVARS) + "\n")
+        self.fsub.write(",".join(["DATE", "SUB", "POLLUTANT"] + SUBVARS) + "\n")
+
+    def write(self, date, hru, sub):
+        date = date.strftime("%Y-%m-%d")
+        pollutants = self.layout.pollutants
+        if hru is not None:
+            rows = []
+            for s, h, values in zip(self.layout.hrusubs, self.layout.hrus, hru.tolist()):
+                for p, v in zip(pollutants, values):
+                    rows.append(f"{date},{s},{h},{p}," + ",".join(map(str, v)) + "\n")
+            self.fhru.write("".join(rows))
+        rows = []
+        for s, values in zip(self.layout.subs, sub.tolist()):
+            for p, v in zip(pollutants, values):
+                rows.append(f"{date},{s},{p}," + ",".join(map(str, v)) + "\n")
+        self.fsub.write("".join(rows))
+
+    def close(self):
+        self.fhru.close()
+        self.fsub.close()
+        if self.index:
+            layout = self.layout
+            OutputIndex.build(self.subpath, "SUB", layout.subs, layout.pollutants, layout.dates).save(self.subpath)
+            if layout.hruout:
+                OutputIndex.build(self.hrupath, "HRU", layout.hrus, layout.pollutants, layout.dates).save(
+                    self.hrupath)
+
+
+class BinarySink(OutputSink):
+
+    def __init__(self, lcdir):
+        """
+        Binary outputs lcproj.hruout.npy and lcproj.subout.npy (date, unit, pollutant, variable) in the SWAT_LC
+        project folder, the axes are stored in lcproj.hruout.axes.npz / lcproj.subout.axes.npz. Read them with
+        read_binary().
+        :param lcdir: SWAT_LC project folder
+        """
+        self.hrupath = os.path.join(lcdir, "lcproj.hruout.npy")
+        self.subpath = os.path.join(lcdir, "lcproj.subout.npy")
+
+    def open(self, layout):
+        self.layout = layout
+        self.t = 0
+        npoll = len(layout.pollutants)
+        self.sub = np.lib.format.open_memmap(self.subpath, mode="w+", dtype=np.float64,
+                                             shape=(len(layout.dates), len(layout.subs), npoll, len(SUBVARS)))
+        save_axes(self.subpath, layout.dates, layout.subs, layout.pollutants, SUBVARS, "SUB")
+        self.hru = None
+        if layout.hruout:
+            self.hru = np.lib.format.open_memmap(self.hrupath, mode="w+", dtype=np.float64,
+                                                 shape=(len(layout.dates), len(layout.hrus), npoll, len(HRUVARS)))
+            save_axes(self.hrupath, layout.dates, layout.hrus, layout.pollutants, HRUVARS, "HRU")
+
+    def write(self, date, hru, sub):
+        self.sub[self.t] = sub
+        if self.hru is not None and hru is not None:
+            self.hru[self.t] = hru
+        self.t += 1
+
+    def close(self):
+        self.sub.flush()
+        del self.sub
+        if self.hru is not None:
+            self.hru.flush()
+            del self.hru
+
+
+def save_axes(path, dates, units, pollutants, variables, unit):
+    np.savez(path[:-4] + ".axes.npz", dates=np.array([d.strftime("%Y-%m-%d") for d in dates]), units=np.array(units),
+             pollutants=np.array(pollutants), variables=np.array(variables), unit=unit)
+
+
+def read_binary(path, mmap=True):
+    """
+    Read a binary output of BinarySink.
+    :param path: path of lcproj.subout.npy / lcproj.hruout.npy
+    :param mmap: memory-map the results instead of loading them
+    :return: results (date, unit, pollutant, variable), axes {"dates", "units", "pollutants", "variables", "unit"}
+    """
+    data = np.load(path, mmap_mode="r" if mmap else None)
+    with np.load(path[:-4] + ".axes.npz") as z:
+        axes = {"dates": pd.DatetimeIndex(z["dates"]), "units": z["units"].tolist(),
+                "pollutants": z["pollutants"].tolist(), "variables": z["variables"].tolist(), "unit": str(z["unit"])}
+    return data, axes
+
+
+class MemorySink(OutputSink):
+
+    def __init__(self, hru=False):
+        """
+        Keep the results in preallocated NumPy arrays, nothing is written to the disk.
+        :param hru: also keep the HRU results
+        """
+        self.keephru = hru
+
+    def signature(self):
+        return {"sink": "memory", "hru": self.keephru}
+
+    def open(self, layout):
+        self.layout = layout
+        self.t = 0
+        npoll = len(layout.pollutants)
+        self.sub = np.zeros((len(layout.dates), len(layout.subs), npoll, len(SUBVARS)))
+        self.hru = None
+        if self.keephru and layout.hruout:
+            self.hru = np.zeros((len(layout.dates), len(layout.hrus), npoll, len(HRUVARS)))
+
+    def write(self, date, hru, sub):
+        self.sub[self.t] = sub
+        if self.hru is not None and hru is not None:
+            self.hru[self.t] = hru
+        self.t += 1
+
+    def result(self):
+        """
+        :return: {"dates", "subs", "hrus", "pollutants", "subvars", "hruvars",
+                  "sub": (date, SUB, pollutant, SUBVARS), "hru": (date, HRU, pollutant, HRUVARS) or None}
+        """
+        layout = self.layout
+        return {"dates": layout.dates, "subs": layout.subs, "hrus": layout.hrus, "pollutants": layout.pollutants,
+                "subvars": SUBVARS, "hruvars": HRUVARS, "sub": self.sub, "hru": self.hru}
+
+    def to_xarray(self):
+        """
+        :return: xarray Dataset with the variables "sub" and "hru" indexed by date/unit/pollutant/variable
+        """
+        try:
+            import xarray as xr
+        except ImportError:
+            raise ImportError("xarray is required for MemorySink.to_xarray(), use MemorySink.result() instead.")
+        layout = self.layout
+        ds = xr.Dataset({"sub": (("date", "SUB", "pollutant", "subvar"), self.sub)},
+                        coords={"date": layout.dates, "SUB": layout.subs, "pollutant": layout.pollutants,
+                                "subvar": SUBVARS})
+        if self.hru is not None:
+            ds["hru"] = xr.DataArray(self.hru, dims=("date", "HRU", "pollutant", "hruvar"),
+                                     coords={"date": layout.dates, "HRU": layout.hrus,
+                                             "pollutant": layout.pollutants, "hruvar": HRUVARS})
+            ds = ds.assign_coords(HRUSUB=("HRU", layout.hrusubs))
+        return ds
+
+
+class SQLSink(OutputSink):
+
+    def __init__(self, url, batchsize=100000, prefix="lcproj_"):
+        """
+        Write the results into the tables {prefix}subout and {prefix}hruout (same columns as the text outputs) of a
+        database, the existing tables are replaced.
+        :param url: SQLAlchemy database URL, e.g. "sqlite:///SWATLC.db"
+        :param batchsize: number of rows in each insert
+        :param prefix: prefix of the table names
+        """
+        from sqlalchemy import create_engine
+        self.engine = create_engine(url)
+        self.batchsize = batchsize
+        self.prefix = prefix
+        self.method = "multi" if self.engine.dialect.name != "sqlite" else None
+
+    def open(self, layout):
+        self.layout = layout
+        npoll = len(layout.pollutants)
+        self.cols = {"subout": {"SUB": np.repeat(layout.subs, npoll), "POLLUTANT": np.tile(layout.pollutants,
+                                                                                         len(layout.subs))},
+                     "hruout": {"SUB": np.repeat(layout.hrusubs, npoll), "HRU": np.repeat(layout.hrus, npoll),
+                                "POLLUTANT": np.tile(layout.pollutants, len(layout.hrus))}}
+        self.buffer = {"subout": [], "hruout": []}
+        self.nrows = {"subout": 0, "hruout": 0}
+        self.written = {"subout": False, "hruout": False}
+
+    def write(self, date, hru, sub):
+        date = date.strftime("%Y-%m-%d")
+        self.append("subout", date, sub.reshape(-1, len(SUBVARS)), SUBVARS)
+        if hru is not None:
+            self.append("hruout", date, hru.reshape(-1, len(HRUVARS)), HRUVARS)
+
+    def append(self, name, date, values, variables):
+        df = pd.DataFrame(values, columns=variables)
+        for i, (c, v) in enumerate(self.cols[name].items()):
+            df.insert(i, c, v)
+        df.insert(0, "DATE", date)
+        self.buffer[name].append(df)
+        self.nrows[name] += len(df.index)
+        if self.nrows[name] >= self.batchsize:
+            self.flush(name)
+
+    def flush(self, name):
+        if not self.buffer[name]:
+            return
+        df = pd.concat(self.buffer[name], ignore_index=True)
+        with self.engine.begin() as con:
+            df.to_sql(self.prefix + name, con=con, if_exists="append" if self.written[name] else "replace",
+                      index=False, chunksize=self.batchsize, method=self.method)
+        self.written[name] = True
+        self.buffer[name] = []
+        self.nrows[name] = 0
+
+    def close(self):
+        self.flush("subout")
+        self.flush("hruout")
+        self.engine.dispose()
+
+
+def make_sink(name, lcdir, url=None, index=False):
+    """
+    :param name: "csv", "binary", "memory" or "sql"
+    :param lcdir: SWAT_LC project folder
+    :param url: database URL of the SQL sink
+    :param index: write the sidecar index of the CSV outputs
+    :return: the output sink
+    """
+    name = name.lower()
+    if name == "csv":
+        return CSVSink(lcdir, index=index)
+    elif name == "binary":
+        return BinarySink(lcdir)
+    elif name == "memory":
+        return MemorySink(hru=True)
+    elif name == "sql":
+        if not url:
+            raise ValueError("The SQL output sink requires a database URL (OUTSINKURL).")
+        return SQLSink(url)
+    raise ValueError("Unknown output sink: {}, available: csv, binary, memory, sql.".format(name))
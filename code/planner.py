@@ -0,0 +1,166 @@
+# Capacity planning of SWAT_LC runs: memory, output size and runtime projected from the project size
+import os
+import sys
+from modelutils import PROJmanager
+from inputcube import HRUVARS as CUBEVARS
+from outsink import HRUVARS, SUBVARS
+from kernel import CHUNKDAYS
+
+
+# calibration of the projections, see calibrate() to update the time costs with the results of a benchmark
+COSTS = {"run_python": 47e-6,   # s per HRU-pollutant-day, text outputs with HRUOUT on (medium benchmark)
+         "run_jit": 10e-6,      # s per HRU-pollutant-day, mostly the writing of the text outputs
+         "load": 87e-6,         # s per HRU-day, reading the SWAT results and the SWAT_LC settings
+         "loadbytes": 10,       # peak memory of reading output.hru (bytes per byte of the file read)
+         "processbytes": 140e6,  # Python interpreter with numpy and pandas (bytes)
+         "hrubytes": 3000,      # memory of an HRU object without the state variables (bytes)
+         "statebytes": 1600,    # memory of the state variables and parameters of a pollutant in an HRU (bytes)
+         "csvhru": 200,         # bytes per row of lcproj.hruout
+         "csvsub": 155}         # bytes per row of lcproj.subout
+
+
+def plan(swatdir, lcdir, costs=None, memory=None):
+    """
+    Dry run of a SWAT_LC project: only the settings (file.cio, .sim, .plt) and the file names of the SWAT project
+    are read, the SWAT results are not loaded and nothing is simulated.
+    :param swatdir: SWAT project folder
+    :param lcdir: SWAT_LC project folder
+    :param costs: calibration of the projections (see COSTS and calibrate), default: COSTS
+    :param memory: memory of the node (bytes), the plan tells whether the projected peak fits in it
+    :return: dict of the plan: "size" (number of sub-basins, HRUs, pollutants, days, output days), "memory"
+             (bytes), "output" (rows and bytes of each output format), "runtime" (s of each engine), "settings"
+    """
+    costs = dict(COSTS, **(costs or {}))
+    mdl = PROJmanager(swatdir, lcdir, dryrun=True)
+    nsub = len(mdl.hrucount)
+    nhru = sum(mdl.hrucount.values())
+    npoll = len(mdl.pollutants)
+    docsim = "DOC" in [p.name for p in mdl.pollutants]
+    outpoll = len([p for p in mdl.pollutants if p.name != "DOC" or mdl.docout != 0])
+    ndays = (mdl.simend - mdl.simstart).days + 1
+    outdays = max((min(mdl.outend, mdl.simend) - max(mdl.outstart, mdl.simstart)).days + 1, 0)
+    swatdays = (mdl.swatend - mdl.swatstart).days + 1
+    hruout = mdl.hruout != 0
+    blockdays = max(1, min(mdl.blockdays, ndays)) if mdl.outofcore != 0 else ndays
+    size = {"subbasins": nsub, "hrus": nhru, "pollutants": npoll, "days": ndays, "outdays": outdays,
+            "hrudays": nhru * ndays}
+
+    # memory (bytes), float64 arrays
+    cube = ndays * len(CUBEVARS) * nhru * 8
+    hrufile = os.path.join(swatdir, "output.hru")
+    hrubytes = os.path.getsize(hrufile) * ndays / swatdays if os.path.exists(hrufile) else 0
+    mem = {"input": blockdays * len(CUBEVARS) * nhru * 8,       # resident part of the input cube
+           "input_disk": cube if mdl.outofcore != 0 else 0,    # memory-mapped cube (OUTOFCORE)
+           "subinput": ndays * nsub * 2 * 8,                    # precipitation and reach flow
+           "stages": 2 * ndays * nsub * npoll * 8 + (5 * blockdays * nhru * 8 if docsim else 0),  # DOC per block
+           "state": nhru * (costs["hrubytes"] + npoll * costs["statebytes"]) + nsub * npoll * costs["statebytes"],
+           "surface": min(CHUNKDAYS, blockdays) * nhru * npoll * 3 * 8,     # surface loads of a range of days
+           "kernel": min(CHUNKDAYS, blockdays) * (npoll * ((nhru * len(HRUVARS) if hruout else 0)
+                                                          + nsub * len(SUBVARS)) + (5 * nhru if docsim else 0)) * 8,
+           "load_peak": costs["loadbytes"] * hrubytes * blockdays / ndays}
+
+    # outputs of each format, the HRU part is only written if HRUOUT is on (always kept by the memory sink)
+    rows = {"sub": outdays * nsub * outpoll, "hru": outdays * nhru * outpoll}
+    values = {"sub": rows["sub"] * len(SUBVARS), "hru": rows["hru"] * len(HRUVARS)}
+    output = {"rows": rows,
+              "csv": {"sub": rows["sub"] * costs["csvsub"], "hru": rows["hru"] * costs["csvhru"]},
+              "binary": {"sub": values["sub"] * 8, "hru": values["hru"] * 8},     # also numpy/xarray in memory
+              "sql": {"sub": rows["sub"], "hru": rows["hru"]}}                    # rows, the size depends on the database
+    sink = mdl.outsink.lower()
+    units = ("sub", "hru") if hruout or sink == "memory" else ("sub",)
+    fmt = {"csv": "csv", "binary": "binary", "memory": "binary", "sql": "sql"}[sink]
+    output["selected"] = {"sink": sink, "size": sum(output[fmt][u] for u in units),
+                          "rows": sum(rows[u] for u in units)}
+
+    mem["output"] = output["selected"]["size"] if sink == "memory" else 0
+    resident = costs["processbytes"] + mem["input"] + mem["subinput"] + mem["state"]
+    running = resident + mem["stages"] + mem["surface"] + mem["output"]
+    mem["peak_python"] = max(resident + mem["load_peak"], running)
+    mem["peak_jit"] = max(resident + mem["load_peak"], running + mem["kernel"])
+
+    runtime = {"load": costs["load"] * nhru * ndays}
+    for engine in ("python", "jit"):
+        runtime["run_" + engine] = costs["run_" + engine] * nhru * npoll * ndays
+    settings = {"engine": mdl.engine, "outsink": mdl.outsink, "hruout": hruout, "docout": mdl.docout != 0,
+                "outofcore": mdl.outofcore != 0, "blockdays": blockdays}
+    result = {"size": size, "memory": mem, "output": output, "runtime": runtime, "settings": settings,
+              "costs": costs}
+    if memory is not None:
+        peak = mem["peak_jit"] if mdl.engine == "jit" else mem["peak_python"]
+        result["fits"] = peak <= memory
+    return result
+
+
+def calibrate(bench):
+    """
+    Time costs measured by a benchmark, the largest scale of each phase is used.
+    :param bench: results of benchmark.run_benchmark (or the path of the saved results)
+    :return: COSTS updated with the measured costs
+    """
+    import benchmark
+    bench = benchmark.load(bench) if isinstance(bench, str) else bench
+    costs = dict(COSTS)
+    scales = list(benchmark.SCALES)
+    results = sorted(bench["results"], key=lambda r: scales.index(r["scale"]))
+    hrudays = {r["scale"]: r["units"] for r in results if r["phase"].startswith("run_") and r["units"]}
+    for r in results:
+        if r["scale"] not in hrudays:
+            continue
+        npoll = benchmark.SCALES[r["scale"]]["npoll"] + 1   # with DOC
+        if r["phase"] in ("run_python", "run_jit"):
+            costs[r["phase"]] = r["seconds"] / (hrudays[r["scale"]] * npoll)
+        elif r["phase"] == "load":
+            costs["load"] = r["seconds"] / hrudays[r["scale"]]
+    return costs
+
+
+def _size(b):
+    for unit in ("B", "KB", "MB", "GB"):
+        if b < 1024:
+            return "{:.1f} {}".format(b, unit)
+        b /= 1024
+    return "{:.1f} TB".format(b)
+
+
+def _time(s):
+    return "{:.0f} s".format(s) if s < 120 else "{:.1f} min".format(s / 60) if s < 7200 else "{:.1f} h".format(s / 3600)
+
+
+def text(p):
+    """
+    :return: human-readable text of a plan
+    """
+    s, m, o, r = p["size"], p["memory"], p["output"], p["runtime"]
+    lines = ["{} sub-basins, {} HRUs, {} pollutants, {} days ({:,} HRU-days), {} output days".format(
+        s["subbasins"], s["hrus"], s["pollutants"], s["days"], s["hrudays"], s["outdays"])]
+    lines.append("Memory:")
+    lines.append("  input series     {:>12}".format(_size(m["input"] + m["subinput"]))
+                 + ("  (memory-mapped cube {} on disk)".format(_size(m["input_disk"])) if m["input_disk"] else ""))
+    lines.append("  state            {:>12}".format(_size(m["state"])))
+    lines.append("  stages           {:>12}".format(_size(m["stages"])))
+    lines.append("  surface loads    {:>12}".format(_size(m["surface"])))
+    if m["output"]:
+        lines.append("  outputs          {:>12}".format(_size(m["output"])))
+    lines.append("  loading peak     {:>12}".format(_size(m["load_peak"])))
+    lines.append("  peak, python     {:>12}".format(_size(m["peak_python"])))
+    lines.append("  peak, jit        {:>12}".format(_size(m["peak_jit"])))
+    lines.append("Outputs (sub-basin + HRU):")
+    lines.append("  rows             {:>12,} + {:,}".format(o["rows"]["sub"], o["rows"]["hru"]))
+    lines.append("  csv              {:>12} + {}".format(_size(o["csv"]["sub"]), _size(o["csv"]["hru"])))
+    lines.append("  binary/in memory {:>12} + {}".format(_size(o["binary"]["sub"]), _size(o["binary"]["hru"])))
+    sel = o["selected"]
+    lines.append("  selected ({}, HRUOUT {}): {:,} rows, {}".format(
+        sel["sink"], "on" if p["settings"]["hruout"] else "off", sel["rows"],
+        "size depends on the database" if sel["sink"] == "sql" else _size(sel["size"])))
+    lines.append("Runtime: loading {}, python engine {}, jit engine {}".format(
+        _time(r["load"]), _time(r["run_python"]), _time(r["run_jit"])))
+    if "fits" in p:
+        lines.append("Fits in the node memory: {}".format("yes" if p["fits"] else "no"))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python planner.py SWATDIR LCDIR [BENCHMARK.json]
+    costs = calibrate(sys.argv[3]) if len(sys.argv) > 3 else None
+    p = plan(sys.argv[1], sys.argv[2], costs)
+    print(text(p))
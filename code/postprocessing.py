@@ -1,3 +1,4 @@
+import os
 import glob
 import pandas as pd
 import geopandas as gpd
@@ -6,54 +7,44 @@ import numpy as np
 import swat_param
 from swat_res import SWATreader
 
+def subout_summary(subout):
+    """
+    Summarize the sub-basin output for every sub-basin and pollutant in one grouped aggregation.
+    :param subout: path of the sub-basin output (lcproj.subout) or the LCreader of it
+    :return: DataFrame indexed by sub-basin, columns "{item}_{pollutant}":
+             MT (average daily load, kg), rSur, rLat, rGw, rFlx, rOCP (ratios of the total load)
+    """
+    lcres = subout if isinstance(subout, resultreader.LCreader) else resultreader.LCreader(subout)
+    df = lcres.metadata
+    pollutants = list(dict.fromkeys(df["POLLUTANT"].values))
+    items = ["MTkg", "MSURkg", "MLATkg", "MGWkg", "MDGWkg", "MFLUXkg", "MOCPkg"]
+    aggs = {i: (i, "sum") for i in items}
+    aggs["MT"] = ("MTkg", "mean")
+    sums = df.groupby(["SUB", "POLLUTANT"], observed=True).agg(**aggs)
+    summary = pd.DataFrame({"MT": sums["MT"],
+                            "rSur": sums["MSURkg"] / sums["MTkg"],
+                            "rLat": sums["MLATkg"] / sums["MTkg"],
+                            "rGw": (sums["MGWkg"] + sums["MDGWkg"]) / sums["MTkg"],
+                            "rFlx": sums["MFLUXkg"] / sums["MTkg"],
+                            "rOCP": sums["MOCPkg"] / sums["MTkg"]})
+    wide = summary.unstack("POLLUTANT")
+    wide = wide[[(v, p) for p in pollutants for v in summary.columns]]
+    wide.columns = ["{}_{}".format(v, p) for v, p in wide.columns]
+    return wide
+
+
 def lcsubout2shp(tarshp,subout):
     shp = gpd.read_file(tarshp)
-    subs = shp["Subbasin"].values
-    areas = shp["Area"].values
-    lcres = resultreader.LCreader(subout)
-    pollutants = set(lcres.metadata["POLLUTANT"].values)
+    wide = subout_summary(subout)
+    pollutants = [c[3:] for c in wide.columns if c.startswith("MT_")]
+    # load per area, mg/(km2*day)
     for p in pollutants:
-        loadpa = []  # mg/(km2*day)
-        sur_ratio = []
-        lat_ratio = []
-        gw_ratio = []
-        flux_ratio = []
-        ocp_ratio = []
-        for id,s in enumerate(subs):
-            total = lcres.inquireDataItem(s,p,"MTkg")
-            sur = lcres.inquireDataItem(s, p, "MSURkg")
-            lat = lcres.inquireDataItem(s,p,"MLATkg")
-            sgw = lcres.inquireDataItem(s,p,"MGWkg")
-            dgw = lcres.inquireDataItem(s, p, "MDGWkg")
-            allgw = sgw + dgw
-            flux = lcres.inquireDataItem(s, p, "MFLUXkg")
-            ocp = lcres.inquireDataItem(s, p, "MOCPkg")
-            s_total = np.sum(total)
-            s_sur = np.sum(sur)
-            s_lat = np.sum(lat)
-            s_gw = np.sum(allgw)
-            s_ocp = np.sum(ocp)
-            s_flux = np.sum(flux)
-            r_sur = s_sur/s_total
-            r_lat = s_lat/s_total
-            r_gw = s_gw/s_total
-            r_flux = s_flux/s_total
-            r_ocp = s_ocp/s_total
-            lpa = 1000000 * np.average(total) / areas[id]
-
-            sur_ratio.append(r_sur)
-            lat_ratio.append(r_lat)
-            gw_ratio.append(r_gw)
-            flux_ratio.append(r_flux)
-            ocp_ratio.append(r_ocp)
-            loadpa.append(lpa)
-
-        shp[r"LPA_{}".format(p)] = loadpa
-        shp["rSur_{}".format(p)] = sur_ratio
-        shp["rLat_{}".format(p)] = lat_ratio
-        shp["rGw_{}".format(p)] = gw_ratio
-        shp["rFlx_{}".format(p)] = flux_ratio
-        shp["rOCP_{}".format(p)] = ocp_ratio
+        wide["MT_{}".format(p)] *= 1000000
+    wide = wide.rename(columns={"MT_{}".format(p): "LPA_{}".format(p) for p in pollutants})
+    shp = shp.drop(columns=[c for c in wide.columns if c in shp.columns])
+    shp = shp.merge(wide, how="left", left_on="Subbasin", right_index=True)
+    for p in pollutants:
+        shp["LPA_{}".format(p)] = shp["LPA_{}".format(p)] / shp["Area"]
     shp.to_file(tarshp)
 
 
@@ -88,9 +79,9 @@ def lcsoilini2shp(tarshp,swatdir,lcdir):
 
     shp = gpd.read_file(tarshp)
     hrugis = shp["HRU_GIS"].values
-    lcini = glob.glob(lcdir+"\\*.init")[0]
-    lcusrini = glob.glob(lcdir+"\\*.usrinit")[0]
-    lcplt = glob.glob(lcdir+"\\*.plt")[0]
+    lcini = glob.glob(os.path.join(lcdir, "*.init"))[0]
+    lcusrini = glob.glob(os.path.join(lcdir, "*.usrinit"))[0]
+    lcplt = glob.glob(os.path.join(lcdir, "*.plt"))[0]
     dfplt = pd.read_csv(lcplt)
     dfini = pd.read_csv(lcini)
     dfusrini = pd.read_csv(lcusrini)
@@ -101,8 +92,8 @@ def lcsoilini2shp(tarshp,swatdir,lcdir):
         ctsoil = []
         converted = []
         for h in hrugis:
-            hrufile = swatdir + "\\{}.hru".format(h)
-            solfile = swatdir + "\\{}.sol".format(h)
+            hrufile = os.path.join(swatdir, "{}.hru".format(h))
+            solfile = os.path.join(swatdir, "{}.sol".format(h))
             hruparam = swat_param.ParamIO(hrufile)
             solparam = swat_param.ParamIO(solfile)
             globalini = dfini[(dfini["LANDUSE"] == hruparam.lu) & (dfini["SOIL"] == hruparam.soiltype) & (dfini["POLLUTANT"] == p)]
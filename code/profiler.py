@@ -0,0 +1,213 @@
+# Phase timers and profiling hooks of the SWAT_LC simulation
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import collections
+
+
+MODES = ["off", "phases", "cprofile", "sampling"]
+
+
+class PhaseTimer:
+
+    def __init__(self):
+        """
+        Accumulated wall time (s) and number of calls of named phases.
+        """
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+
+    def __repr__(self):
+        return "PhaseTimer({} phases, {:.3f} s)".format(len(self.seconds), sum(self.seconds.values()))
+
+    def add(self, name, seconds, calls=1):
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+
+    def timed(self, fn, *args, **kwargs):
+        """
+        Call fn and record its time under its name.
+        """
+        t = time.perf_counter()
+        value = fn(*args, **kwargs)
+        self.add(fn.__name__, time.perf_counter() - t)
+        return value
+
+    def lap(self, name, since):
+        """
+        Record the time since the last lap under name, chained laps account for all the time of a loop.
+        :param since: time of the last lap (time.perf_counter)
+        :return: the current time, the start of the next lap
+        """
+        now = time.perf_counter()
+        self.seconds[name] += now - since
+        self.calls[name] += 1
+        return now
+
+    def to_dict(self):
+        """
+        :return: {phase: {"seconds", "calls"}} in the order of the first call
+        """
+        return {k: {"seconds": self.seconds[k], "calls": self.calls[k]} for k in self.seconds}
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.005):
+        """
+        Statistical profiler: a background thread samples the call stack of the profiled thread at a fixed interval.
+        The overhead does not depend on the number of function calls, unlike cProfile.
+        :param interval: sampling interval (s)
+        """
+        self.interval = interval
+        self.own = collections.Counter()        # samples where the function is running (top of the stack)
+        self.total = collections.Counter()      # samples where the function is on the stack
+        self.nsamples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ident = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(ident,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self, ident):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                continue
+            self.nsamples += 1
+            self.own[self._key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                key = self._key(frame)
+                if key not in seen:
+                    self.total[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    @staticmethod
+    def _key(frame):
+        code = frame.f_code
+        return "{}:{}({})".format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+    def to_dict(self, top=30):
+        """
+        :return: {"samples", "interval", "own": [[function, samples, fraction]], "total": [...]} of the top functions
+        """
+        n = max(self.nsamples, 1)
+        return {"samples": self.nsamples, "interval": self.interval,
+                "own": [[k, v, v / n] for k, v in self.own.most_common(top)],
+                "total": [[k, v, v / n] for k, v in self.total.most_common(top)]}
+
+
+class Profiler:
+
+    def __init__(self, mode="off", interval=0.005):
+        """
+        Instrumentation of a simulation run.
+        :param mode: off: nothing is recorded, phases: phase timers, cprofile: phase timers and cProfile,
+                     sampling: phase timers and the sampling profiler
+        :param interval: sampling interval (s) of the sampling profiler
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown profiling mode: {}, available: {}.".format(mode, ", ".join(MODES)))
+        self.mode = mode
+        self.enabled = mode != "off"
+        self.timer = PhaseTimer()
+        self.cprof = cProfile.Profile() if mode == "cprofile" else None
+        self.sampler = SamplingProfiler(interval) if mode == "sampling" else None
+        self.t0 = None
+        self.wall = None
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        if self.cprof is not None:
+            self.cprof.enable()
+        if self.sampler is not None:
+            self.sampler.start()
+        return self.t0
+
+    def stop(self):
+        if self.cprof is not None:
+            self.cprof.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.wall = time.perf_counter() - self.t0
+
+    def report(self, load=None, units=None, top=30):
+        """
+        :param load: PhaseTimer of the project loading (PROJmanager.timer)
+        :param units: number of simulated HRU-days
+        :param top: number of functions in the profiles
+        :return: dict of the report
+        """
+        rep = {"mode": self.mode, "wall": self.wall, "load": load.to_dict() if load is not None else None,
+               "run": self.timer.to_dict(), "hrudays": units,
+               "hrudays_per_s": units / self.wall if units and self.wall else None}
+        if self.cprof is not None:
+            stats = pstats.Stats(self.cprof)
+            rows = []
+            for (f, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+                rows.append(["{}:{}({})".format(os.path.basename(f), line, name), nc, tt, ct])
+            rows.sort(key=lambda r: r[2], reverse=True)
+            rep["cprofile"] = [{"function": r[0], "calls": r[1], "tottime": r[2], "cumtime": r[3]} for r in rows[:top]]
+        if self.sampler is not None:
+            rep["sampling"] = self.sampler.to_dict(top)
+        return rep
+
+    @staticmethod
+    def text(rep):
+        """
+        :return: human-readable text of a report
+        """
+        lines = []
+        if rep["load"]:
+            total = sum(v["seconds"] for v in rep["load"].values())
+            lines.append("Project loading: {:.3f} s".format(total))
+            for k, v in rep["load"].items():
+                lines.append("  {:<28}{:>10.3f} s {:>6.1f}%".format(k, v["seconds"], 100 * v["seconds"] / total))
+        lines.append("Simulation: {:.3f} s".format(rep["wall"]))
+        for k, v in rep["run"].items():
+            lines.append("  {:<28}{:>10.3f} s {:>6.1f}% {:>12} calls".format(k, v["seconds"],
+                                                                         100 * v["seconds"] / rep["wall"], v["calls"]))
+        if rep["hrudays_per_s"]:
+            lines.append("  {:,} HRU-days, {:,.0f} HRU-days/s".format(rep["hrudays"], rep["hrudays_per_s"]))
+        if "cprofile" in rep:
+            lines.append("cProfile (by own time):")
+            lines.append("  {:>10} {:>10} {:>10}  function".format("calls", "tottime", "cumtime"))
+            for r in rep["cprofile"]:
+                lines.append("  {:>10} {:>10.3f} {:>10.3f}  {}".format(r["calls"], r["tottime"], r["cumtime"],
+                                                                    r["function"]))
+        if "sampling" in rep:
+            s = rep["sampling"]
+            lines.append("Sampling profiler ({} samples every {} s, by own samples):".format(s["samples"],
+                                                                                        s["interval"]))
+            for k, v, f in s["own"]:
+                lines.append("  {:>6.1f}%  {}".format(100 * f, k))
+        return "\n".join(lines)
+
+    def write(self, lcdir, load=None, units=None, prefix="lcproj.profile"):
+        """
+        Write the report to {prefix}.json and {prefix}.txt in the SWAT_LC project folder, and the cProfile
+        statistics to {prefix}.prof (readable with pstats/snakeviz).
+        :return: the report
+        """
+        rep = self.report(load, units)
+        with open(os.path.join(lcdir, prefix + ".json"), "w") as f:
+            json.dump(rep, f, indent=1)
+        with open(os.path.join(lcdir, prefix + ".txt"), "w") as f:
+            f.write(self.text(rep) + "\n")
+        if self.cprof is not None:
+            self.cprof.dump_stats(os.path.join(lcdir, prefix + ".prof"))
+        return rep
@@ -1,18 +1,90 @@
 # Author: Qianyang Wang
 import sys
+import json
+import time
+import datetime
+
+
+MODES = ["bar", "json", "off"]
 
 
 class ProgressBar:
 
-    def __init__(self,total_calcs):
-        self.total = total_calcs
+    def __init__(self, ndays, nsub=1, nhru=0, mode="bar", interval=1.0, stream=None):
+        """
+        Time-throttled progress of a simulation: percent, simulated days per second, HRU-days per second and ETA.
+        update can be called as often as needed, the progress is only written once per interval.
+        :param ndays: number of simulated days
+        :param nsub: number of sub-basins, the progress value is counted in sub-basin-days
+        :param nhru: number of HRUs (HRU-days per second)
+        :param mode: bar: progress line on the screen, json: one JSON line per interval (batch jobs),
+                     off: nothing is written (the callers check enabled before updating)
+        :param interval: minimum time between two writes (s)
+        :param stream: output stream, default: sys.stdout
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown progress mode: {}, available: {}.".format(mode, ", ".join(MODES)))
+        self.ndays = ndays
+        self.nsub = max(nsub, 1)
+        self.nhru = nhru
+        self.total = ndays * self.nsub
+        self.mode = mode
+        self.enabled = mode != "off"
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stdout
+        self.value = 0
+        self.t0 = None
+        self.next = 0
+
+    def start(self):
+        self.value = 0
+        self.t0 = time.monotonic()
+        self.next = self.t0 + self.interval
+        if self.enabled:
+            self.write(self.t0)
+
+    def update(self, value):
+        """
+        :param value: number of simulated sub-basin-days
+        """
+        self.value = value
+        now = time.monotonic()
+        if now >= self.next:
+            self.next = now + self.interval
+            self.write(now)
+
+    def finish(self):
+        """
+        Write the final progress (the simulation may have been stopped before the end of the period).
+        """
+        if self.enabled and self.t0 is not None:
+            self.write(time.monotonic(), done=True)
 
-    def update(self,value):
-        current_progress = self.calculate_current(value)
-        print("\r", end="")
-        print("Progress: {}%: ".format(round(current_progress,1)), "▋" * int(current_progress / 2), end="")
-        sys.stdout.flush()
+    def status(self, now):
+        """
+        :return: dict of the progress: percent, simulated days, elapsed time (s), days/s, HRU-days/s and ETA (s)
+        """
+        elapsed = now - self.t0
+        days = self.value / self.nsub
+        rate = days / elapsed if elapsed > 0 else 0
+        eta = (self.ndays - days) / rate if rate > 0 else None
+        return {"percent": 100 * self.value / self.total if self.total else 100, "days": days, "ndays": self.ndays,
+                "elapsed": elapsed, "days_per_s": rate, "hrudays_per_s": rate * self.nhru, "eta": eta}
 
-    def calculate_current(self,value):
-        p = 100 * value/self.total
-        return p
\ No newline at end of file
+    def write(self, now, done=False):
+        st = self.status(now)
+        if self.mode == "json":
+            st["done"] = done
+            self.stream.write(json.dumps(st) + "\n")
+        else:
+            if done:
+                tail = "elapsed {}".format(datetime.timedelta(seconds=int(st["elapsed"])))
+            elif st["eta"] is None:
+                tail = "ETA --:--:--"
+            else:
+                tail = "ETA {}".format(datetime.timedelta(seconds=int(st["eta"])))
+            # padded, a shorter line would not overwrite the end of the previous one
+            self.stream.write("\rProgress: {:5.1f}% {:<50} {:,.1f} days/s, {:,.0f} HRU-days/s, {:<20}{}".format(
+                st["percent"], "▋" * int(st["percent"] / 2), st["days_per_s"], st["hrudays_per_s"], tail,
+                "\n" if done else ""))
+        self.stream.flush()
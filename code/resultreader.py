@@ -1,31 +1,182 @@
 # Author: Qianyang Wang
 import pandas as pd
+import io
+import os
 import numpy as np
-import mysql.connector
 from sqlalchemy import create_engine
+from outindex import OutputIndex
+
+
+def _lcout_dtypes(columns, float32=False):
+    """
+    :return: dtypes of the SWAT-LC output columns for the typed loading
+    """
+    dtypes = {}
+    for c in columns:
+        if c in ("SUB", "HRU"):
+            dtypes[c] = np.int32
+        elif c in ("DATE", "POLLUTANT"):
+            dtypes[c] = str
+        else:
+            dtypes[c] = np.float32 if float32 else np.float64
+    return dtypes
+
+
+def _lcout_header(path):
+    if hasattr(path, "read"):
+        header = path.readline()
+        path.seek(0)
+        return (header.decode() if isinstance(header, bytes) else header).strip().split(",")
+    with open(path) as f:
+        return f.readline().strip().split(",")
+
+
+def read_lcout(path, typed=True, float32=False, usecols=None):
+    """
+    Load a SWAT-LC output file (lcproj.subout / lcproj.hruout).
+    :param path: path (or file object) of the output file
+    :param typed: True -> dates parsed to a DatetimeIndex, categorical POLLUTANT, int32 SUB/HRU;
+                  False -> pandas default dtypes (DATE strings as the index)
+    :param float32: load the results as float32 (typed loading only)
+    :param usecols: columns to load (DATE is always loaded as the index), default: all
+    :return: DataFrame indexed by DATE
+    """
+    if usecols is not None:
+        usecols = ["DATE"] + [c for c in usecols if c != "DATE"]
+    if not typed:
+        return pd.read_csv(path, index_col=0, header=0, usecols=usecols)
+    dtypes = _lcout_dtypes(usecols or _lcout_header(path), float32)
+    if "POLLUTANT" in dtypes:
+        dtypes["POLLUTANT"] = "category"
+    df = pd.read_csv(path, header=0, usecols=usecols, dtype=dtypes)
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop("DATE"), format="%Y-%m-%d"), name="DATE")
+    return df
+
+
+def iter_lcout(path, chunksize=1000000, typed=True, float32=False, usecols=None):
+    """
+    Iterate over a SWAT-LC output file in chunks, so that files larger than the memory can be analysed.
+    :param path: path of the output file
+    :param chunksize: number of rows in each chunk
+    :param typed, float32, usecols: see read_lcout, the categories of POLLUTANT are kept the same across the
+                                    chunks (all pollutants are listed on the first day of the output)
+    :return: generator of DataFrames indexed by DATE
+    """
+    if usecols is not None:
+        usecols = ["DATE"] + [c for c in usecols if c != "DATE"]
+    if not typed:
+        yield from pd.read_csv(path, index_col=0, header=0, usecols=usecols, chunksize=chunksize)
+        return
+    dtypes = _lcout_dtypes(usecols or _lcout_header(path), float32)
+    pollutants = []
+    for df in pd.read_csv(path, header=0, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        if "POLLUTANT" in df.columns:
+            pollutants += [p for p in pd.unique(df["POLLUTANT"]) if p not in pollutants]
+            df["POLLUTANT"] = pd.Categorical(df["POLLUTANT"], categories=pollutants)
+        df.index = pd.DatetimeIndex(pd.to_datetime(df.pop("DATE"), format="%Y-%m-%d"), name="DATE")
+        yield df
 
 
 class LCreader:
 
-    def __init__(self,path):
+    def __init__(self,path,typed=False,float32=False,useindex=True):
+        """
+        :param path: path of lcproj.subout / lcproj.hruout
+        :param typed: memory-lean typed loading (DatetimeIndex, categorical POLLUTANT, int32 ids), see read_lcout
+        :param float32: load the results as float32 (typed loading only)
+        :param useindex: use the sidecar index (.idx.npz, see Simulation.write_index) if it exists, the whole file
+                         is then only loaded when the metadata is accessed, single units are read by seeking
+        """
         self.path = path
-        self.metadata = self.readout()
+        self.unit = "HRU" if "hruout" in self.path else "SUB"
+        self.typed = typed
+        self.float32 = float32
+        self.index = OutputIndex.load(self.path) if useindex else None
+        self._metadata = None if self.index is not None else self.readout()
+        self._sorted = None     # results sorted by (unit, pollutant)
+        self._bounds = None     # {(unit id, pollutant): (first row, last row + 1)} in the sorted results
+        self._last = (None, None)   # last (unit id, pollutant) and its rows read with the index
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = self.readout()
+        return self._metadata
 
     def readout(self):
-        metadata = pd.read_csv(self.path,index_col=0,header=0)
+        metadata = read_lcout(self.path, typed=self.typed, float32=self.float32)
         return metadata
 
-    def inquireDataItem(self,id,pollutantname,itemname):
-        if "hruout" in self.path:
-            df = self.metadata[(self.metadata["HRU"] == id) & (self.metadata["POLLUTANT"] == pollutantname)][itemname]
+    def build_index(self):
+        """
+        Sort the results by (HRU/SUB, POLLUTANT) once (the date order is kept within each group), so that
+        the data of any unit and pollutant is a slice of the sorted table.
+        """
+        pcol = self.metadata["POLLUTANT"]
+        if isinstance(pcol.dtype, pd.CategoricalDtype):
+            pkeys = pcol.cat.codes.values
         else:
-            df = self.metadata[(self.metadata["SUB"] == id) & (self.metadata["POLLUTANT"] == pollutantname)][itemname]
+            pkeys = pcol.values
+        order = np.lexsort((pkeys, self.metadata[self.unit].values))
+        self._sorted = self.metadata.iloc[order]
+        units = self._sorted[self.unit].values
+        pkeys = pkeys[order]
+        pollutants = self._sorted["POLLUTANT"].values
+        starts = np.flatnonzero(np.r_[True, (units[1:] != units[:-1]) | (pkeys[1:] != pkeys[:-1])])
+        stops = np.r_[starts[1:], len(units)]
+        self._bounds = {(units[i], pollutants[i]): (i, j) for i, j in zip(starts, stops)}
+
+    def read_indexed(self, id, pollutantname):
+        """
+        Read the results of one unit and pollutant with the sidecar index, without parsing the whole file.
+        :return: DataFrame indexed by DATE (same columns and dtypes as the metadata)
+        """
+        if self._last[0] != (id, pollutantname):
+            with open(self.path, "rb") as f:
+                rows = self.index.read_rows(f, id, pollutantname)
+            buf = io.BytesIO((",".join(self.index.columns) + "\n").encode() + rows)
+            df = read_lcout(buf, typed=self.typed, float32=self.float32)
+            if not rows and not self.typed:
+                df = df.astype({c: np.int64 if c in ("SUB", "HRU") else np.float64
+                                for c in df.columns if c != "POLLUTANT"})
+            self._last = ((id, pollutantname), df)
+        return self._last[1]
+
+    def inquireDataItem(self,id,pollutantname,itemname):
+        if self._metadata is None and self.index is not None:
+            return self.read_indexed(id, pollutantname)[itemname]
+        if self._bounds is None:
+            self.build_index()
+        if (id, pollutantname) not in self._bounds:
+            return self.metadata[itemname].iloc[0:0]
+        i, j = self._bounds[(id, pollutantname)]
+        df = self._sorted[itemname].iloc[i:j]
         #arr = np.array(df).flatten()
         return df
 
-    def toWASP8db(self,path=None):
+    def inquireAllItems(self, itemnames=None):
+        """
+        Get the results of all units and pollutants at once.
+        :param itemnames: list of the result items (e.g. ["MTkg", "MSURkg"]), default: all
+        :return: DataFrame indexed by date, the columns are (HRU/SUB, POLLUTANT, item)
+        """
+        if itemnames is None:
+            itemnames = [c for c in self.metadata.columns if c not in (self.unit, "SUB", "HRU", "POLLUTANT")]
+        df = self.metadata.set_index([self.unit, "POLLUTANT"], append=True)[itemnames]
+        df = df.unstack([self.unit, "POLLUTANT"])
+        df = df.reorder_levels([1, 2, 0], axis=1).sort_index(axis=1, level=[0, 1], sort_remaining=False)
+        return df
+
+    def toWASP8db(self,path=None,chunksize=100000):
+        """
+        :param path: path of the WASP8 external database, the format follows the extension:
+                     .xlsx (default) -> Excel, .csv / .parquet -> streamed in chunks (for large results)
+        :param chunksize: number of subout rows read at a time (csv/parquet)
+        """
         if not "subout" in self.path:
             raise NotImplementedError("The current version only accept the sub-basin output.")
+        if path and os.path.splitext(path)[1].lower() in (".csv", ".parquet"):
+            subout2waspfile(self.path, path, chunksize=chunksize)
         else:
             data = self.metadata.iloc[:,0:3]
             data["SUB"] = data["SUB"].map(lambda x: "Reach{}".format(x))
@@ -37,7 +188,7 @@ class LCreader:
             else:
                 data.to_excel("SWATLC_WASPDB.xlsx")
 
-    def toWASP8dbMySQL(self, db_config=None):
+    def toWASP8dbMySQL(self, db_config=None, batchsize=10000):
         """
         :param db_config:
             {
@@ -47,6 +198,7 @@ class LCreader:
                 'database': 'SWATLC_SSP126_2050s',
                 'table':"chrnap"
             }
+        :param batchsize: number of rows in each multi-row insert
         :return:
         """
 
@@ -54,20 +206,84 @@ class LCreader:
         if not "subout" in self.path:
             raise NotImplementedError("The current version only accepts the sub-basin output.")
 
-        data = self.metadata.iloc[:, 0:3].copy()
-        data["SUB"] = data["SUB"].map(lambda x: f"Reach{x}")
-        data = data.reset_index()
-        data = data.rename(columns={
-            "DATE":"TIME",
-            "SUB": "STATION",
-            "POLLUTANT": "VARIABLE",
-            "MTkg": "VALUE"
-        })
-        data["TIME"] = pd.to_datetime(data["TIME"]).dt.strftime("%-m/%-d/%Y") #WASP time format
-        engine = create_engine('mysql+pymysql://{}:{}@{}:3306/{}'.format(db_config["user"],db_config["password"],
-                                                                          db_config["host"],db_config["database"]))
-        data.to_sql(db_config["table"], con=engine, if_exists='append', index=False)
+        url = 'mysql+pymysql://{}:{}@{}:3306/{}'.format(db_config["user"],db_config["password"],
+                                                        db_config["host"],db_config["database"])
+        subout2waspdb(self.path, url, db_config["table"], batchsize=batchsize)
 
 
+def iter_wasp_rows(subout, chunksize=100000):
+    """
+    Read the sub-basin output in chunks and convert them to the WASP8 external database layout.
+    :param subout: path of lcproj.subout
+    :param chunksize: number of subout rows read at a time
+    :return: generator of DataFrames with the columns TIME (m/d/Y, WASP time format), STATION (Reach{SUB}),
+             VARIABLE (pollutant) and VALUE (MTkg)
+    """
+    times = {}      # formatted dates, each date is parsed once
+    reader = pd.read_csv(subout, usecols=["DATE", "SUB", "POLLUTANT", "MTkg"], chunksize=chunksize,
+                         dtype={"DATE": str, "SUB": np.int64, "POLLUTANT": str, "MTkg": np.float64})
+    for chunk in reader:
+        new = [d for d in pd.unique(chunk["DATE"]) if d not in times]
+        for d, t in zip(new, pd.to_datetime(new)):
+            times[d] = "{}/{}/{}".format(t.month, t.day, t.year)
+        yield pd.DataFrame({"TIME": chunk["DATE"].map(times).values,
+                            "STATION": "Reach" + chunk["SUB"].astype(str).values,
+                            "VARIABLE": chunk["POLLUTANT"].values,
+                            "VALUE": chunk["MTkg"].values})
 
 
+def subout2waspdb(subout, url, table, batchsize=10000, chunksize=100000, if_exists="append", multirow=True):
+    """
+    Stream the sub-basin output into a WASP8 external database table without loading the whole file.
+    :param subout: path of lcproj.subout
+    :param url: SQLAlchemy database URL, e.g. "sqlite:///SWATLC_WASPDB.db", "mysql+pymysql://user:pw@host:3306/db"
+    :param table: name of the table
+    :param batchsize: number of rows in each insert
+    :param chunksize: number of subout rows read at a time
+    :param if_exists: "append", "replace" or "fail", applies to the existing table before the first chunk
+    :param multirow: use multi-row INSERT ... VALUES statements (SQLite uses executemany, which is faster there
+                     and not limited by the number of bound variables)
+    :return: number of inserted rows
+    """
+    engine = create_engine(url)
+    method = "multi" if multirow and engine.dialect.name != "sqlite" else None
+    nrows = 0
+    with engine.begin() as con:
+        for chunk in iter_wasp_rows(subout, chunksize):
+            chunk.to_sql(table, con=con, if_exists=if_exists if nrows == 0 else "append", index=False,
+                         chunksize=batchsize, method=method)
+            nrows += len(chunk.index)
+    engine.dispose()
+    return nrows
+
+
+def subout2waspfile(subout, path, chunksize=100000):
+    """
+    Stream the sub-basin output into a WASP8 external database file (.csv or .parquet), replacing the Excel
+    export for large results.
+    :param subout: path of lcproj.subout
+    :param path: output path, the format follows the extension
+    :param chunksize: number of subout rows read at a time
+    :return: number of written rows
+    """
+    fmt = os.path.splitext(path)[1].lower()
+    if fmt not in (".csv", ".parquet"):
+        raise ValueError("Unsupported WASP database file format: {}, use .csv or .parquet.".format(fmt))
+    nrows = 0
+    writer = None
+    try:
+        for chunk in iter_wasp_rows(subout, chunksize):
+            if fmt == ".csv":
+                chunk.to_csv(path, mode="w" if nrows == 0 else "a", header=nrows == 0, index=False)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                tab = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, tab.schema)
+                writer.write_table(tab)
+            nrows += len(chunk.index)
+    finally:
+        if writer is not None:
+            writer.close()
+    return nrows
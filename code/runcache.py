@@ -0,0 +1,147 @@
+# Persistent on-disk cache of the simulation results
+import os
+import glob
+import json
+import pickle
+import hashlib
+import datetime
+import numpy as np
+
+
+# SWAT files read by SWAT_LC
+SWATFILES = ["file.cio", "basins.bsn", "*.sub", "*.hru", "*.gw", "*.sol", "*.rte", "output.hru", "output.sub",
+             "output.rch", "Tmp1.Tmp"]
+
+
+def _jsonable(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (datetime.date, datetime.datetime)):
+        return o.isoformat()
+    if callable(o):
+        return o.__name__
+    return str(o)
+
+
+def canonical(obj):
+    """
+    :return: canonical JSON text of a (nested) object, used for hashing
+    """
+    return json.dumps(obj, sort_keys=True, default=_jsonable)
+
+
+def swat_fingerprint(swatdir):
+    """
+    Fingerprint of the SWAT inputs: name, size and modification time of the SWAT files read by SWAT_LC. It is taken
+    once when the SWAT results are loaded (PROJmanager.fingerprint), so the runs are cached under the inputs they
+    were simulated with.
+    """
+    files = sorted(set(f for pattern in SWATFILES for f in glob.glob(os.path.join(swatdir, pattern))))
+    stats = []
+    for f in files:
+        st = os.stat(f)
+        stats.append([os.path.basename(f), st.st_size, st.st_mtime_ns])
+    return canonical(stats)
+
+
+def lc_signature(mdl):
+    """
+    All the resolved SWAT_LC settings and parameters of a loaded project (PROJmanager) that affect the results,
+    including the user defined (sub-basin/HRU) parameters and the initial conditions.
+    """
+    settings = {k: getattr(mdl, k) for k in ("bumth", "womth", "docmth", "outstart", "outend", "hruout", "docout",
+                                             "initype", "flagwater", "riverflux", "tmpgage", "simstart", "simend",
+                                             "engine")}
+    subs = [{k: v for k, v in vars(s).items() if k not in ("input", "stvars", "hrulist", "swatdir")}
+            for s in mdl.sublist]
+    hrus = [{k: v for k, v in vars(h).items() if k not in ("input", "stvars", "swatdir")}
+            for s in mdl.sublist for h in s.hrulist]
+    sig = {"settings": settings, "swat": mdl.settings, "glbparam": mdl.glbparam,
+           "pollutants": [vars(p) for p in mdl.pollutants],
+           "lu": {k: vars(v) for k, v in mdl.lu.items()},
+           "soils": {k: vars(v) for k, v in mdl.soils.items()},
+           "subs": subs, "hrus": hrus,
+           "inimsoil": sorted([h, p, m] for (h, p), m in mdl.inimsoil.items())}
+    return canonical(sig)
+
+
+class RunCache:
+
+    def __init__(self, path, maxbytes=2 * 1024 ** 3):
+        """
+        Results of the simulation runs stored in a folder, one file per run. The least recently used entries are
+        removed when the total size exceeds maxbytes.
+        :param path: cache folder
+        :param maxbytes: max total size of the cache (bytes)
+        """
+        self.path = path
+        self.maxbytes = maxbytes
+        os.makedirs(path, exist_ok=True)
+
+    def __repr__(self):
+        return f"RunCache({self.path}, {len(self.entries())} entries)"
+
+    @staticmethod
+    def key(*parts):
+        """
+        :return: hash of the canonical form of the parts
+        """
+        h = hashlib.sha256()
+        for p in parts:
+            h.update(canonical(p).encode() if not isinstance(p, str) else p.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def entries(self):
+        return glob.glob(os.path.join(self.path, "*.pkl"))
+
+    def get(self, key):
+        """
+        :return: the cached value, None if the key is not in the cache
+        """
+        f = self.entry(key)
+        try:
+            with open(f, "rb") as fhnd:
+                value = pickle.load(fhnd)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(f)     # most recently used
+        return value
+
+    def put(self, key, value):
+        f = self.entry(key)
+        tmp = "{}.{}.tmp".format(f, os.getpid())
+        with open(tmp, "wb") as fhnd:
+            pickle.dump(value, fhnd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, f)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is within its size limit.
+        """
+        stats = []
+        for f in self.entries():
+            try:
+                st = os.stat(f)
+            except FileNotFoundError:
+                continue
+            stats.append((st.st_mtime_ns, st.st_size, f))
+        total = sum(s[1] for s in stats)
+        for mtime, size, f in sorted(stats):
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for f in self.entries():
+            os.remove(f)
@@ -0,0 +1,104 @@
+# Stateless stages of the SWAT_LC daily loop, computed for the whole simulation period before the time loop
+import numpy as np
+import outcrop
+from wqutils import masked_div
+
+
+def outcrop_loads(mdl, ndays):
+    """
+    Channel outcrop erosion loads of every reach and pollutant. The erosion only depends on the reach flow, the
+    channel width, the air temperature and the constant .ocp coefficients, so the whole series is evaluated at once.
+    DOC and the reaches without outcrops have no outcrop erosion.
+    :param mdl: the loaded project (PROJmanager)
+    :param ndays: number of simulated days
+    :return: (day, sub-basin, pollutant) array of the daily erosion mass (kg), in the order of mdl.sublist and
+             mdl.pollutants
+    """
+    loads = np.zeros((ndays, len(mdl.sublist), len(mdl.pollutants)))
+    for j, sub in enumerate(mdl.sublist):
+        if sub.hasoutcrop is not True:
+            continue
+        rchflow = np.asarray(sub.input["Flow"][:ndays], dtype=float)
+        tmp = np.asarray(sub.input["TMP"][:ndays], dtype=float)
+        for k, pollutant in enumerate(mdl.pollutants):
+            if pollutant.name != "DOC":
+                p = pollutant.name
+                loads[:, j, k] = outcrop.washload_equation_m(sub.cocp[p], sub.kocp[p], rchflow, sub.width,
+                                                             sub.nocp[p], sub.qwcr[p], sub.ea[p], sub.t0[p], tmp)
+    return loads
+
+
+def riverflux_loads(mdl, ndays):
+    """
+    Pollutant loads received directly by the water surface of every reach (RIVERFLUX): the dry flux
+    watsurf * riverflux/365 and the wet deposition watsurf * precipitation * cprep, with the reach settings of
+    .usrflux taking priority over the global settings of .plt.
+    :param mdl: the loaded project (PROJmanager)
+    :param ndays: number of simulated days
+    :return: (day, sub-basin, pollutant) array of the daily flux mass (kg), in the order of mdl.sublist and
+             mdl.pollutants
+    """
+    loads = np.zeros((ndays, len(mdl.sublist), len(mdl.pollutants)))
+    for j, sub in enumerate(mdl.sublist):
+        subpcp = np.asarray(sub.input["PRECIP"][:ndays], dtype=float)
+        for k, pollutant in enumerate(mdl.pollutants):
+            if sub.usrflux[pollutant.name]:
+                flux = sub.riverflux[pollutant.name]
+                cprep = sub.cprep[pollutant.name]
+            else:
+                flux = pollutant.flux
+                cprep = pollutant.cprep
+            dry = sub.watsurf * (flux / 365) / (10 ** 9)  # m2 * ug/(m2 * yr) ug -> kg
+            wet = sub.watsurf * subpcp * cprep / (10 ** 12)  # m2 * mm -> 0.001 m3 -> L    ng/10**12 -> kg
+            loads[:, j, k] = np.where(subpcp != 0, dry + wet, dry)
+    return loads
+
+
+def doc_params(mdl):
+    """
+    Constant DOC properties of every HRU, the HRU settings of .usrsol take priority over the soil settings of .sol.
+    :param mdl: the loaded project (PROJmanager)
+    :return: None if DOC is not simulated, otherwise a dict of the HRU arrays "area", "morgc", "msolid", "fdoc" and
+             "cbase" in the order of mdl.hruinput
+    """
+    if "DOC" not in [p.name for p in mdl.pollutants]:
+        return None
+    hrus = {h.id: h for s in mdl.sublist for h in s.hrulist}
+    hrus = [hrus[i] for i in mdl.hruinput.hruids]
+    return {"area": np.array([h.area for h in hrus], dtype=float),
+            "morgc": np.array([h.morgc for h in hrus], dtype=float),
+            "msolid": np.array([h.msolid for h in hrus], dtype=float),
+            "fdoc": np.array([h.fdoc["DOC"] if h.usrsol["DOC"] else mdl.soils[h.soiltype].fdoc["DOC"] for h in hrus],
+                             dtype=float),
+            "cbase": np.array([h.cbase["DOC"] if h.usrsol["DOC"] else mdl.soils[h.soiltype].cbase["DOC"]
+                               for h in hrus], dtype=float)}
+
+
+def doc_series(mdl, params, block):
+    """
+    DOC of every HRU for a block of days. The DOC in the soil water only depends on the soil water (SWEND, PERC,
+    LATQ) and the constant soil organic carbon (docmth, fdoc), the groundwater DOC is the constant cbase, so none of
+    them depends on the previous days. Only the days of the input block are computed, so nothing of the whole period
+    is kept in memory (out-of-core mode).
+    :param mdl: the loaded project (PROJmanager)
+    :param params: DOC properties of the HRUs (doc_params)
+    :param block: (day, inputcube.HRUVARS, HRU) HRU inputs of the days (InputCube.block)
+    :return: dict of the (day, HRU) arrays "cw" (DOC conc. in the soil water, ng/L), "mdoc" (DOC mass in the soil
+             water, kg), "mlat" (lateral flow load, kg), "mgwrch" and "mdgwrch" (shallow/deep aquifer loads to the
+             reach, kg), and the HRU array "cbase" (ng/L). The HRUs are in the order of mdl.hruinput.
+    """
+    area, morgc, fdoc, cbase = params["area"], params["morgc"], params["fdoc"], params["cbase"]
+    var = {v: i for i, v in enumerate(mdl.hruinput.varnames)}
+    latq = block[:, var["LATQ"]]
+    vswc = (block[:, var["SWEND"]] + block[:, var["PERC"]] + latq) * area * 1000  # mm * km2 = 1000 m3
+    if mdl.docmth == 0:
+        csoc = 10 ** 6 * morgc / params["msolid"]  # mg/kg
+        cdoc = csoc * fdoc  # mg/L
+    else:
+        cdoc = masked_div(10 ** 3 * morgc, vswc) * fdoc  # mg/L
+    mdoc = cdoc * vswc / 1000  # kg
+    cw = masked_div(10 ** 9 * mdoc, vswc)  # ng/L
+    return {"cw": cw, "mdoc": mdoc, "mlat": cw * latq * area / 10 ** 6,
+            "mgwrch": cbase * block[:, var["GWQ"]] * area / 10 ** 6,  # ng/L * mm * km2 = mg; mg/10**6 = kg
+            "mdgwrch": cbase * block[:, var["DGWQ"]] * area / 10 ** 6,
+            "cbase": cbase}
@@ -0,0 +1,125 @@
+# Surface lag storage of SWAT_LC solved along the time axis for all the HRUs and pollutants at once
+import sys
+import numpy as np
+from wqutils import decay
+
+
+"""
+The surface lag storage is a first-order linear recurrence x[t] = (1 - r) * (x[t-1] - kd * x[t-1] + m[t]) once the
+load of the generated surface runoff m is known. The surface process (build-up and wash-off) does not depend on the
+soil layer or the aquifers, so the loads of a range of days are computed first and the storage is then scanned along
+the days: surface_lag_series with whole-array steps (Python engine), lag_scan with explicit loops (compiled by the
+kernel with Numba). The operations are done in the same order as the daily surface.surface_lag step, the results are
+the same as those of the step-by-step loop (see check).
+The recharge delay and the aquifer storages are not solved this way: the revap of the shallow aquifer goes back to
+the soil layer, which also gives the percolation load, so they stay in the daily loop.
+"""
+
+
+def lag_factor(surlag, Lslp, slp, nov, area, Lrch, slprch, nrch):
+    """
+    Fraction of the stored surface load released to the reach every day, see surface.surface_lag for the parameters.
+    """
+    tov = 0.0556 * (Lslp * nov) ** 0.6 / slp ** 0.3
+    tch = 0.62 * Lrch * nrch ** 0.75 / (area ** 0.125 * slprch ** 0.375)
+    tconc = tov + tch
+    return 1 - np.exp(-surlag / tconc)
+
+
+def lag_factors(mdl):
+    """
+    Released fraction of every HRU, the global SURLAG of basins.bsn is used if the HRU SURLAG is not set
+    (SURLAG <= 0, older SWAT versions).
+    :param mdl: the loaded project (PROJmanager)
+    :return: (HRU,) array in the order of mdl.hruinput
+    """
+    subs = {h.id: s for s in mdl.sublist for h in s.hrulist}
+    hrus = {h.id: h for s in mdl.sublist for h in s.hrulist}
+    r = np.zeros(len(mdl.hruinput.hruids))
+    for i, hid in enumerate(mdl.hruinput.hruids):
+        h, sub = hrus[hid], subs[hid]
+        surlag = mdl.glbparam["SURLAG"] if h.NORparam["SURLAG"] <= 0 else h.NORparam["SURLAG"]
+        r[i] = lag_factor(surlag, h.NORparam["SLSUBBSN"], h.NORparam["HRU_SLP"], h.NORparam["OV_N"], h.area,
+                          sub.NORparam["CH_L1"] * h.NORparam["HRU_FR"], sub.NORparam["CH_S1"], sub.NORparam["CH_N1"])
+    return r
+
+
+def surface_lag_series(mhrmv, msurfstor, kd, r):
+    """
+    Surface lag storage (surface.surface_lag) with the decay of the stored load.
+    :param mhrmv: (day, HRU, pollutant) load of the generated surface runoff (kg)
+    :param msurfstor: (HRU, pollutant) storage at the end of the previous day (kg)
+    :param kd: decay coefficient in water (1/day), broadcast over (HRU, pollutant)
+    :param r: released fraction (see lag_factor), broadcast over (HRU, pollutant)
+    :return: (day, HRU, pollutant) load to the reach msurrch (kg), (HRU, pollutant) storage at the end of the last day
+    """
+    msurrch = np.empty(np.shape(mhrmv))
+    s = np.asarray(msurfstor, dtype=float)
+    for t in range(msurrch.shape[0]):
+        m = mhrmv[t] + decay(s, kd)
+        msurrch[t] = m * r
+        s = m - msurrch[t]
+    return msurrch, s
+
+
+def lag_scan(mhrmv, stor, kd, r, msurrch):
+    """
+    Same as surface_lag_series with explicit loops, compiled by kernel with Numba.
+    :param mhrmv: (day, HRU, pollutant) load of the generated surface runoff (kg)
+    :param stor: (HRU, pollutant) storage at the end of the previous day (kg), updated in place
+    :param kd: (HRU, pollutant) decay coefficient in water (1/day)
+    :param r: (HRU,) released fraction
+    :param msurrch: (day, HRU, pollutant) load to the reach (kg), filled in place
+    """
+    for i in range(stor.shape[0]):
+        for k in range(stor.shape[1]):
+            s = stor[i, k]
+            for t in range(mhrmv.shape[0]):
+                m = mhrmv[t, i, k] + (s - kd[i, k] * s)
+                msurrch[t, i, k] = m * r[i]
+                s = m - msurrch[t, i, k]
+            stor[i, k] = s
+
+
+def check(ndays=1000, nhru=50, npoll=3, seed=0, scan=None):
+    """
+    Compare surface_lag_series and lag_scan with the daily step of Simulation.run (decay of the stored load and
+    surface.surface_lag) on random loads and HRU properties.
+    :param scan: lag_scan function to check, default: the compiled scan of kernel (Numba) if available
+    :return: dict of the max absolute differences "series" and "scan" to the step loop (0 -> same results)
+    """
+    import surface
+    if scan is None:
+        import kernel
+        scan = kernel.lag_scan
+    rng = np.random.default_rng(seed)
+    mhrmv = rng.exponential(1.0, (ndays, nhru, npoll)) * (rng.random((ndays, nhru, 1)) < 0.3)
+    stor0 = rng.random((nhru, npoll))
+    kd = rng.random((nhru, npoll)) * 0.1
+    prop = [rng.uniform(lo, hi, nhru) for lo, hi in ((0.5, 12), (10, 120), (0.01, 0.5), (0.05, 0.5), (0.1, 10),
+                                                     (0.5, 20), (0.001, 0.05), (0.01, 0.1))]
+    r = np.array([lag_factor(*[float(p[i]) for p in prop]) for i in range(nhru)])
+
+    step = np.zeros_like(mhrmv)
+    stepstor = np.zeros_like(stor0)
+    for i in range(nhru):
+        for k in range(npoll):
+            msurfstor = float(stor0[i, k])
+            for t in range(ndays):
+                msurfstor = decay(msurfstor, float(kd[i, k]))
+                step[t, i, k], msurfstor = surface.surface_lag(float(mhrmv[t, i, k]), msurfstor,
+                                                               *[float(p[i]) for p in prop])
+            stepstor[i, k] = msurfstor
+
+    series, stor = surface_lag_series(mhrmv, stor0, kd, r[:, None])
+    scanned = np.zeros_like(mhrmv)
+    scanstor = stor0.copy()
+    scan(mhrmv, scanstor, kd, r, scanned)
+    return {"series": max(np.abs(series - step).max(), np.abs(stor - stepstor).max()),
+            "scan": max(np.abs(scanned - step).max(), np.abs(scanstor - stepstor).max())}
+
+
+if __name__ == "__main__":
+    # python storages.py [NDAYS NHRU NPOLL]
+    diff = check(*[int(a) for a in sys.argv[1:4]])
+    print("Max difference to the step loop: series {series:g}, scan {scan:g}".format(**diff))
@@ -1,6 +1,8 @@
 # Author: Qianyang Wang
 import numpy as np
 
+# The process functions take scalars or arrays of any broadcastable shape (e.g. HRU x pollutant x ensemble member).
+
 
 def cal_partioning(theta,kdoc,cwdoc,kp,dsoil):
     """
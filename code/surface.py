@@ -5,6 +5,9 @@ import numpy as np
 Dry deposition & Other terrestrial process: build-up
 Wet deposition: rain concentration
 Load calc.: wash-off
+
+The process functions take scalars or arrays of any broadcastable shape (e.g. HRU x pollutant x ensemble member),
+the arguments are never modified in place.
 """
 
 
@@ -19,8 +22,8 @@ def power_build_up(bmax,k,n,accum,dt):
     :return:
     """
     b = k * dt**n
-    accum += b
-    return min(bmax,accum)
+    accum = accum + b
+    return np.minimum(bmax,accum)
 
 
 def exp_build_up(bmax,k,accum,dt):
@@ -32,8 +35,8 @@ def exp_build_up(bmax,k,accum,dt):
     :return:
     """
     b = bmax * (1 - np.exp(-k * dt))
-    accum += b
-    return min(bmax,accum)
+    accum = accum + b
+    return np.minimum(bmax,accum)
 
 
 def sat_build_up(bmax,k,accum):
@@ -44,8 +47,8 @@ def sat_build_up(bmax,k,accum):
     :return:
     """
     b = bmax * 1/ (k + 1)
-    accum += b
-    return min(bmax,accum)
+    accum = accum + b
+    return np.minimum(bmax,accum)
 
 
 def half_sat_build_up(bmax,k,accum,dt):
@@ -57,8 +60,8 @@ def half_sat_build_up(bmax,k,accum,dt):
     :return:
     """
     b = bmax * dt/ (k + dt)
-    accum += b
-    return min(bmax,accum)
+    accum = accum + b
+    return np.minimum(bmax,accum)
 
 
 def exponential_wash_off(m,k,dt=1):
@@ -100,7 +103,7 @@ def rating_curve_wash_off(m,k,q,n):
     :param n: coefficient
     :return:
     """
-    w = min(m,k*q**n)
+    w = np.minimum(m,k*q**n)
     remain = m - w
     return remain, w
 
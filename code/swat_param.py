@@ -1,4 +1,5 @@
 # Author: Qianyang Wang
+import os
 import re
 
 
@@ -12,10 +13,11 @@ class ParamIO:
         self.parameters = {}
         self.paratypes = {}
         self.descriptions = {}
-        if "sol" in fpath:
+        ftype = os.path.splitext(fpath)[1]    # file type by the extension, the folder name may contain "sol"/"hru"
+        if ftype == ".sol":
             self.sol = True
             self._parsesol(self.hnd)
-        elif "hru" in fpath:
+        elif ftype == ".hru":
             self.lu = self._get_lu_label(self.hnd)
             self.id = self._get_hruid(self.hnd)
             self.subid = self._get_subid(self.hnd)
@@ -1,6 +1,7 @@
 # Fork from https://github.com/ougx/swatResultReader
 # Modified by Qianyang Wang
 import os
+import io
 import pandas as pd
 import numpy as np
 import datetime
@@ -235,10 +236,15 @@ class SWATreader():
         widths = [4, 5, 10, 5, 5, 3, 3, 5, 11]
         return cols_first + [c.strip() for c in columns], widths + [10] * 66 + [11,11] + [10] * 10
 
-    def read_sub(self):
+    def read_sub(self, start=None, end=None):
         '''
         read SWAT output reach
 
+        Parameters
+        ----------
+        start, end : str or datetime, optional
+            only read the days within the window (daily output only).
+
         Returns
         -------
         dat : TYPE
@@ -249,8 +255,13 @@ class SWATreader():
 
         assert os.path.exists(fpath), '{} does not exist. Make sure the model run has completed.'.format(fpath)
 
+        columns, widths = self.get_sub_header_width()
+        dat = self.read_window(fpath, columns, widths, start, end)
+        if dat is not None:
+            self.df_out = dat.iloc[:, [1] + list(range(columns.index('AREAkm2'), len(columns)))]
+            return self.df_out
+
         with open(fpath) as f:
-            columns, widths = self.get_sub_header_width()
             dat = pd.read_fwf(f, skiprows=9, header=None, widths=widths)
             dat.columns = columns
             if self.cio['ICALEN'] == '1':
@@ -266,13 +277,20 @@ class SWATreader():
                 dat.index = np.repeat(date_index, nsub)
                 dat.index.name = 'time'
         self.df_out = dat.iloc[:, [1] + list(range(columns.index('AREAkm2'), len(columns)))]
+        if start is not None and end is not None:
+            self.df_out = self.df_out.loc[pd.Timestamp(start):pd.Timestamp(end)]
         return self.df_out
 
 
-    def read_rch(self):
+    def read_rch(self, start=None, end=None):
         '''
         read SWAT output reach
 
+        Parameters
+        ----------
+        start, end : str or datetime, optional
+            only read the days within the window (daily output only).
+
         Returns
         -------
         dat : TYPE
@@ -283,8 +301,13 @@ class SWATreader():
 
         assert os.path.exists(fpath), '{} does not exist. Make sure the model run has completed.'.format(fpath)
 
+        columns, widths = self.get_rch_header_width()
+        dat = self.read_window(fpath, columns, widths, start, end)
+        if dat is not None:
+            self.df_out = dat.iloc[:, [1] + list(range(columns.index('AREAkm2') + 1, len(columns)))]
+            return self.df_out
+
         with open(fpath) as f:
-            columns, widths = self.get_rch_header_width()
             dat = pd.read_fwf(f, skiprows=9, header=None, widths=widths)
             dat.columns = columns
             if self.cio['ICALEN'] == '1':
@@ -300,6 +323,8 @@ class SWATreader():
                 dat.index = np.repeat(date_index, nsub)
                 dat.index.name = 'time'
         self.df_out = dat.iloc[:, [1] + list(range(columns.index('AREAkm2') + 1, len(columns)))]
+        if start is not None and end is not None:
+            self.df_out = self.df_out.loc[pd.Timestamp(start):pd.Timestamp(end)]
         return self.df_out
 
     def read_sed(self):
@@ -330,10 +355,15 @@ class SWATreader():
         self.df_out = dat.iloc[:, [1] + list(range(columns.index('AREAkm2') + 1, len(columns)))]
         return self.df_out
 
-    def read_hru(self):
+    def read_hru(self, start=None, end=None):
         """
         read SWAT output hru
 
+        Parameters
+        ----------
+        start, end : str or datetime, optional
+            only read the days within the window (daily output only).
+
         Returns
         -------
         dat : TYPE
@@ -343,9 +373,13 @@ class SWATreader():
         fpath = os.path.join(self.TxtInOut, 'output.hru')
         assert os.path.exists(fpath), '{} does not exist. Make sure the model run has completed.'.format(fpath)
 
-        with open(fpath,"r") as f:
+        columns, widths = self.get_hru_header_width()
+        dat = self.read_window(fpath, columns, widths, start, end)
+        if dat is not None:
+            self.df_out = dat.iloc[:, list(range(0,5)) + list(range(columns.index('AREAkm2'), len(columns)))]
+            return self.df_out
 
-            columns, widths = self.get_hru_header_width()
+        with open(fpath,"r") as f:
             dat = pd.read_fwf(f, skiprows=9, header=None, widths=widths)
             dat.columns = columns
             step = {'0': 'M', '1': 'D', '2': 'A'}
@@ -355,10 +389,74 @@ class SWATreader():
             dat.index = np.repeat(date_index, nhrus)
             dat.index.name = 'time'
         self.df_out = dat.iloc[:, list(range(0,5)) + list(range(columns.index('AREAkm2'), len(columns)))]
+        if start is not None and end is not None:
+            self.df_out = self.df_out.loc[pd.Timestamp(start):pd.Timestamp(end)]
         return self.df_out
 
 
 
+    def read_window(self, fpath, columns, widths, start, end, skiprows=9):
+        """
+        Read the rows of a daily SWAT output file (output.hru/.sub/.rch) within [start, end] only.
+        SWAT writes a fixed number of rows (one per HRU/sub-basin/reach) for each day and every row has the
+        same length, so the byte offset of any day can be computed and the rows outside the window are skipped.
+
+        Parameters
+        ----------
+        fpath : str
+            path of the output file
+        columns, widths : list
+            column names and widths (see get_*_header_width)
+        start, end : str or datetime
+            the window to be read
+        skiprows : int
+            number of header lines
+
+        Returns
+        -------
+        dat : DataFrame or None
+            the rows within the window indexed by date, None if no window is given, the output is not daily,
+            or the file layout is not regular (then the whole file should be read instead).
+
+        """
+        if start is None or end is None or self.cio['IPRINT'] != '1':
+            return None
+        start = pd.Timestamp(start)
+        end = pd.Timestamp(end)
+        if start < self.output_start_date or end > self.output_end_date or start > end:
+            raise ValueError("The window {} - {} is not within the SWAT output period {} - {}.".format(
+                start.date(), end.date(), self.output_start_date.date(), self.output_end_date.date()))
+        unitloc = slice(widths[0], widths[0] + widths[1])  # the 2nd column is the HRU/SUB/RCH number
+        with open(fpath, "rb") as f:
+            for i in range(skiprows):
+                f.readline()
+            header = f.tell()
+            first = f.readline()
+            rowlen = len(first)
+            nunit = 1
+            while True:
+                r = f.readline()
+                if not r or r[unitloc] == first[unitloc]:
+                    break
+                if len(r) != rowlen:
+                    return None
+                nunit += 1
+            ndays = (end - start).days + 1
+            f.seek(header + (start - self.output_start_date).days * nunit * rowlen)
+            block = f.read(ndays * nunit * rowlen)
+        if len(block) != ndays * nunit * rowlen or block[unitloc] != first[unitloc]:
+            return None
+        dat = pd.read_fwf(io.BytesIO(block), header=None, widths=widths)
+        dat.columns = columns
+        # make sure the offset is correct
+        if "YR" in columns and (dat.YR.iloc[0], dat.MO.iloc[0], dat.DA.iloc[0]) != (start.year, start.month, start.day):
+            return None
+        if "MON" in columns and dat.MON.iloc[0] != start.dayofyear:
+            return None
+        dat.index = np.repeat(pd.date_range(start, end), nunit)
+        dat.index.name = 'time'
+        return dat
+
     @staticmethod
     def filter(df_out, units, vars, freq=None, stat=None):
         '''
@@ -450,25 +548,65 @@ class SWATreader():
             return np.array(res)
 
 
-    def read_TMP(self):
+    def read_TMP_stations(self):
+        """
+        read the SWAT temperature file (Tmp1.Tmp) of all stations
+
+        Returns
+        -------
+        tmpdf : DataFrame
+            daily max & min air temperature (degC) of each station, indexed by date. Columns are named as
+            (station No., "MAX"/"MIN"), the missing values (-99) are replaced by NaN.
+
+        """
         fpath = os.path.join(self.TxtInOut, 'Tmp1.Tmp')
-        with open(fpath) as f:
-            data = f.readlines()[4:]
-            dataseries = []
-            tempseries = []
-            for r in data:
-                date = r[0:7]
-                tmps = [float(r[7+i*5:7+(i+1)*5]) for i in range(int(len(r[7:-1])/5))]
-                dataseries.append(date)
-                tempseries.append(tmps)
-            dataseries = pd.Series(dataseries)
-            tempseries = pd.DataFrame(np.array(tempseries))  # C to K
-            tempseries.replace(-99.0, np.nan)
-            tempdf = tempseries.mean(axis=1, skipna=True)  # axis=1表示按行计算
-            tempdf += 273.15
-            resdf = pd.concat([dataseries,tempdf],axis=1)
-            resdf.columns = ["Date","AvgTmp"]
-            resdf['Date'] = pd.to_datetime(resdf['Date'], format='%Y%j')
+        with open(fpath, "rb") as f:
+            lines = [l for l in f.read().splitlines()[4:] if l.strip()]
+        # fixed width parsing of the whole file: 7 characters of date (YYYYDDD) followed by 5 characters per value
+        width = max(len(l) for l in lines)
+        nval = (width - 7) // 5
+        buf = np.array(lines, dtype="S{}".format(width))
+        chars = buf.view("S1").reshape(len(lines), width)
+        dates = chars[:, :7].copy().view("S7")[:, 0]
+        values = chars[:, 7:7 + nval * 5].copy().view("S5")
+        values = np.where(np.char.strip(values) == b"", b"-99", values).astype(float)
+        values[values == -99.0] = np.nan
+        columns = pd.MultiIndex.from_tuples([(i // 2 + 1, "MAX" if i % 2 == 0 else "MIN") for i in range(nval)],
+                                            names=["STATION", "TYPE"])
+        tmpdf = pd.DataFrame(values, index=pd.to_datetime(dates.astype(str), format='%Y%j'), columns=columns)
+        tmpdf.index.name = "Date"
+        return tmpdf
+
+    def read_TMP(self, tmpdf=None):
+        """
+        read the SWAT temperature file (Tmp1.Tmp) and calculate the basin average air temperature
+
+        Parameters
+        ----------
+        tmpdf : DataFrame, optional
+            the result of read_TMP_stations, to avoid reading the file again.
+
+        Returns
+        -------
+        resdf : DataFrame
+            columns "Date" and "AvgTmp" (K), the average of all stations (missing values excluded).
+
+        """
+        if tmpdf is None:
+            tmpdf = self.read_TMP_stations()
+        resdf = pd.DataFrame({"Date": tmpdf.index, "AvgTmp": tmpdf.mean(axis=1, skipna=True).values + 273.15})
         return resdf
 
+    @staticmethod
+    def station_avg_TMP(tmpdf):
+        """
+        Daily average air temperature (K) of each station, i.e., the average of the max & min temperature.
+
+        Returns
+        -------
+        DataFrame indexed by date, one column per station.
+
+        """
+        return tmpdf.T.groupby(level="STATION").mean().T + 273.15
+
 
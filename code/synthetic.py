@@ -0,0 +1,259 @@
+# Synthetic SWAT/SWAT_LC project generator
+import os
+import datetime
+import numpy as np
+from swat_res import SWATreader
+
+
+"""
+The generated TxtInOut folder only contains the files (and parameters) read by SWAT_LC, the values are random but
+physically plausible, so that the model structure (number of sub-basins, HRUs, pollutants and years) can be scaled
+freely for testing and benchmarking without a real SWAT model. The SWAT_LC files follow the formats of the
+file_templates.
+"""
+
+CIO_SKIP = tuple(range(7)) + (11, 33) + tuple(range(33, 41)) + (45, 47, 53, 57) + tuple(range(62, 73)) + (77,)
+LANDUSES = ["FRST", "WETL", "PAST", "AGRL", "URHD", "BARR"]
+SOILS = ["Dystric Histosols", "Orthic Podzols", "Eutric Cambisols", "Gleyic Luvisols", "WATER"]
+CHUNKROWS = 10000   # max number of rows of the SWAT outputs formatted at once (whole days)
+
+
+def _cio_line(value, key, desc=""):
+    return "{:>16}    | {} : {}\n".format(value, key, desc)
+
+
+def write_cio(path, iyr, nbyr):
+    """
+    Write a file.cio with the layout expected by the SWATreader (title lines at the skipped rows).
+    """
+    idal = 366 if (iyr + nbyr - 1) % 4 == 0 else 365
+    keys = {7: ("NBYR", nbyr), 8: ("IYR", iyr), 9: ("IDAF", 1), 10: ("IDAL", idal), 58: ("IPRINT", 1),
+            59: ("NYSKIP", 0), 78: ("ICALEN", 1)}
+    with open(os.path.join(path, "file.cio"), "w") as f:
+        for i in range(80):
+            if i in CIO_SKIP:
+                f.write("Synthetic SWAT project: file.cio section {}\n".format(i))
+            elif i in keys:
+                f.write(_cio_line(keys[i][1], keys[i][0]))
+            else:
+                f.write(_cio_line(0, "ITEM{}".format(i)))
+    return idal
+
+
+def write_params(fpath, title, params):
+    with open(fpath, "w") as f:
+        f.write(title + "\n")
+        for k, v in params:
+            f.write(_cio_line(v, k))
+
+
+def write_sol(fpath, title, layers):
+    names = ["Depth                [mm]", "Bulk Density Moist [g/cc]", "Ave. AW Incl. Rock Frag",
+             "Ksat. (est.)      [mm/hr]", "Organic Carbon [weight %]", "Rock Fragments   [vol. %]"]
+    with open(fpath, "w") as f:
+        f.write(title + "\n")
+        f.write(" Soil Name: synthetic\n Soil Hydrologic Group: B\n Maximum rooting depth(m) : 1000.00\n")
+        f.write(" Porosity fraction from which anions are excluded: 0.500\n Crack volume potential of soil: 0.500\n")
+        f.write(" Texture 1                : L-L\n")
+        for n, vals in zip(names, layers):
+            f.write(" {}:".format(n) + "".join("{:12.2f}".format(v) for v in vals) + "\n")
+
+
+def _write_fwf(fpath, columns, widths, table, nrows, rowsperday=1, title="Synthetic SWAT output"):
+    """
+    Write a SWAT fixed-width output file (9 header lines) with the column layout used by the SWATreader. The rows are
+    formatted and appended to the file by chunks of days (about CHUNKROWS rows), only the text of one chunk is kept in
+    memory.
+    :param table: dict {column name: array of nrows values}, missing columns are written as 0
+    :param rowsperday: number of rows of each day (HRUs, sub-basins)
+    """
+    fmts = []
+    for c, w in zip(columns, widths):
+        kind = table[c].dtype.kind if c in table else "f"
+        if kind in "US":
+            fmts.append("%-{}s".format(w))
+        elif kind in "iu":
+            fmts.append("%{}d".format(w))
+        else:
+            fmts.append("%{}.3f".format(w))
+    chunkrows = max(1, CHUNKROWS // rowsperday) * rowsperday
+    with open(fpath, "w") as f:
+        for i in range(9):
+            f.write(title + "\n")
+        for r0 in range(0, nrows, chunkrows):
+            r1 = min(r0 + chunkrows, nrows)
+            fields = None
+            for c, fmt in zip(columns, fmts):
+                col = np.char.mod(fmt, table[c][r0:r1] if c in table else np.zeros(r1 - r0))
+                fields = col if fields is None else np.char.add(fields, col)
+            f.write("\n".join(fields.tolist()) + "\n")
+
+
+def generate_project(rootdir, nsub=5, nhru=4, pollutants=("Chrysene", "Napthalene"), nyears=2, iyr=2000, seed=0):
+    """
+    Generate a synthetic SWAT project (TxtInOut) and the SWAT_LC project files.
+    :param rootdir: output folder, the SWAT and SWAT_LC folders are created as rootdir/TxtInOut and rootdir/LC
+    :param nsub: number of sub-basins
+    :param nhru: number of HRUs in each sub-basin
+    :param pollutants: names of the simulated PACs (DOC is always added)
+    :param nyears: number of simulated years
+    :param iyr: starting year
+    :param seed: random seed
+    :return: (SWAT folder, SWAT_LC folder)
+    """
+    rng = np.random.default_rng(seed)
+    swatdir = os.path.join(rootdir, "TxtInOut")
+    lcdir = os.path.join(rootdir, "LC")
+    os.makedirs(swatdir, exist_ok=True)
+    os.makedirs(lcdir, exist_ok=True)
+
+    write_cio(swatdir, iyr, nyears)
+    write_params(os.path.join(swatdir, "basins.bsn"), "Basin data: synthetic", [("SURLAG", "4.000")])
+    dates = [datetime.date(iyr, 1, 1) + datetime.timedelta(days=i)
+             for i in range((datetime.date(iyr + nyears, 1, 1) - datetime.date(iyr, 1, 1)).days)]
+    ndays = len(dates)
+
+    hrus = []
+    gid = 0
+    for s in range(1, nsub + 1):
+        subkm = round(float(rng.uniform(20, 200)), 3)
+        write_params(os.path.join(swatdir, "{:05d}0000.sub".format(s)), " .sub file Subbasin: {}".format(s),
+                     [("SUB_KM", "{:.3f}".format(subkm)), ("CH_L1", "{:.3f}".format(rng.uniform(2, 20))),
+                      ("CH_S1", "{:.3f}".format(rng.uniform(0.001, 0.05))),
+                      ("CH_W1", "{:.3f}".format(rng.uniform(2, 20))), ("CH_N1", "0.014"),
+                      ("IRGAGE", 1), ("ITGAGE", int(rng.integers(1, 3)))])
+        write_params(os.path.join(swatdir, "{:05d}0000.rte".format(s)), " .rte file Subbasin: {}".format(s),
+                     [("CHW2", "{:.3f}".format(rng.uniform(10, 80))), ("CH_D", "2.000"),
+                      ("CH_L2", "{:.3f}".format(rng.uniform(5, 40)))])
+        fracs = rng.dirichlet(np.ones(nhru))
+        for h in range(1, nhru + 1):
+            gid += 1
+            lu = LANDUSES[int(rng.integers(len(LANDUSES)))]
+            soil = SOILS[int(rng.integers(len(SOILS)))]
+            fname = "{:05d}{:04d}".format(s, h)
+            title = " .hru file Watershed HRU:{} Subbasin:{} HRU:{} Luse:{} Soil: {} Slope: 0-9999 1/1/2000".format(
+                gid, s, h, lu, soil)
+            write_params(os.path.join(swatdir, fname + ".hru"), title,
+                         [("HRU_FR", "{:.7f}".format(fracs[h - 1])), ("SLSUBBSN", "{:.3f}".format(rng.uniform(10, 90))),
+                          ("HRU_SLP", "{:.3f}".format(rng.uniform(0.01, 0.3))), ("OV_N", "0.140"),
+                          ("LAT_TTIME", "0.000"), ("SLSOIL", "0.000"), ("SURLAG", "0.000")])
+            write_params(os.path.join(swatdir, fname + ".gw"), " .gw file Watershed HRU:{}".format(gid),
+                         [("SHALLST", "1000.000"), ("GW_DELAY", "{:.3f}".format(rng.uniform(5, 60))),
+                          ("GW_SPYLD", "0.003"), ("RCHRG_DP", "{:.3f}".format(rng.uniform(0.01, 0.2)))])
+            write_sol(os.path.join(swatdir, fname + ".sol"), " .Sol file Watershed HRU:{}".format(gid),
+                      [[300.0, 1000.0], rng.uniform(1.1, 1.6, 2), [0.15, 0.12], rng.uniform(5, 50, 2),
+                       rng.uniform(0.5, 5, 2), rng.uniform(0, 10, 2)])
+            hrus.append((gid, s, lu, subkm * fracs[h - 1]))
+
+    # SWAT outputs (water balance terms)
+    nh = len(hrus)
+    pcp = np.where(rng.random((ndays, nh)) < 0.35, rng.gamma(0.8, 8, (ndays, nh)), 0)
+    smt = np.where(rng.random((ndays, nh)) < 0.05, rng.uniform(0, 5, (ndays, nh)), 0)
+    surq = (pcp + smt) * rng.uniform(0.05, 0.3, (ndays, nh))
+    surqcnt = surq * 0.8
+    perc = (pcp + smt) * rng.uniform(0.0, 0.2, (ndays, nh))
+    latq = (pcp + smt) * rng.uniform(0.0, 0.1, (ndays, nh))
+    latqcnt = latq * 0.9
+    swini = rng.uniform(50, 250, (ndays, nh))
+    swend = swini + rng.uniform(-5, 5, (ndays, nh))
+    gwq = rng.uniform(0, 1.5, (ndays, nh))
+    gwqd = rng.uniform(0, 0.2, (ndays, nh))
+    revap = rng.uniform(0, 0.3, (ndays, nh))
+    sast = rng.uniform(0, 50, (ndays, nh))
+    dast = rng.uniform(0, 500, (ndays, nh))
+    wyld = surqcnt + latqcnt + gwq + gwqd
+    hrucols = {"PRECIPmm": pcp, "SNOMELTmm": smt, "SW_INITmm": swini, "SW_ENDmm": swend, "PERCmm": perc,
+               "GW_RCHGmm": perc, "REVAPmm": revap, "SA_STmm": sast, "DA_STmm": dast, "SURQ_GENmm": surq,
+               "SURQ_CNTmm": surqcnt, "LATQGENmm": latq, "GW_Qmm": gwq, "WYLDmm": wyld, "GW_Q_Dmm": gwqd,
+               "LATQCNTmm": latqcnt}
+    reader = SWATreader(swatdir)
+    months = np.array([d.month for d in dates])
+    days = np.array([d.day for d in dates])
+    years = np.array([d.year for d in dates])
+    gids = np.array([h[0] for h in hrus])
+    hsubs = np.array([h[1] for h in hrus])
+    table = {k: v.flatten() for k, v in hrucols.items()}
+    table.update({"LULC": np.tile([h[2] for h in hrus], ndays), "HRU": np.tile(gids, ndays),
+                  "GIS": np.tile(hsubs * 10000 + gids, ndays), "SUB": np.tile(hsubs, ndays),
+                  "MGT": np.zeros(ndays * nh, dtype=int), "MO": np.repeat(months, nh), "DA": np.repeat(days, nh),
+                  "YR": np.repeat(years, nh), "AREAkm2": np.tile([h[3] for h in hrus], ndays)})
+    _write_fwf(os.path.join(swatdir, "output.hru"), *reader.get_hru_header_width(), table, ndays * nh, nh)
+
+    subids = np.arange(1, nsub + 1)
+    subpcp = rng.gamma(0.8, 8, (ndays, nsub)) * (rng.random((ndays, nsub)) < 0.4)
+    table = {"TYPE": np.full(ndays * nsub, "BIGSUB"), "SUB": np.tile(subids, ndays), "GIS": np.tile(subids, ndays),
+             "MO": np.repeat(months, nsub), "DA": np.repeat(days, nsub), "YR": np.repeat(years, nsub),
+             "AREAkm2": np.full(ndays * nsub, 100.0), "PRECIPmm": subpcp.flatten()}
+    _write_fwf(os.path.join(swatdir, "output.sub"), *reader.get_sub_header_width(), table, ndays * nsub, nsub)
+
+    flow = rng.gamma(2.0, 30, (ndays, nsub))
+    table.update({"TYPE": np.full(ndays * nsub, "REACH "), "RCH": table.pop("SUB"),
+                  "FLOW_INcms": flow.flatten(), "FLOW_OUTcms": flow.flatten()})
+    _write_fwf(os.path.join(swatdir, "output.rch"), *reader.get_rch_header_width(), table, ndays * nsub, nsub)
+
+    nstation = 2
+    tmax = 10 + 15 * np.sin(np.arange(ndays) / 365 * 2 * np.pi)[:, None] + rng.normal(0, 3, (ndays, nstation))
+    tmin = tmax - rng.uniform(5, 12, (ndays, nstation))
+    with open(os.path.join(swatdir, "Tmp1.Tmp"), "w") as f:
+        f.write("Station  tmp1,tmp2\nLati    56.7 57.1\nLong  -111.4-111.6\nElev     300  320\n")
+        for d, date in enumerate(dates):
+            vals = ""
+            for k in range(nstation):
+                mx = -99.0 if rng.random() < 0.01 else tmax[d, k]
+                vals += "{:5.1f}{:5.1f}".format(mx, tmin[d, k])
+            f.write("{}{:03d}".format(date.year, date.timetuple().tm_yday) + vals + "\n")
+
+    # SWAT_LC project files
+    with open(os.path.join(lcdir, "lcproj.sim"), "w") as f:
+        f.write("[General Settings]\nBUMETHOD = 2\nWOMETHOD = 0\nDOCMETHOD = 0\nRIVERFLUX = 1\n")
+        f.write("OUTSTART = {}-01-01\nOUTEND = {}\n".format(iyr, dates[-1].strftime("%Y-%m-%d")))
+        f.write("SCREENSHOW = 0\nHRUOUT = 1\nDOCOUT = 1\nINITYPE = SOIL-LU\nFWATER = WATER\n")
+    with open(os.path.join(lcdir, "lcproj.plt"), "w") as f:
+        f.write("POLLUTANT,hlw,hls,logkoc,logkdoc,cprep,riverflux\n")
+        f.write("DOC,40,500,0.0,0.0,500000,0\n")
+        for p in pollutants:
+            f.write("{},{},{},{:.2f},{:.2f},{:.1f},{:.2f}\n".format(p, int(rng.integers(20, 120)),
+                                                                      int(rng.integers(200, 900)),
+                                                                      rng.uniform(3, 6), rng.uniform(2, 5.5),
+                                                                      rng.uniform(5, 150), rng.uniform(0.5, 50)))
+    with open(os.path.join(lcdir, "lcproj.lu"), "w") as f:
+        f.write("LANDUSE,POLLUTANT,bmax,kbu,nbu,kwov,nwov,kwoh,nwoh\n")
+        for lu in LANDUSES + ["WATR"]:
+            f.write("{},DOC,50,100,2,0.05,1.22,0.02,0.6\n".format(lu))
+            for p in pollutants:
+                f.write("{},{},{:.4f},{},2,{:.3f},1.2,{:.4f},0.8\n".format(lu, p, rng.uniform(0.005, 0.5),
+                                                                           int(rng.integers(100, 600)),
+                                                                           rng.uniform(0.1, 0.9),
+                                                                           rng.uniform(0.001, 0.05)))
+    with open(os.path.join(lcdir, "lcproj.sol"), "w") as f:
+        f.write("SOIL,POLLUTANT,fdoc,cbase,geoflx\n")
+        for s in SOILS:
+            f.write("{},DOC,{:.4f},{:.1f},0\n".format(s, rng.uniform(0.001, 0.01), rng.uniform(1e6, 1e7)))
+            for p in pollutants:
+                f.write("{},{},0,0,{:.1f}\n".format(s, p, rng.uniform(0, 3000)))
+    with open(os.path.join(lcdir, "lcproj.conflict"), "w") as f:
+        f.write("SOIL,LU,RSOIL,RLU\nWATER,ANY,WATER,WATR\n")
+    with open(os.path.join(lcdir, "lcproj.init"), "w") as f:
+        f.write("LANDUSE,SOIL,POLLUTANT,ctsoil\n")
+        for lu in LANDUSES + ["WATR"]:
+            for s in SOILS:
+                for p in pollutants:
+                    f.write("{},{},{},{:.1f}\n".format(lu, s, p, 0 if lu == "WATR" else rng.uniform(100, 9000)))
+    with open(os.path.join(lcdir, "lcproj.usrinit"), "w") as f:
+        f.write("CTLTYPE,ID,POLLUTANT,ctsoil\n")
+        f.write("SUB,1,{},{:.1f}\n".format(pollutants[0], rng.uniform(100, 9000)))
+        f.write("HRU,2,{},{:.1f}\n".format(pollutants[0], rng.uniform(100, 9000)))
+    with open(os.path.join(lcdir, "lcproj.usrlu"), "w") as f:
+        f.write("CTLTYPE,ID,POLLUTANT,bmax,kbu,nbu,kwov,nwov,kwoh,nwoh\n")
+        f.write("SUB,{},{},0.01,300,2,0.8,1.2,0.0003,0.8\n".format(nsub, pollutants[0]))
+        f.write("HRU,1,{},0.02,300,2,0.8,1.2,0.0003,0.8\n".format(pollutants[-1]))
+    with open(os.path.join(lcdir, "lcproj.usrflux"), "w") as f:
+        f.write("RCH,POLLUTANT,cprep,riverflux\n")
+        f.write("1,{},5,2\n".format(pollutants[0]))
+    with open(os.path.join(lcdir, "lcproj.ocp"), "w") as f:
+        f.write("RCH,COCP,POLLUTANT,KOCP,NOCP,QWCR,EA,T0\n")
+        for s in range(1, nsub + 1, 2):
+            for p in pollutants:
+                f.write("{},{:.1f},{},{:.4f},1.6,0.1,60000,278.15\n".format(s, rng.uniform(5, 50), p,
+                                                                            rng.uniform(0.0005, 0.003)))
+    return swatdir, lcdir
@@ -1,4 +1,5 @@
 # Author: Qianyang Wang
+import numpy as np
 
 
 
@@ -9,10 +10,21 @@ def decay(mass, kd):
     :return: the remained mass after the decay process
     """
     mdecay = kd * mass
-    mass -= mdecay
+    mass = mass - mdecay
     return mass
 
 
+def masked_div(num, den, fill=0):
+    """
+    Division that gives fill where the denominator is 0, works with scalars and arrays.
+    :param num: numerator
+    :param den: denominator
+    :param fill: result where den == 0
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den != 0, np.divide(num, den), fill)[()]
+
+
 class Pollutant:
 
     def __init__(self,name):
@@ -60,4 +72,5 @@ class Soil:
         self.name = name
         self.fdoc = {}
         self.cbase = {}
+        self.geoflx = {}
 